@@ -1,25 +1,32 @@
 import os
 import secrets
 import string
+import hmac
+import hashlib
 import csv
 import io
 from datetime import timedelta
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, session as flask_session
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, Response, session as flask_session
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
-import qrcode
-from io import BytesIO
 import base64
 
-from database import init_db, get_db, get_setting, set_setting
+from database import init_db, get_db, get_setting
 from models import User
-from timezone_utils import now as tz_now, format_datetime
+from timezone_utils import format_datetime, format_rows, epoch_ms
+import instrumentation
+import assets
+import compression
+import attachments
+import media
+import bulk
+import jobs
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'change-this-to-a-random-secret-key')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=365)
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
+app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', os.path.join(os.path.dirname(__file__), 'uploads'))
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # Initialize login manager
@@ -27,8 +34,32 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-# Initialize database
-init_db()
+# Per-request SQL/latency instrumentation
+instrumentation.init_app(app)
+
+# Fingerprinted static assets (build with `python assets.py`)
+assets.init_app(app)
+
+# gzip/brotli for HTML, JSON and CSV responses
+compression.init_app(app)
+
+# Content-addressed leave attachments (`flask dedupe-attachments` for old files)
+attachments.init_app(app)
+
+# Resumable background jobs for bulk operations (`flask run-jobs` after a restart)
+jobs.init_app(app)
+
+# Initialize database. This is a single PRAGMA read once the schema is current;
+# under gunicorn.conf.py (preload) it runs once in the master before workers fork.
+# Set INIT_DB_ON_START=0 when migrations run as a separate `flask init-db` step.
+if os.getenv('INIT_DB_ON_START', '1') == '1':
+    init_db()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or migrate the database schema"""
+    init_db()
+    print('数据库已初始化')
 
 # Create upload directory
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -77,30 +108,38 @@ def generate_activity_code():
             return code
         conn.close()
 
-def generate_qr_token():
-    """Generate secure QR token"""
-    return secrets.token_urlsafe(32)
+def generate_qr_token(session_id, slot):
+    """Derive the QR token for a session's rotation slot
+
+    The token is an HMAC of (session, slot) keyed by the app secret, so every
+    screen and worker showing the same session in the same slot agrees on it.
+    """
+    digest = hmac.new(app.config['SECRET_KEY'].encode(),
+                      f'{session_id}:{slot}'.encode(),
+                      hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
 
 @app.route('/')
+@instrumentation.budget(20)
 @login_required
 @password_change_required
 def index():
     """User home page"""
     system_title = get_setting('system_title', '签到系统')
     total_points = current_user.get_points()
-    points_history = current_user.get_points_history()
+    points_history = format_rows(current_user.get_points_history(), 'created_at_ms')
 
     # Get pending leave requests
-    conn = get_db()
+    conn = get_db(readonly=True)
     cursor = conn.cursor()
     cursor.execute('''
         SELECT lr.*, ats.activity_code
         FROM leave_requests lr
         LEFT JOIN attendance_sessions ats ON lr.session_id = ats.id
         WHERE lr.user_id = ?
-        ORDER BY lr.created_at DESC
+        ORDER BY lr.created_at_ms DESC
     ''', (current_user.id,))
-    leave_requests = cursor.fetchall()
+    leave_requests = format_rows(cursor.fetchall(), 'created_at_ms')
     conn.close()
 
     return render_template('index.html',
@@ -190,10 +229,11 @@ def password_changed_rescan():
     return render_template('password_changed_rescan.html', system_title=system_title)
 
 @app.route('/checkin/<qr_token>')
+@instrumentation.budget(24)
 def checkin(qr_token):
     """Check-in via QR code"""
     if not current_user.is_authenticated:
-        return redirect(url_for('login', next=request.url))
+        return redirect(url_for('login', next=request.path))
 
     if current_user.must_change_password:
         flash('请先修改密码', 'warning')
@@ -206,9 +246,9 @@ def checkin(qr_token):
         SELECT qr.*, ats.activity_code
         FROM qr_codes qr
         JOIN attendance_sessions ats ON qr.session_id = ats.id
-        WHERE qr.qr_token = ? AND qr.expires_at > ?
+        WHERE qr.qr_token = ? AND qr.expires_at_ms > ?
         AND ats.is_active = 1
-    ''', (qr_token, tz_now()))
+    ''', (qr_token, epoch_ms()))
     qr_code_row = cursor.fetchone()
 
     if not qr_code_row:
@@ -315,32 +355,54 @@ def request_leave():
             flash('请填写请假原因', 'error')
             return redirect(url_for('request_leave'))
 
+        # Files already sent through the resumable upload API (app_uploads.py), claimed below
+        upload_ids = set(request.form.getlist('upload_ids'))
+        finished = []
+
+        # Hash and spool the uploads before the write transaction starts
+        uploads = [(secure_filename(file.filename), attachments.spool(file.stream))
+                   for file in request.files.getlist('attachments') if file and file.filename]
+
         # Create leave request
         conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO leave_requests (user_id, leave_type, reason, status)
-            VALUES (?, ?, ?, 'pending')
-        ''', (current_user.id, leave_type, reason))
-        leave_request_id = cursor.lastrowid
-
-        # Handle file uploads
-        files = request.files.getlist('attachments')
-        for file in files:
-            if file and file.filename:
-                filename = secure_filename(file.filename)
-                timestamp = tz_now().strftime('%Y%m%d%H%M%S')
-                unique_filename = f"{timestamp}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                file.save(filepath)
-
-                cursor.execute('''
-                    INSERT INTO leave_attachments (leave_request_id, filename, filepath)
-                    VALUES (?, ?, ?)
-                ''', (leave_request_id, filename, filepath))
-
-        conn.commit()
-        conn.close()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            if upload_ids:
+                # Claimed under the write lock: a second submit of the same form finds nothing
+                finished = attachments.claim_uploads(cursor, current_user.id, upload_ids)
+                if finished is None:
+                    conn.rollback()
+                    for _filename, spooled in uploads:
+                        attachments.discard(spooled)
+                    flash('附件上传未完成，请重新上传', 'error')
+                    return redirect(url_for('request_leave'))
+
+            cursor.execute('''
+                INSERT INTO leave_requests (user_id, leave_type, reason, status)
+                VALUES (?, ?, ?, 'pending')
+            ''', (current_user.id, leave_type, reason))
+            leave_request_id = cursor.lastrowid
+
+            for filename, spooled in uploads:
+                attachments.add_attachment(cursor, leave_request_id, filename, spooled)
+                # Previews are generated by media_worker.py, not in this request
+                media.enqueue(cursor, spooled[1])
+            for _upload_id, filename, spooled in finished:
+                # Linked, not moved: a rollback leaves the upload resumable
+                attachments.add_attachment(cursor, leave_request_id, filename, spooled, keep_source=True)
+                media.enqueue(cursor, spooled[1])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            for _filename, spooled in uploads:
+                attachments.discard(spooled)
+            raise
+        finally:
+            conn.close()
+
+        for _upload_id, _filename, spooled in finished:
+            attachments.discard(spooled)
 
         flash('请假申请已提交', 'success')
         return redirect(url_for('index'))
@@ -355,7 +417,7 @@ def admin_dashboard():
     """Admin dashboard"""
     system_title = get_setting('system_title', '签到系统')
 
-    conn = get_db()
+    conn = get_db(readonly=True)
     cursor = conn.cursor()
 
     # Get statistics
@@ -383,7 +445,7 @@ def admin_dashboard():
 def admin_users():
     """Admin user management"""
     system_title = get_setting('system_title', '签到系统')
-    users = User.get_all_users()
+    users = format_rows(User.get_all_users(), 'created_at_ms')
     return render_template('admin/users.html', system_title=system_title, users=users)
 
 @app.route('/admin/users/template')
@@ -464,15 +526,16 @@ def delete_users():
         return redirect(url_for('admin_users'))
 
     conn = get_db()
-    cursor = conn.cursor()
-
-    for user_id in user_ids:
-        cursor.execute('DELETE FROM users WHERE id = ? AND is_admin = 0', (user_id,))
-
-    conn.commit()
-    conn.close()
+    try:
+        counts, cleanup = bulk.delete_users(conn, user_ids)
+    finally:
+        conn.close()
+    # Attachment files are unlinked after the commit, off the request path
+    attachments.release_in_background(cleanup)
 
-    flash(f'成功删除{len(user_ids)}个用户', 'success')
+    flash(f"成功删除{counts['users']}个用户，同时删除签到记录{counts['attendance_records']}条、"
+          f"积分记录{counts['points_records']}条、请假申请{counts['leave_requests']}条、"
+          f"附件{counts['leave_attachments']}个", 'success')
     return redirect(url_for('admin_users'))
 
 @app.route('/admin/users/<int:user_id>/reset-password', methods=['POST'])
@@ -511,12 +574,26 @@ def rename_user(user_id):
 
     return redirect(url_for('admin_users'))
 
+@app.route('/admin/metrics')
+@login_required
+@admin_required
+def admin_metrics():
+    """Prometheus metrics aggregated across all workers"""
+    return Response(instrumentation.render_prometheus(),
+                    mimetype='text/plain; version=0.0.4')
+
 # Import and register additional routes
 from app_attendance import register_attendance_routes
 from app_leave_points import register_leave_points_routes
+from app_groups import register_group_routes
+from app_uploads import register_upload_routes
+from app_jobs import register_job_routes
 
 register_attendance_routes(app, admin_required, password_change_required, generate_activity_code, generate_qr_token)
 register_leave_points_routes(app, admin_required, password_change_required)
+register_group_routes(app, admin_required, password_change_required)
+register_upload_routes(app, password_change_required)
+register_job_routes(app, admin_required, password_change_required)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -1,18 +1,37 @@
 # Attendance management routes (to be imported into app.py)
 
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, send_file
 from flask_login import login_required, current_user
 from datetime import timedelta
-import qrcode
+import time
+import threading
 from io import BytesIO
 import base64
+import csv
+import io
 
-from database import get_db, get_setting
+from database import get_db, get_setting, roster_cte
 from models import User
-from timezone_utils import now as tz_now
+from timezone_utils import now as tz_now, format_rows, epoch_ms
+from instrumentation import timed, budget
+import bulk
+import jobs
+
+# Per-process cache of the current rotation slot for each session:
+# session_id -> {'slot', 'interval', 'url_root', 'qr_image', 'slot_end'}
+# Shared by all threads of a gthread worker, so every access holds the lock.
+_qr_slot_cache = {}
+_qr_slot_lock = threading.Lock()
 
 def generate_qr_code_image(data):
     """Generate QR code image as base64"""
+    with timed('qr_render'):
+        return _render_qr_code_image(data)
+
+def _render_qr_code_image(data):
+    # Imported on first use: qrcode pulls in Pillow, which most workers never need
+    import qrcode
+
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -29,6 +48,12 @@ def generate_qr_code_image(data):
 
     return base64.b64encode(buffer.getvalue()).decode()
 
+# Status column of the attendance CSV: codes or their names
+STATUS_CODES = {
+    '已签到': 'present', '签到': 'present', '已签退': 'present', '签退': 'present',
+    '缺勤': 'absent', '公假': 'public_leave', '事假': 'personal_leave', '病假': 'sick_leave'
+}
+
 def register_attendance_routes(app, admin_required, password_change_required, generate_activity_code, generate_qr_token):
     """Register attendance-related routes"""
 
@@ -40,24 +65,38 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
         """Admin attendance management"""
         system_title = get_setting('system_title', '签到系统')
 
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
         cursor.execute('''
             SELECT ats.*, u.name as created_by_name,
                    COUNT(DISTINCT CASE WHEN ar.status = 'present' THEN ar.id END) as checked_in_count,
-                   (SELECT COUNT(*) FROM users WHERE is_admin = 0) as total_users
+                   CASE WHEN EXISTS (SELECT 1 FROM session_groups sg WHERE sg.session_id = ats.id)
+                        THEN (SELECT COUNT(DISTINCT gm.user_id)
+                              FROM session_groups sg
+                              JOIN group_members gm ON gm.group_id = sg.group_id
+                              WHERE sg.session_id = ats.id)
+                        ELSE (SELECT COUNT(*) FROM users WHERE is_admin = 0)
+                   END as total_users,
+                   (SELECT GROUP_CONCAT(g.name, '、')
+                    FROM session_groups sg
+                    JOIN user_groups g ON g.id = sg.group_id
+                    WHERE sg.session_id = ats.id) as group_names
             FROM attendance_sessions ats
             LEFT JOIN users u ON ats.created_by = u.id
             LEFT JOIN attendance_records ar ON ats.id = ar.session_id
             GROUP BY ats.id
-            ORDER BY ats.created_at DESC
+            ORDER BY ats.created_at_ms DESC
         ''')
-        sessions = cursor.fetchall()
+        sessions = format_rows(cursor.fetchall(), 'created_at_ms')
+
+        cursor.execute('SELECT id, name FROM user_groups ORDER BY name')
+        groups = cursor.fetchall()
         conn.close()
 
         return render_template('admin/attendance.html',
                              system_title=system_title,
-                             sessions=sessions)
+                             sessions=sessions,
+                             groups=groups)
 
     @app.route('/admin/attendance/create', methods=['POST'])
     @login_required
@@ -65,6 +104,7 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
     def create_attendance_session():
         """Create new attendance session"""
         create_checkout = request.form.get('create_checkout') == 'on'
+        group_ids = [int(gid) for gid in request.form.getlist('group_ids') if gid.isdigit()]
 
         # Generate activity code
         activity_code = generate_activity_code()
@@ -77,6 +117,7 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
             VALUES (?, ?, 1, 'checkin')
         ''', (activity_code, current_user.id))
         checkin_session_id = cursor.lastrowid
+        session_ids = [checkin_session_id]
 
         # Create paired checkout session if requested
         if create_checkout:
@@ -88,14 +129,21 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
                 INSERT INTO attendance_sessions (activity_code, created_by, is_active, session_type, paired_session_id)
                 VALUES (?, ?, 1, 'checkout', ?)
             ''', (checkout_code, current_user.id, checkin_session_id))
+            session_ids.append(cursor.lastrowid)
 
-            conn.commit()
-            conn.close()
+        # Bind sessions to the selected groups (paired checkout shares the roster)
+        if group_ids:
+            cursor.executemany('''
+                INSERT OR IGNORE INTO session_groups (session_id, group_id)
+                SELECT ?, id FROM user_groups WHERE id = ?
+            ''', [(sid, gid) for sid in session_ids for gid in group_ids])
+
+        conn.commit()
+        conn.close()
 
+        if create_checkout:
             flash(f'签到活动已创建，活动码：{activity_code}；签退活动已创建，活动码：{checkout_code}', 'success')
         else:
-            conn.commit()
-            conn.close()
             flash(f'签到活动已创建，活动码：{activity_code}', 'success')
 
         return redirect(url_for('admin_attendance'))
@@ -108,7 +156,7 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
         """View attendance records for a session"""
         system_title = get_setting('system_title', '签到系统')
 
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
 
         # Get session info
@@ -132,25 +180,28 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
             JOIN users u ON ar.user_id = u.id
             WHERE ar.session_id = ?
             ORDER BY
-                CASE WHEN ar.checked_in_at IS NULL THEN 1 ELSE 0 END,
-                ar.checked_in_at DESC
+                CASE WHEN ar.checked_in_at_ms IS NULL THEN 1 ELSE 0 END,
+                ar.checked_in_at_ms DESC
         ''', (session_id,))
-        records = cursor.fetchall()
+        records = format_rows(cursor.fetchall(), 'checked_in_at_ms')
 
         # Get users who haven't checked in - 过滤掉已批准请假的用户，与签到显示保持一致
-        cursor.execute('''
+        roster_sql, roster_params = roster_cte(session_id)
+        cursor.execute(roster_sql + '''
             SELECT u.id, u.name, u.student_id
-            FROM users u
-            WHERE u.is_admin = 0
-            AND u.id NOT IN (
-                SELECT ar.user_id FROM attendance_records ar WHERE ar.session_id = ?
+            FROM roster r
+            JOIN users u ON u.id = r.user_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM attendance_records ar
+                WHERE ar.session_id = ? AND ar.user_id = r.user_id
             )
-            AND u.id NOT IN (
-                SELECT lr.user_id FROM leave_requests lr
-                WHERE (lr.session_id = ? OR lr.session_id IS NULL) AND lr.status = 'approved'
+            AND NOT EXISTS (
+                SELECT 1 FROM leave_requests lr
+                WHERE lr.status = 'approved' AND lr.user_id = r.user_id
+                AND (lr.session_id = ? OR lr.session_id IS NULL)
             )
             ORDER BY u.student_id
-        ''', (session_id, session_id))
+        ''', roster_params + (session_id, session_id))
         not_checked_in = cursor.fetchall()
 
         conn.close()
@@ -347,83 +398,123 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
         flash(f'已为 {user["name"]} 添加签到记录：{status_names[status]}', 'success')
         return redirect(url_for('attendance_records', session_id=session_id))
 
-    @app.route('/admin/attendance/<int:session_id>/delete', methods=['POST'])
+    @app.route('/admin/attendance/records/template')
     @login_required
     @admin_required
-    def delete_attendance_session(session_id):
-        """Delete entire attendance session with all related data"""
-        conn = get_db()
-        cursor = conn.cursor()
-
+    def download_attendance_template():
+        """Download CSV template for bulk attendance edits"""
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['学工号', '状态'])
+        writer.writerow(['20230001', '已签到'])
+        writer.writerow(['20230002', '病假'])
+
+        return send_file(
+            io.BytesIO(output.getvalue().encode('utf-8-sig')),
+            mimetype='text/csv',
+            as_attachment=True,
+            download_name='签到记录导入模板.csv'
+        )
+
+    @app.route('/admin/attendance/<int:session_id>/records/bulk', methods=['POST'])
+    @login_required
+    @admin_required
+    def bulk_update_attendance(session_id):
+        """Set the status of many users in a session at once (e.g. paper sign-ins after a QR outage)
+
+        Takes the selected `user_ids` with one `status`, or a CSV `file`
+        (学工号, 状态; the status as a code or its Chinese name). A JSON
+        body takes `changes`: [{student_id or user_id, status}] and gets
+        the counts back.
+        """
+        data = request.get_json(silent=True) if request.is_json else None
+        errors = []
         try:
-            # Get session info
-            cursor.execute('SELECT * FROM attendance_sessions WHERE id = ?', (session_id,))
-            session = cursor.fetchone()
-
-            if not session:
-                flash('签到活动不存在', 'error')
-                return redirect(url_for('admin_attendance'))
+            if data is not None:
+                entries = [(index, change.get('user_id'), change.get('student_id'), change.get('status'))
+                           for index, change in enumerate(data.get('changes') or [], start=1)]
+            elif request.files.get('file') and request.files['file'].filename:
+                stream = io.StringIO(request.files['file'].stream.read().decode('utf-8-sig'))
+                entries = [(line, None, row.get('学工号'), row.get('状态'))
+                           for line, row in enumerate(csv.DictReader(stream), start=2)]
+            else:
+                status = request.form.get('status')
+                entries = [(None, user_id, None, status) for user_id in request.form.getlist('user_ids')]
+        except (AttributeError, UnicodeDecodeError, csv.Error):
+            entries = None
+
+        def respond(summary, status=200):
+            if data is not None:
+                return jsonify(summary), status
+            flash(summary['message'], 'success' if summary['success'] else 'error')
+            for error in summary.get('errors', [])[:10]:
+                flash(f"第{error['line']}行 {error['student_id']}：{error['message']}", 'warning')
+            return redirect(url_for('attendance_records', session_id=session_id))
 
-            session_ids_to_delete = [session_id]
-            session_codes = [session['activity_code']]
-
-            # Find paired session
-            paired_session_id = session['paired_session_id']
-
-            # If this is a checkout session (has paired_session_id), also delete the checkin
-            if paired_session_id:
-                cursor.execute('SELECT activity_code FROM attendance_sessions WHERE id = ?', (paired_session_id,))
-                paired_session = cursor.fetchone()
-                if paired_session:
-                    session_ids_to_delete.append(paired_session_id)
-                    session_codes.append(paired_session['activity_code'])
-
-            # If this is a checkin session, find and delete its paired checkout
-            cursor.execute('SELECT id, activity_code FROM attendance_sessions WHERE paired_session_id = ?', (session_id,))
-            checkout_session = cursor.fetchone()
-            if checkout_session:
-                session_ids_to_delete.append(checkout_session['id'])
-                session_codes.append(checkout_session['activity_code'])
-
-            # Delete all related data for all sessions
-            for sid in session_ids_to_delete:
-                # Soft delete all related points records
-                cursor.execute('''
-                    UPDATE points_records
-                    SET is_deleted = 1
-                    WHERE session_id = ? AND is_deleted = 0
-                ''', (sid,))
+        if not entries:
+            message = '签到数据格式错误' if entries is None else '请选择用户或上传签到文件'
+            return respond({'success': False, 'message': message}, 400)
 
-                # Delete all QR codes for this session
-                cursor.execute('DELETE FROM qr_codes WHERE session_id = ?', (sid,))
+        conn = get_db()
+        try:
+            if not conn.execute('SELECT 1 FROM attendance_sessions WHERE id = ?', (session_id,)).fetchone():
+                return respond({'success': False, 'message': '签到活动不存在'}, 404)
+
+            students = bulk.resolve_students(conn, [student_id for _line, user_id, student_id, _status in entries
+                                                    if student_id and not user_id])
+            changes = []
+            for line, user_id, student_id, status in entries:
+                status = STATUS_CODES.get(str(status or '').strip(), str(status or '').strip())
+                student_id = str(student_id or '').strip()
+                if status not in bulk.ATTENDANCE_EDITS:
+                    errors.append({'line': line, 'student_id': student_id, 'message': '无效的状态'})
+                elif user_id:
+                    changes.append((user_id, status))
+                elif student_id in students:
+                    changes.append((students[student_id]['id'], status))
+                else:
+                    errors.append({'line': line, 'student_id': student_id,
+                                   'message': '学工号不存在' if student_id else '缺少学工号'})
 
-                # Delete all attendance records for this session
-                cursor.execute('DELETE FROM attendance_records WHERE session_id = ?', (sid,))
+            counts = bulk.apply_attendance_changes(conn, session_id, changes, current_user.id) if changes else {
+                'added': 0, 'updated': 0, 'unchanged': 0, 'unknown': 0, 'points_revoked': 0, 'points_added': 0}
+        finally:
+            conn.close()
 
-                # Update leave requests to remove session_id reference
-                cursor.execute('''
-                    UPDATE leave_requests
-                    SET session_id = NULL
-                    WHERE session_id = ?
-                ''', (sid,))
+        message = f"新增签到记录{counts['added']}条，修改{counts['updated']}条"
+        if counts['unchanged']:
+            message += f"，{counts['unchanged']}条状态未改变"
+        if counts['unknown'] or errors:
+            message += f"，{counts['unknown'] + len(errors)}条无效已跳过"
+        return respond({'success': True, 'message': message, 'errors': errors, **counts})
 
-                # Update leave requests to remove paired_session_id reference
-                cursor.execute('''
-                    UPDATE leave_requests
-                    SET paired_session_id = NULL
-                    WHERE paired_session_id = ?
-                ''', (sid,))
+    @app.route('/admin/attendance/<int:session_id>/delete', methods=['POST'])
+    @login_required
+    @admin_required
+    def delete_attendance_session(session_id):
+        """Delete an attendance session (and its paired session) with all related data
 
-                # Delete the session itself
-                cursor.execute('DELETE FROM attendance_sessions WHERE id = ?', (sid,))
+        Runs the chunked delete job inline: the session's rows are found
+        through the session_id indexes, so this is usually one short
+        transaction.
+        """
+        conn = get_db()
+        try:
+            job_id, session_codes = bulk.queue_session_delete(conn, [session_id], created_by=current_user.id)
+            if job_id is None:
+                flash('签到活动不存在', 'error')
+                return redirect(url_for('admin_attendance'))
 
-            conn.commit()
+            job = jobs.run(conn, job_id)
+            if job is None or job['status'] != 'done':
+                # The sessions are already closed; `flask run-jobs` finishes what is left
+                flash(f'删除未完成: {job["error"] if job else "任务正在执行"}', 'error')
+                return redirect(url_for('job_status', job_id=job_id))
 
             if len(session_codes) > 1:
                 flash(f'已删除配对的签到活动（活动码：{", ".join(session_codes)}）', 'success')
             else:
                 flash(f'签到活动（活动码：{session_codes[0]}）已删除', 'success')
-
         except Exception as e:
             conn.rollback()
             flash(f'删除失败: {str(e)}', 'error')
@@ -432,6 +523,43 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
 
         return redirect(url_for('admin_attendance'))
 
+    @app.route('/admin/attendance/delete', methods=['POST'])
+    @login_required
+    @admin_required
+    def delete_attendance_sessions():
+        """Delete the selected sessions, or all sessions created in a date range, as one background job"""
+        session_ids = request.form.getlist('session_ids')
+        start_date = request.form.get('start_date', '').strip()
+        end_date = request.form.get('end_date', '').strip()
+
+        if start_date and end_date:
+            start_ms, end_ms = epoch_ms(start_date), epoch_ms(end_date)
+            if start_ms is None or end_ms is None or start_ms > end_ms:
+                flash('日期范围无效', 'error')
+                return redirect(url_for('admin_attendance'))
+            conn = get_db(readonly=True)
+            session_ids += [row['id'] for row in conn.execute('''
+                SELECT id FROM attendance_sessions WHERE created_at_ms >= ? AND created_at_ms < ?
+            ''', (start_ms, end_ms + 24 * 3600 * 1000))]
+            conn.close()
+
+        if not session_ids:
+            flash('没有要删除的签到活动', 'error')
+            return redirect(url_for('admin_attendance'))
+
+        conn = get_db()
+        try:
+            job_id, session_codes = bulk.queue_session_delete(conn, session_ids, created_by=current_user.id)
+        finally:
+            conn.close()
+        if job_id is None:
+            flash('签到活动不存在', 'error')
+            return redirect(url_for('admin_attendance'))
+
+        jobs.start_in_background(job_id)
+        flash(f'正在删除 {len(session_codes)} 个签到活动，已停止签到', 'success')
+        return redirect(url_for('job_status', job_id=job_id))
+
     @app.route('/admin/attendance/<int:session_id>/end', methods=['POST'])
     @login_required
     @admin_required
@@ -439,12 +567,15 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
         """End attendance session"""
         conn = get_db()
         cursor = conn.cursor()
-
-        # Check for pending leave requests
-        cursor.execute('''
-            SELECT COUNT(*) as count FROM leave_requests
-            WHERE status = 'pending'
-        ''')
+        roster_sql, roster_params = roster_cte(session_id)
+
+        # Check for pending leave requests of the session's members
+        cursor.execute(roster_sql + '''
+            SELECT COUNT(*) as count
+            FROM roster r
+            JOIN leave_requests lr ON lr.user_id = r.user_id
+            WHERE lr.status = 'pending'
+        ''', roster_params)
         pending_count = cursor.fetchone()['count']
 
         if pending_count > 0:
@@ -484,12 +615,13 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
         cursor.execute('UPDATE attendance_sessions SET is_active = 0 WHERE id = ?', (session_id,))
 
         # 获取所有已批准待使用的请假（查找还未关联到签到活动的请假）
-        cursor.execute('''
-            SELECT id, user_id, leave_type
-            FROM leave_requests
-            WHERE status = 'approved' AND session_id IS NULL
-            ORDER BY approved_at
-        ''')
+        cursor.execute(roster_sql + '''
+            SELECT lr.id, lr.user_id, lr.leave_type
+            FROM roster r
+            JOIN leave_requests lr ON lr.user_id = r.user_id
+            WHERE lr.status = 'approved' AND lr.session_id IS NULL
+            ORDER BY lr.approved_at_ms
+        ''', roster_params)
 
         approved_leaves = cursor.fetchall()
 
@@ -539,15 +671,16 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
         absent_count = 0
         used_leave_count = 0
 
-        # 获取所有未完成当前会话的用户
-        cursor.execute('''
+        # 获取名单中所有未完成当前会话的用户
+        cursor.execute(roster_sql + '''
             SELECT u.id, u.name, u.student_id
-            FROM users u
-            WHERE u.is_admin = 0
-            AND u.id NOT IN (
-                SELECT ar.user_id FROM attendance_records ar WHERE ar.session_id = ?
+            FROM roster r
+            JOIN users u ON u.id = r.user_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM attendance_records ar
+                WHERE ar.session_id = ? AND ar.user_id = r.user_id
             )
-        ''', (session_id,))
+        ''', roster_params + (session_id,))
         not_completed_users = cursor.fetchall()
 
         # 处理每个未完成的用户
@@ -728,7 +861,7 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
             return jsonify({'success': False, 'message': '请输入活动码'})
 
         # Verify activity code
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
         cursor.execute('''
             SELECT id, is_active
@@ -754,6 +887,7 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
         })
 
     @app.route('/api/qr/generate/<int:session_id>')
+    @budget(12)
     def generate_qr_api(session_id):
         """Generate new QR code for session"""
         conn = get_db()
@@ -771,33 +905,58 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
             conn.close()
             return jsonify({'success': False, 'message': '签到活动不存在或已结束'})
 
-        # Generate QR token
-        qr_token = generate_qr_token()
-        qr_refresh_interval = int(get_setting('qr_refresh_interval', '15'))
-        expires_at = tz_now() + timedelta(seconds=qr_refresh_interval + 5)
+        # 二维码按会话时间片轮换：同一时间片内所有屏幕/进程得到相同的令牌和图片
+        qr_refresh_interval = max(int(get_setting('qr_refresh_interval', '15')), 1)
+        current_time = time.time()
+        slot = int(current_time // qr_refresh_interval)
+        slot_end = (slot + 1) * qr_refresh_interval
 
-        # Save QR code
-        cursor.execute('''
-            INSERT INTO qr_codes (session_id, qr_token, expires_at)
-            VALUES (?, ?, ?)
-        ''', (session_id, qr_token, expires_at))
-        conn.commit()
-        conn.close()
+        with _qr_slot_lock:
+            cached = _qr_slot_cache.get(session_id)
+        if (cached and cached['slot'] == slot and cached['interval'] == qr_refresh_interval
+                and cached['url_root'] == request.url_root):
+            conn.close()
+            qr_image = cached['qr_image']
+        else:
+            qr_token = generate_qr_token(session_id, slot)
+            expires_at = tz_now() + timedelta(seconds=slot_end - current_time + 5)
+
+            # Only the first screen/worker in a slot actually inserts the token
+            cursor.execute('''
+                INSERT OR IGNORE INTO qr_codes (session_id, qr_token, expires_at)
+                VALUES (?, ?, ?)
+            ''', (session_id, qr_token, expires_at))
+            conn.commit()
+            conn.close()
 
-        # Generate QR code image
-        checkin_url = url_for('checkin', qr_token=qr_token, _external=True)
-        qr_image = generate_qr_code_image(checkin_url)
+            # Generate QR code image
+            checkin_url = url_for('checkin', qr_token=qr_token, _external=True)
+            qr_image = generate_qr_code_image(checkin_url)
+
+            with _qr_slot_lock:
+                # Drop slots that have already rotated out before caching the new one
+                for sid in [sid for sid, entry in _qr_slot_cache.items() if entry['slot_end'] <= current_time]:
+                    del _qr_slot_cache[sid]
+                _qr_slot_cache[session_id] = {
+                    'slot': slot,
+                    'interval': qr_refresh_interval,
+                    'url_root': request.url_root,
+                    'qr_image': qr_image,
+                    'slot_end': slot_end
+                }
 
         return jsonify({
             'success': True,
             'qr_image': qr_image,
-            'refresh_interval': qr_refresh_interval
+            'refresh_interval': qr_refresh_interval,
+            'expires_in': round(slot_end - current_time, 3)
         })
 
     @app.route('/api/qr/status/<int:session_id>')
+    @budget(8)
     def qr_status_api(session_id):
         """Get attendance status for QR display"""
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
 
         # Get session status
@@ -816,28 +975,31 @@ def register_attendance_routes(app, admin_required, password_change_required, ge
 
         # Get checked-in users (only status='present')
         cursor.execute('''
-            SELECT u.id, u.name, u.student_id, ar.checked_in_at
+            SELECT u.id, u.name, u.student_id, ar.checked_in_at, ar.checked_in_at_ms
             FROM attendance_records ar
             JOIN users u ON ar.user_id = u.id
             WHERE ar.session_id = ? AND ar.status = 'present'
-            ORDER BY ar.checked_in_at DESC
+            ORDER BY ar.checked_in_at_ms DESC
         ''', (session_id,))
         checked_in = [dict(row) for row in cursor.fetchall()]
 
         # Get users who haven't checked in (excluding approved leaves)
-        cursor.execute('''
+        roster_sql, roster_params = roster_cte(session_id)
+        cursor.execute(roster_sql + '''
             SELECT u.id, u.name, u.student_id
-            FROM users u
-            WHERE u.is_admin = 0
-            AND u.id NOT IN (
-                SELECT ar.user_id FROM attendance_records ar WHERE ar.session_id = ?
+            FROM roster r
+            JOIN users u ON u.id = r.user_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM attendance_records ar
+                WHERE ar.session_id = ? AND ar.user_id = r.user_id
             )
-            AND u.id NOT IN (
-                SELECT lr.user_id FROM leave_requests lr
-                WHERE (lr.session_id = ? OR lr.session_id IS NULL) AND lr.status = 'approved'
+            AND NOT EXISTS (
+                SELECT 1 FROM leave_requests lr
+                WHERE lr.status = 'approved' AND lr.user_id = r.user_id
+                AND (lr.session_id = ? OR lr.session_id IS NULL)
             )
             ORDER BY u.student_id
-        ''', (session_id, session_id))
+        ''', roster_params + (session_id, session_id))
         not_checked_in = [dict(row) for row in cursor.fetchall()]
 
         conn.close()
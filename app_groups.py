@@ -0,0 +1,169 @@
+# Group (class roster) management routes (to be imported into app.py)
+
+from flask import render_template, request, redirect, url_for, flash
+from flask_login import login_required, current_user
+import sqlite3
+import csv
+import io
+
+from database import get_db, get_setting
+
+def register_group_routes(app, admin_required, password_change_required):
+    """Register group/roster management routes"""
+
+    @app.route('/admin/groups')
+    @login_required
+    @admin_required
+    @password_change_required
+    def admin_groups():
+        """Admin group management"""
+        system_title = get_setting('system_title', '签到系统')
+
+        conn = get_db(readonly=True)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT g.*, COUNT(gm.user_id) as member_count
+            FROM user_groups g
+            LEFT JOIN group_members gm ON gm.group_id = g.id
+            GROUP BY g.id
+            ORDER BY g.name
+        ''')
+        groups = cursor.fetchall()
+        conn.close()
+
+        return render_template('admin/groups.html',
+                             system_title=system_title,
+                             groups=groups)
+
+    @app.route('/admin/groups/create', methods=['POST'])
+    @login_required
+    @admin_required
+    def create_group():
+        """Create new group"""
+        name = request.form.get('name', '').strip()
+        if not name:
+            flash('分组名称不能为空', 'error')
+            return redirect(url_for('admin_groups'))
+
+        conn = get_db()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                INSERT INTO user_groups (name, created_by)
+                VALUES (?, ?)
+            ''', (name, current_user.id))
+            conn.commit()
+            flash(f'分组 {name} 已创建', 'success')
+        except sqlite3.IntegrityError:
+            flash('分组名称已存在', 'error')
+        finally:
+            conn.close()
+
+        return redirect(url_for('admin_groups'))
+
+    @app.route('/admin/groups/<int:group_id>/import', methods=['POST'])
+    @login_required
+    @admin_required
+    def import_group_members(group_id):
+        """Import group members from CSV (学工号 column)"""
+        file = request.files.get('file')
+        if not file or file.filename == '':
+            flash('请选择文件', 'error')
+            return redirect(url_for('admin_groups'))
+
+        if not file.filename.endswith('.csv'):
+            flash('只支持CSV文件', 'error')
+            return redirect(url_for('admin_groups'))
+
+        replace = request.form.get('replace') == 'on'
+
+        try:
+            stream = io.StringIO(file.stream.read().decode('utf-8-sig'))
+            student_ids = []
+            for row in csv.DictReader(stream):
+                student_id = (row.get('学工号') or '').strip()
+                if student_id:
+                    student_ids.append(student_id)
+        except Exception as e:
+            flash(f'导入失败: {str(e)}', 'error')
+            return redirect(url_for('admin_groups'))
+
+        conn = get_db()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT id FROM user_groups WHERE id = ?', (group_id,))
+        if not cursor.fetchone():
+            conn.close()
+            flash('分组不存在', 'error')
+            return redirect(url_for('admin_groups'))
+
+        if replace:
+            cursor.execute('DELETE FROM group_members WHERE group_id = ?', (group_id,))
+
+        # Resolve student ids through the unique index and insert in one pass
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS import_student_ids (student_id TEXT PRIMARY KEY)')
+        cursor.execute('DELETE FROM import_student_ids')
+        cursor.executemany('INSERT OR IGNORE INTO import_student_ids (student_id) VALUES (?)',
+                           [(sid,) for sid in student_ids])
+        cursor.execute('''
+            INSERT OR IGNORE INTO group_members (group_id, user_id)
+            SELECT ?, u.id
+            FROM import_student_ids i
+            JOIN users u ON u.student_id = i.student_id
+            WHERE u.is_admin = 0
+        ''', (group_id,))
+        added_count = cursor.rowcount
+        cursor.execute('''
+            SELECT COUNT(*) as count FROM import_student_ids i
+            WHERE NOT EXISTS (
+                SELECT 1 FROM users u WHERE u.student_id = i.student_id AND u.is_admin = 0
+            )
+        ''')
+        unknown_count = cursor.fetchone()['count']
+        cursor.execute('DELETE FROM import_student_ids')
+
+        conn.commit()
+        conn.close()
+
+        flash(f'成功导入{added_count}名成员', 'success')
+        if unknown_count > 0:
+            flash(f'{unknown_count}个学工号不存在，已跳过', 'warning')
+        return redirect(url_for('admin_groups'))
+
+    @app.route('/admin/groups/<int:group_id>/delete', methods=['POST'])
+    @login_required
+    @admin_required
+    def delete_group(group_id):
+        """Delete group and its memberships
+
+        Refused while any session, ended ones included, is bound to the
+        group: without the binding roster_cte would fall back to every
+        non-admin user for that session.
+        """
+        conn = get_db()
+        cursor = conn.cursor()
+
+        # 活动依赖该分组确定名单，不允许删除
+        cursor.execute('''
+            SELECT COUNT(*) as count, COALESCE(SUM(ats.is_active = 1), 0) as active
+            FROM session_groups sg
+            JOIN attendance_sessions ats ON ats.id = sg.session_id
+            WHERE sg.group_id = ?
+        ''', (group_id,))
+        usage = cursor.fetchone()
+        if usage['active'] > 0:
+            conn.close()
+            flash('该分组仍有进行中的签到活动，无法删除', 'error')
+            return redirect(url_for('admin_groups'))
+        if usage['count'] > 0:
+            conn.close()
+            flash(f'该分组已用于{usage["count"]}个签到活动，删除这些活动后才能删除分组', 'error')
+            return redirect(url_for('admin_groups'))
+
+        cursor.execute('DELETE FROM group_members WHERE group_id = ?', (group_id,))
+        cursor.execute('DELETE FROM user_groups WHERE id = ?', (group_id,))
+        conn.commit()
+        conn.close()
+
+        flash('分组已删除', 'success')
+        return redirect(url_for('admin_groups'))
@@ -0,0 +1,72 @@
+# Background job progress routes (to be imported into app.py)
+#
+#   GET /admin/jobs/<id>    progress page, polls the API below until the job finishes
+#   GET /api/jobs/<id>      status, progress/total and result as JSON
+
+from flask import render_template, jsonify, abort, url_for
+from flask_login import login_required
+
+from database import get_db, get_setting
+from timezone_utils import format_datetime
+import jobs
+
+# kind -> (title, page to return to)
+JOB_KINDS = {
+    'delete_sessions': ('删除签到活动', 'admin_attendance'),
+    'rescore_points': ('重新计算历史积分', 'admin_settings')
+}
+
+
+def _job_state(job):
+    total = job['total'] or 0
+    progress = min(job['progress'], total) if total else job['progress']
+    title = JOB_KINDS.get(job['kind'], (job['kind'], None))[0]
+    if (job['params'] or {}).get('dry_run'):
+        title += '（预览）'
+    return {
+        'success': True,
+        'id': job['id'],
+        'kind': job['kind'],
+        'title': title,
+        'status': job['status'],
+        'progress': progress,
+        'total': total,
+        'percent': 100 if job['status'] == 'done' else (int(progress * 100 / total) if total else 0),
+        'params': job['params'],
+        'result': job['result'],
+        'error': job['error']
+    }
+
+
+def _load_job(job_id):
+    conn = get_db(readonly=True)
+    job = jobs.get(conn, job_id)
+    conn.close()
+    if job is None:
+        abort(404)
+    return job
+
+
+def register_job_routes(app, admin_required, password_change_required):
+    """Register job progress routes"""
+
+    @app.route('/admin/jobs/<int:job_id>')
+    @login_required
+    @admin_required
+    @password_change_required
+    def job_status(job_id):
+        """Progress page of a background job"""
+        job = _load_job(job_id)
+        back_endpoint = JOB_KINDS.get(job['kind'], (None, 'admin_dashboard'))[1]
+        return render_template('admin/job.html',
+                               system_title=get_setting('system_title', '签到系统'),
+                               job=_job_state(job),
+                               created_at=format_datetime(job['created_at_ms']),
+                               back_url=url_for(back_endpoint))
+
+    @app.route('/api/jobs/<int:job_id>')
+    @login_required
+    @admin_required
+    def job_status_api(job_id):
+        """Current state of a background job"""
+        return jsonify(_job_state(_load_job(job_id)))
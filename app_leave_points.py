@@ -4,10 +4,54 @@ from flask import render_template, request, redirect, url_for, flash, jsonify, s
 from flask_login import login_required, current_user
 import csv
 import io
+import os
+import re
 
-from database import get_db, get_setting, set_setting
+from database import get_db, get_setting, set_setting, roster_cte
 from models import User
-from timezone_utils import now as tz_now
+from timezone_utils import now as tz_now, format_rows, epoch_ms
+from instrumentation import budget
+import attachments
+import media
+import bulk
+import jobs
+
+LEAVE_TYPES = {'public': '公假', 'personal': '事假', 'sick': '病假'}
+
+POINTS_CSV_COLUMNS = ['学工号', '分数', '理由']
+
+RESCORE_STATUS_NAMES = {
+    'present': '签到成功', 'absent': '缺勤', 'public_leave': '公假', 'personal_leave': '事假', 'sick_leave': '病假'
+}
+
+
+def _same_number(a, b):
+    try:
+        return float(a) == float(b)
+    except (TypeError, ValueError):
+        return a == b
+
+
+def _read_points_csv(text):
+    """(line, student_id, points, reason) rows of a batch points CSV; line 1 is the header"""
+    return [(line, row.get('学工号'), row.get('分数'), row.get('理由'))
+            for line, row in enumerate(csv.DictReader(io.StringIO(text)), start=2)]
+
+
+def _pending_leaves(cursor, session_id, leave_type=None):
+    """Pending leave requests of the session's members, optionally of one type"""
+    roster_sql, roster_params = roster_cte(session_id)
+    type_filter = 'AND lr.leave_type = ?' if leave_type else ''
+    cursor.execute(roster_sql + f'''
+        SELECT lr.*, u.name as user_name, u.student_id
+        FROM roster r
+        JOIN leave_requests lr ON lr.user_id = r.user_id
+        JOIN users u ON lr.user_id = u.id
+        WHERE lr.status = 'pending' {type_filter}
+        ORDER BY lr.created_at_ms
+    ''', roster_params + ((leave_type,) if leave_type else ()))
+    return cursor.fetchall()
+
 
 def register_leave_points_routes(app, admin_required, password_change_required):
     """Register leave and points management routes"""
@@ -20,7 +64,7 @@ def register_leave_points_routes(app, admin_required, password_change_required):
         """Admin leave management"""
         system_title = get_setting('system_title', '签到系统')
 
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
         cursor.execute('''
             SELECT lr.*, u.name as user_name, u.student_id,
@@ -30,9 +74,9 @@ def register_leave_points_routes(app, admin_required, password_change_required):
             JOIN users u ON lr.user_id = u.id
             LEFT JOIN attendance_sessions ats ON lr.session_id = ats.id
             LEFT JOIN users approver ON lr.approved_by = approver.id
-            ORDER BY lr.created_at DESC
+            ORDER BY lr.created_at_ms DESC
         ''')
-        leave_requests = cursor.fetchall()
+        leave_requests = format_rows(cursor.fetchall(), 'created_at_ms')
         conn.close()
 
         return render_template('admin/leave.html',
@@ -47,7 +91,7 @@ def register_leave_points_routes(app, admin_required, password_change_required):
         """Approve leave requests for a session"""
         system_title = get_setting('system_title', '签到系统')
 
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
 
         # Get session info
@@ -58,40 +102,43 @@ def register_leave_points_routes(app, admin_required, password_change_required):
             flash('签到活动不存在', 'error')
             return redirect(url_for('admin_attendance'))
 
-        # Get pending leave requests
-        cursor.execute('''
-            SELECT lr.*, u.name as user_name, u.student_id
-            FROM leave_requests lr
-            JOIN users u ON lr.user_id = u.id
-            WHERE lr.status = 'pending'
-            ORDER BY lr.created_at
-        ''')
-        pending_requests = cursor.fetchall()
+        pending_requests = _pending_leaves(cursor, session_id)
 
         conn.close()
 
         return render_template('admin/leave_approval.html',
                              system_title=system_title,
                              session=session,
-                             pending_requests=pending_requests)
+                             pending_requests=pending_requests,
+                             leave_types=LEAVE_TYPES)
 
     @app.route('/admin/leave/<int:leave_id>/attachments')
     @login_required
     @admin_required
     def view_leave_attachments(leave_id):
         """View leave request attachments"""
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
         cursor.execute('''
             SELECT * FROM leave_attachments
             WHERE leave_request_id = ?
         ''', (leave_id,))
-        attachments = cursor.fetchall()
+        leave_attachments = cursor.fetchall()
+        ready = media.ready_formats(conn, [att['sha256'] for att in leave_attachments])
         conn.close()
 
+        results = []
+        for att in leave_attachments:
+            item = dict(att)
+            item['download_url'] = url_for('download_leave_attachment', attachment_id=att['id'])
+            item['preview_url'] = url_for('preview_leave_attachment', attachment_id=att['id'])
+            item['thumb_url'] = (url_for('preview_leave_attachment', attachment_id=att['id'], size='thumb')
+                                 if att['sha256'] in ready else None)
+            results.append(item)
+
         return jsonify({
             'success': True,
-            'attachments': [dict(att) for att in attachments]
+            'attachments': results
         })
 
     @app.route('/admin/leave/attachment/<int:attachment_id>')
@@ -99,7 +146,7 @@ def register_leave_points_routes(app, admin_required, password_change_required):
     @admin_required
     def download_leave_attachment(attachment_id):
         """Download leave request attachment"""
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
         cursor.execute('''
             SELECT * FROM leave_attachments
@@ -112,17 +159,49 @@ def register_leave_points_routes(app, admin_required, password_change_required):
             flash('附件不存在', 'error')
             return redirect(url_for('admin_leave'))
 
-        import os
         if not os.path.exists(attachment['filepath']):
             flash('附件文件不存在', 'error')
             return redirect(url_for('admin_leave'))
 
-        return send_file(
+        # Only raster images are shown in the browser (?inline=1); everything else is downloaded
+        inline = attachments.inline_mimetype(attachment['filename']) if request.args.get('inline') == '1' else None
+        return attachments.send_stored_file(
             attachment['filepath'],
-            as_attachment=True,
+            etag=attachment['sha256'],
+            mimetype=inline,
+            as_attachment=inline is None,
             download_name=attachment['filename']
         )
 
+    @app.route('/admin/leave/attachment/<int:attachment_id>/preview')
+    @login_required
+    @admin_required
+    def preview_leave_attachment(attachment_id):
+        """Downscaled preview (?size=thumb for the thumbnail); the original until it is generated"""
+        kind = 'thumb' if request.args.get('size') == 'thumb' else 'preview'
+        conn = get_db(readonly=True)
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, sha256, filename FROM leave_attachments WHERE id = ?', (attachment_id,))
+        attachment = cursor.fetchone()
+        ready = media.ready_formats(conn, [attachment['sha256']]) if attachment else {}
+        conn.close()
+
+        if not attachment:
+            flash('附件不存在', 'error')
+            return redirect(url_for('admin_leave'))
+
+        preview_format = ready.get(attachment['sha256'])
+        if preview_format:
+            path = attachments.preview_path(attachment['sha256'], kind, preview_format)
+            if os.path.exists(path):
+                return attachments.send_stored_file(path, etag=f"{attachment['sha256']}-{kind}",
+                                                    mimetype=media.MIMETYPES[preview_format])
+
+        # Not processed yet: show an image original in the browser, download anything else
+        if attachments.inline_mimetype(attachment['filename']):
+            return redirect(url_for('download_leave_attachment', attachment_id=attachment_id, inline=1))
+        return redirect(url_for('download_leave_attachment', attachment_id=attachment_id))
+
     @app.route('/admin/leave/<int:leave_id>/approve', methods=['POST'])
     @login_required
     @admin_required
@@ -169,15 +248,79 @@ def register_leave_points_routes(app, admin_required, password_change_required):
             return redirect(url_for('admin_leave_approval', session_id=session_id))
         return redirect(url_for('admin_leave'))
 
+    @app.route('/admin/leave/<int:session_id>/approval/bulk', methods=['POST'])
+    @login_required
+    @admin_required
+    def bulk_approve_leave(session_id):
+        """Approve or reject many pending requests of a session's members at once
+
+        Takes `action` plus either `leave_ids` (the selection) or
+        `leave_type` ('all' or one type: every pending request it
+        matches). A JSON body gets a JSON summary; a form post is
+        redirected back to the approval page.
+        """
+        data = request.get_json(silent=True) if request.is_json else None
+        if data is not None:
+            action = data.get('action')
+            leave_ids = data.get('leave_ids') or []
+            leave_type = data.get('leave_type')
+        else:
+            action = request.form.get('action')
+            leave_ids = request.form.getlist('leave_ids')
+            leave_type = request.form.get('leave_type')
+
+        def respond(summary, status=200):
+            if data is not None:
+                return jsonify(summary), status
+            flash(summary['message'], 'success' if summary['success'] else 'error')
+            return redirect(url_for('admin_leave_approval', session_id=session_id))
+
+        if action not in bulk.LEAVE_DECISIONS:
+            return respond({'success': False, 'message': '无效的操作'}, 400)
+        if not leave_ids and leave_type != 'all' and leave_type not in LEAVE_TYPES:
+            return respond({'success': False, 'message': '请选择要审批的请假申请'}, 400)
+
+        conn = get_db()
+        try:
+            cursor = conn.cursor()
+            if not cursor.execute('SELECT 1 FROM attendance_sessions WHERE id = ?', (session_id,)).fetchone():
+                return respond({'success': False, 'message': '签到活动不存在'}, 404)
+
+            # Only the session's own pending requests can be decided from its page
+            pending = _pending_leaves(cursor, session_id, leave_type if leave_type in LEAVE_TYPES else None)
+            targets = [row['id'] for row in pending]
+            if leave_ids:
+                selected = {str(value) for value in leave_ids}
+                targets = [leave_id for leave_id in targets if str(leave_id) in selected]
+
+            updated, skipped = bulk.decide_leaves(conn, targets, action, current_user.id)
+            skipped += len(leave_ids) - len(targets) if leave_ids else 0
+            remaining = len(_pending_leaves(cursor, session_id))
+        finally:
+            conn.close()
+
+        status_text = '批准' if action == 'approve' else '拒绝'
+        message = f'已{status_text} {updated} 条请假申请'
+        if skipped:
+            message += f'，{skipped} 条已被处理或不属于本活动'
+        message += f'，剩余待审批 {remaining} 条'
+        return respond({
+            'success': True,
+            'action': action,
+            'updated': updated,
+            'skipped': skipped,
+            'remaining': remaining,
+            'message': message
+        })
+
     @app.route('/admin/leave/<int:leave_id>/delete', methods=['POST'])
     @login_required
     @admin_required
     def delete_leave(leave_id):
         """Delete entire leave request with all related data"""
-        import os
-
         conn = get_db()
         cursor = conn.cursor()
+        released = None
 
         try:
             # Get leave request
@@ -189,8 +332,8 @@ def register_leave_points_routes(app, admin_required, password_change_required):
                 return redirect(url_for('admin_leave'))
 
             # Get all attachments before deleting
-            cursor.execute('SELECT filepath FROM leave_attachments WHERE leave_request_id = ?', (leave_id,))
-            attachments = cursor.fetchall()
+            cursor.execute('SELECT filepath, sha256 FROM leave_attachments WHERE leave_request_id = ?', (leave_id,))
+            leave_attachments = cursor.fetchall()
 
             # Soft delete related points records
             cursor.execute('''
@@ -199,21 +342,22 @@ def register_leave_points_routes(app, admin_required, password_change_required):
                 WHERE leave_request_id = ?
             ''', (leave_id,))
 
-            # Delete attachments from database (CASCADE will handle this)
-            # But we need to delete physical files first
-            for attachment in attachments:
+            # Files stored before content addressing belong to this request alone
+            for attachment in leave_attachments:
                 filepath = attachment['filepath']
-                if os.path.exists(filepath):
+                if attachment['sha256'] is None and os.path.exists(filepath):
                     try:
                         os.remove(filepath)
                     except Exception as e:
                         # Log error but continue with deletion
                         print(f"Failed to delete file {filepath}: {e}")
 
-            # Delete leave request (CASCADE will delete attachments)
+            # Foreign keys are not enforced, so delete the attachment rows explicitly
+            cursor.execute('DELETE FROM leave_attachments WHERE leave_request_id = ?', (leave_id,))
             cursor.execute('DELETE FROM leave_requests WHERE id = ?', (leave_id,))
 
             conn.commit()
+            released = [attachment['sha256'] for attachment in leave_attachments]
             flash('请假记录已删除', 'success')
 
         except Exception as e:
@@ -222,6 +366,12 @@ def register_leave_points_routes(app, admin_required, password_change_required):
         finally:
             conn.close()
 
+        if released:
+            # Shared blobs are only removed once no other request references them. This runs
+            # after the commit and off the request path, so a failure here cannot be reported
+            # as a failed delete; `flask gc-attachments` removes whatever it leaves behind
+            attachments.release_in_background({'digests': released})
+
         return redirect(url_for('admin_leave'))
 
     @app.route('/admin/attendance/<int:session_id>/manual-status', methods=['POST'])
@@ -272,6 +422,7 @@ def register_leave_points_routes(app, admin_required, password_change_required):
         return redirect(url_for('admin_attendance'))
 
     @app.route('/admin/points')
+    @budget(12)
     @login_required
     @admin_required
     @password_change_required
@@ -279,7 +430,7 @@ def register_leave_points_routes(app, admin_required, password_change_required):
         """Admin points management"""
         system_title = get_setting('system_title', '签到系统')
 
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
 
         # Get all users with their points
@@ -345,6 +496,134 @@ def register_leave_points_routes(app, admin_required, password_change_required):
         flash('积分记录已撤销', 'success')
         return redirect(url_for('admin_points'))
 
+    @app.route('/admin/points/template')
+    @login_required
+    @admin_required
+    def download_points_template():
+        """Download CSV template for batch points adjustments"""
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(POINTS_CSV_COLUMNS)
+        writer.writerow(['20230001', '2', '竞赛获奖'])
+        writer.writerow(['20230002', '-1', '违反纪律'])
+
+        return send_file(
+            io.BytesIO(output.getvalue().encode('utf-8-sig')),
+            mimetype='text/csv',
+            as_attachment=True,
+            download_name='积分调整模板.csv'
+        )
+
+    @app.route('/admin/points/batch', methods=['POST'])
+    @login_required
+    @admin_required
+    @password_change_required
+    def batch_points():
+        """Add or deduct points for many students at once
+
+        Input is a CSV (学工号, 分数, 理由) uploaded as `file` or sent as
+        `csv_text`, or the selected `student_ids` with one `points` and
+        `reason`. A JSON body takes `entries` ([{student_id, points,
+        reason}]) or `student_ids` + `points` + `reason`. With `dry_run`
+        nothing is written: forms get a preview page whose confirm button
+        posts the same rows again, JSON callers get the plan.
+        """
+        data = request.get_json(silent=True) if request.is_json else None
+        try:
+            if data is not None:
+                dry_run = bool(data.get('dry_run'))
+                rows = [(index, entry.get('student_id'), entry.get('points'), entry.get('reason'))
+                        for index, entry in enumerate(data.get('entries') or [], start=1)]
+                rows += [(None, student_id, data.get('points'), data.get('reason'))
+                         for student_id in data.get('student_ids') or []]
+            else:
+                dry_run = request.form.get('dry_run') == '1'
+                file = request.files.get('file')
+                if file and file.filename:
+                    rows = _read_points_csv(file.stream.read().decode('utf-8-sig'))
+                elif request.form.get('csv_text'):
+                    rows = _read_points_csv(request.form['csv_text'])
+                else:
+                    rows = [(None, student_id, request.form.get('points'), request.form.get('reason'))
+                            for student_id in request.form.getlist('student_ids')]
+        except (AttributeError, UnicodeDecodeError, csv.Error):
+            rows = None
+
+        if not rows:
+            message = '积分数据格式错误' if rows is None else '请选择学生或上传积分文件'
+            if data is not None:
+                return jsonify({'success': False, 'message': message}), 400
+            flash(message, 'error')
+            return redirect(url_for('admin_points'))
+
+        conn = get_db()
+        try:
+            entries, errors = bulk.plan_points(conn, rows)
+            added = 0 if dry_run else bulk.add_points(conn, entries, current_user.id)
+        finally:
+            conn.close()
+
+        if data is not None:
+            return jsonify({
+                'success': True,
+                'dry_run': dry_run,
+                'added': added,
+                'total_points': round(sum(entry['points'] for entry in entries), 2),
+                'entries': entries,
+                'errors': errors
+            })
+
+        if dry_run:
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(POINTS_CSV_COLUMNS)
+            for entry in entries:
+                writer.writerow([entry['student_id'], entry['points'], entry['reason']])
+            return render_template('admin/points_preview.html',
+                                   system_title=get_setting('system_title', '签到系统'),
+                                   entries=entries,
+                                   errors=errors,
+                                   total_points=sum(entry['points'] for entry in entries),
+                                   csv_text=output.getvalue())
+
+        flash(f'已为{added}条记录调整积分', 'success')
+        if errors:
+            flash(f'{len(errors)}条记录有误，已跳过', 'warning')
+        return redirect(url_for('admin_points'))
+
+    @app.route('/admin/points/revoke', methods=['POST'])
+    @login_required
+    @admin_required
+    def batch_revoke_points():
+        """Revoke many manual points records by id (`record_ids`: a list, or ids separated by spaces/commas)"""
+        data = request.get_json(silent=True) if request.is_json else None
+        if data is not None:
+            record_ids = data.get('record_ids') or []
+        else:
+            record_ids = []
+            for value in request.form.getlist('record_ids'):
+                record_ids += re.split(r'[\s,，]+', value)
+        record_ids = [value for value in record_ids if str(value).strip()]
+
+        if not record_ids:
+            if data is not None:
+                return jsonify({'success': False, 'message': '请填写要撤销的记录编号'}), 400
+            flash('请填写要撤销的记录编号', 'error')
+            return redirect(url_for('admin_points'))
+
+        conn = get_db()
+        try:
+            revoked, skipped = bulk.revoke_points(conn, record_ids)
+        finally:
+            conn.close()
+
+        if data is not None:
+            return jsonify({'success': True, 'revoked': revoked, 'skipped': skipped})
+        flash(f'已撤销{revoked}条积分记录', 'success')
+        if skipped:
+            flash(f'{skipped}条记录不存在、已撤销或不是手动调整，已跳过', 'warning')
+        return redirect(url_for('admin_points'))
+
     @app.route('/admin/points/user/<int:user_id>')
     @login_required
     @admin_required
@@ -363,16 +642,17 @@ def register_leave_points_routes(app, admin_required, password_change_required):
                 'name': user.name,
                 'student_id': user.student_id
             },
-            'points_history': [dict(record) for record in points_history],
+            'points_history': format_rows(points_history, 'created_at_ms'),
             'total_points': user.get_points()
         })
 
     @app.route('/admin/export/leave-history')
+    @budget(10)
     @login_required
     @admin_required
     def export_leave_history():
         """Export leave history and points"""
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
 
         # Get all users with their points breakdown
@@ -437,6 +717,8 @@ def register_leave_points_routes(app, admin_required, password_change_required):
         system_title = get_setting('system_title', '签到系统')
 
         if request.method == 'POST':
+            previous = {status: get_setting(key, default)
+                        for status, (key, default, *_rest) in bulk.RESCORE_STATUSES.items()}
             # Update settings
             set_setting('system_title', request.form.get('system_title', '签到系统'))
             set_setting('qr_refresh_interval', request.form.get('qr_refresh_interval', '15'))
@@ -446,8 +728,11 @@ def register_leave_points_routes(app, admin_required, password_change_required):
             set_setting('sick_leave_points', request.form.get('sick_leave_points', '-0.5'))
             set_setting('absent_points', request.form.get('absent_points', '-2'))
 
-            flash('设置已保存', 'success')
-            return redirect(url_for('admin_settings'))
+            # Point values that changed are offered for re-scoring past sessions
+            changed = {f'was_{status}': value for status, value in previous.items()
+                       if not _same_number(value, get_setting(bulk.RESCORE_STATUSES[status][0], value))}
+            flash('设置已保存' + ('，分值的修改只影响之后的活动，可在下方重新计算历史积分' if changed else ''), 'success')
+            return redirect(url_for('admin_settings', **changed))
 
         settings = {
             'system_title': get_setting('system_title', '签到系统'),
@@ -459,6 +744,106 @@ def register_leave_points_routes(app, admin_required, password_change_required):
             'absent_points': get_setting('absent_points', '-2')
         }
 
+        rescore = [(status, key, request.args.get(f'was_{status}'))
+                   for status, (key, *_rest) in bulk.RESCORE_STATUSES.items()]
+
         return render_template('admin/settings.html',
                              system_title=system_title,
-                             settings=settings)
+                             settings=settings,
+                             rescore=rescore,
+                             status_names=RESCORE_STATUS_NAMES)
+
+    @app.route('/admin/points/rescore', methods=['POST'])
+    @login_required
+    @admin_required
+    @password_change_required
+    def queue_points_rescore():
+        """Preview re-scoring past sessions with the current point values
+
+        The sessions are those created in a date range (`start_date`,
+        `end_date`), an id range (`first_session_id`, `last_session_id`) or
+        the listed `session_ids`. For each selected status the form gives
+        the value the sessions were scored with (`previous_<status>`). The
+        preview runs as a background job whose page shows the difference
+        and can apply it.
+        """
+        values = {}
+        for status in request.form.getlist('statuses'):
+            if status not in bulk.RESCORE_STATUSES:
+                continue
+            key, default = bulk.RESCORE_STATUSES[status][:2]
+            try:
+                values[status] = (float(request.form.get(f'previous_{status}', '')), float(get_setting(key, default)))
+            except ValueError:
+                flash(f'{RESCORE_STATUS_NAMES[status]}的原分值无效', 'error')
+                return redirect(url_for('admin_settings'))
+        if not values:
+            flash('请选择要重新计算的分值', 'error')
+            return redirect(url_for('admin_settings'))
+
+        start_date = request.form.get('start_date', '').strip()
+        end_date = request.form.get('end_date', '').strip()
+        first_id = request.form.get('first_session_id', '').strip()
+        last_id = request.form.get('last_session_id', '').strip()
+        session_ids = request.form.getlist('session_ids')
+        if start_date or end_date:
+            start_ms, end_ms = epoch_ms(start_date), epoch_ms(end_date)
+            if start_ms is None or end_ms is None or start_ms > end_ms:
+                flash('日期范围无效', 'error')
+                return redirect(url_for('admin_settings'))
+            query = 'SELECT id FROM attendance_sessions WHERE created_at_ms >= ? AND created_at_ms < ?'
+            query_params = (start_ms, end_ms + 24 * 3600 * 1000)
+            label = f'{start_date} 至 {end_date}'
+        elif first_id or last_id:
+            if not (first_id.isdigit() and last_id.isdigit()) or int(first_id) > int(last_id):
+                flash('活动编号范围无效', 'error')
+                return redirect(url_for('admin_settings'))
+            query = 'SELECT id FROM attendance_sessions WHERE id BETWEEN ? AND ?'
+            query_params = (int(first_id), int(last_id))
+            label = f'活动编号 {first_id} 至 {last_id}'
+        elif session_ids:
+            query, query_params, label = None, (), f'选中的 {len(session_ids)} 个活动'
+        else:
+            flash('请选择日期范围或活动编号范围', 'error')
+            return redirect(url_for('admin_settings'))
+
+        conn = get_db()
+        try:
+            if query:
+                session_ids = [row['id'] for row in conn.execute(query, query_params)]
+            job_id = bulk.queue_rescore(conn, session_ids, values, dry_run=True, created_by=current_user.id,
+                                        label=label)
+        finally:
+            conn.close()
+        if job_id is None:
+            flash('所选范围内没有签到活动', 'error')
+            return redirect(url_for('admin_settings'))
+
+        jobs.start_in_background(job_id)
+        return redirect(url_for('job_status', job_id=job_id))
+
+    @app.route('/admin/points/rescore/<int:job_id>/apply', methods=['POST'])
+    @login_required
+    @admin_required
+    @password_change_required
+    def apply_points_rescore(job_id):
+        """Re-score for real what a finished preview job reported, with the values it used"""
+        conn = get_db()
+        try:
+            preview = jobs.get(conn, job_id)
+            if (preview is None or preview['kind'] != 'rescore_points' or not preview['params']['dry_run']
+                    or preview['status'] != 'done'):
+                flash('预览不存在或尚未完成', 'error')
+                return redirect(url_for('admin_settings'))
+            params = preview['params']
+            new_job_id = bulk.queue_rescore(conn, params['session_ids'], params['values'], dry_run=False,
+                                            created_by=current_user.id, label=params['label'])
+        finally:
+            conn.close()
+        if new_job_id is None:
+            flash('签到活动已被删除', 'error')
+            return redirect(url_for('admin_settings'))
+
+        jobs.start_in_background(new_job_id)
+        flash('正在重新计算历史积分', 'success')
+        return redirect(url_for('job_status', job_id=new_job_id))
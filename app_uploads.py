@@ -0,0 +1,190 @@
+# Resumable chunked upload routes for leave attachments (to be imported into app.py)
+#
+#   POST   /api/uploads                  {filename, size, sha256} -> upload id and offset to continue from
+#   PUT    /api/uploads/<id>?offset=N    raw chunk body, appended at N
+#   GET    /api/uploads/<id>             current offset (after a dropped connection)
+#   POST   /api/uploads/<id>/finalize    verify the SHA-256; the id can then be attached by /leave/request
+#   DELETE /api/uploads/<id>             cancel
+#
+# Each request is short (one chunk), so a slow mobile upload never holds a
+# worker for its whole duration, and a dropped connection only loses the
+# chunk in flight.
+
+from flask import request, jsonify
+from flask_login import login_required, current_user
+from werkzeug.utils import secure_filename
+import os
+import re
+import secrets
+
+from database import get_db
+from timezone_utils import epoch_ms
+import attachments
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def _upload_state(row):
+    return {
+        'success': True,
+        'upload_id': row['id'],
+        'filename': row['filename'],
+        'size': row['size'],
+        'offset': row['received'],
+        'status': row['status'],
+        'chunk_size': attachments.UPLOAD_CHUNK_SIZE
+    }
+
+
+def _get_upload(upload_id):
+    conn = get_db(readonly=True)
+    row = conn.execute('SELECT * FROM upload_sessions WHERE id = ? AND user_id = ?',
+                       (upload_id, current_user.id)).fetchone()
+    conn.close()
+    return row
+
+
+def register_upload_routes(app, password_change_required):
+    """Register resumable upload routes"""
+
+    @app.route('/api/uploads', methods=['POST'])
+    @login_required
+    @password_change_required
+    def init_upload():
+        """Start an upload, or resume the caller's unfinished upload of the same file"""
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(str(data.get('filename') or ''))
+        digest = str(data.get('sha256') or '').lower()
+        size = data.get('size')
+
+        if not filename or not SHA256_RE.match(digest) or not isinstance(size, int) or size <= 0:
+            return jsonify({'success': False, 'message': '上传参数无效'}), 400
+        if size > attachments.UPLOAD_MAX_SIZE:
+            return jsonify({'success': False, 'message': '文件过大'}), 413
+
+        conn = get_db()
+        try:
+            existing = conn.execute('''
+                SELECT * FROM upload_sessions WHERE user_id = ? AND sha256 = ? AND size = ?
+                ORDER BY updated_at_ms DESC LIMIT 1
+            ''', (current_user.id, digest, size)).fetchone()
+            if existing is not None:
+                path = attachments.part_path(existing['id'])
+                if existing['received'] == 0 or os.path.exists(path):
+                    return jsonify(_upload_state(existing))
+                # Its data is gone (attached by a request that failed); start over
+                conn.execute('DELETE FROM upload_sessions WHERE id = ?', (existing['id'],))
+
+            now_ms = epoch_ms()
+            upload_id = secrets.token_hex(16)
+            conn.execute('''
+                INSERT INTO upload_sessions (id, user_id, filename, size, sha256, created_at_ms, updated_at_ms)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (upload_id, current_user.id, filename, size, digest, now_ms, now_ms))
+            conn.commit()
+            row = conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+        finally:
+            conn.close()
+        return jsonify(_upload_state(row)), 201
+
+    @app.route('/api/uploads/<upload_id>', methods=['GET'])
+    @login_required
+    @password_change_required
+    def upload_status(upload_id):
+        """Where to continue an upload"""
+        row = _get_upload(upload_id)
+        if row is None:
+            return jsonify({'success': False, 'message': '上传不存在'}), 404
+        return jsonify(_upload_state(row))
+
+    @app.route('/api/uploads/<upload_id>', methods=['PUT'])
+    @login_required
+    @password_change_required
+    def put_upload_chunk(upload_id):
+        """Write one chunk; the body is streamed to disk, never held in memory"""
+        row = _get_upload(upload_id)
+        if row is None:
+            return jsonify({'success': False, 'message': '上传不存在'}), 404
+        if row['status'] != 'open':
+            return jsonify({'success': False, 'message': '上传已完成', 'offset': row['received']}), 409
+
+        offset = request.args.get('offset', type=int)
+        if offset != row['received']:
+            # The client's idea of the offset is stale (e.g. a retried chunk); tell it where to continue
+            return jsonify({'success': False, 'message': '上传位置不一致', 'offset': row['received']}), 409
+
+        limit = min(row['size'] - offset, attachments.UPLOAD_CHUNK_SIZE)
+        if not request.content_length or request.content_length > limit:
+            return jsonify({'success': False, 'message': '分片大小无效'}), 400
+        try:
+            written = attachments.write_chunk(attachments.part_path(upload_id), offset, request.stream, limit)
+        except ValueError:
+            return jsonify({'success': False, 'message': '分片大小无效'}), 400
+
+        # A body cut short by a dropped connection still counts; the client resumes after it
+        conn = get_db()
+        try:
+            cursor = conn.execute('''
+                UPDATE upload_sessions SET received = ?, updated_at_ms = ?
+                WHERE id = ? AND received = ? AND status = 'open'
+            ''', (offset + written, epoch_ms(), upload_id, offset))
+            conn.commit()
+            row = conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+        finally:
+            conn.close()
+        if cursor.rowcount == 0:
+            return jsonify({'success': False, 'message': '上传位置不一致', 'offset': row['received']}), 409
+        return jsonify(_upload_state(row))
+
+    @app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+    @login_required
+    @password_change_required
+    def finalize_upload(upload_id):
+        """Check the received file against the declared SHA-256"""
+        row = _get_upload(upload_id)
+        if row is None:
+            return jsonify({'success': False, 'message': '上传不存在'}), 404
+        if row['status'] == 'complete':
+            return jsonify(_upload_state(row))
+        if row['received'] != row['size']:
+            return jsonify({'success': False, 'message': '文件尚未上传完整', 'offset': row['received']}), 409
+
+        path = attachments.part_path(upload_id)
+        verified = os.path.exists(path) and attachments.file_sha256(path) == row['sha256']
+        conn = get_db()
+        try:
+            if not verified:
+                if os.path.exists(path):
+                    os.remove(path)
+                conn.execute('UPDATE upload_sessions SET received = 0, updated_at_ms = ? WHERE id = ?',
+                             (epoch_ms(), upload_id))
+            else:
+                conn.execute('''
+                    UPDATE upload_sessions SET status = 'complete', updated_at_ms = ? WHERE id = ?
+                ''', (epoch_ms(), upload_id))
+            conn.commit()
+            row = conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+        finally:
+            conn.close()
+        if not verified:
+            return jsonify({'success': False, 'message': '文件校验失败，请重新上传', 'offset': 0}), 422
+        return jsonify(_upload_state(row))
+
+    @app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+    @login_required
+    @password_change_required
+    def cancel_upload(upload_id):
+        """Discard an upload that will not be attached"""
+        conn = get_db()
+        try:
+            cursor = conn.execute('DELETE FROM upload_sessions WHERE id = ? AND user_id = ?',
+                                  (upload_id, current_user.id))
+            conn.commit()
+        finally:
+            conn.close()
+        if cursor.rowcount == 0:
+            return jsonify({'success': False, 'message': '上传不存在'}), 404
+        path = attachments.part_path(upload_id)
+        if os.path.exists(path):
+            os.remove(path)
+        return jsonify({'success': True})
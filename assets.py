@@ -0,0 +1,126 @@
+"""
+Static asset pipeline
+
+`python assets.py` copies every file under static/css and static/js to
+static/dist with a content hash in its name, writes gzip (and brotli, if
+the `brotli` package is installed) variants next to it, and records the
+mapping in static/dist/manifest.json. Templates resolve URLs with
+`asset_url('css/base.css')`; hashed files are served from /assets/ with
+immutable cache headers. Without a build the helper falls back to the
+plain /static/ files so development works unchanged.
+"""
+import os
+import sys
+import json
+import gzip
+import shutil
+import hashlib
+import mimetypes
+
+from flask import request, send_from_directory, url_for, abort
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+SOURCE_DIRS = ('css', 'js')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+_manifest = {}
+_hashed_files = set()
+
+
+def build(static_dir=STATIC_DIR, dist_dir=None):
+    """Fingerprint and precompress the static sources; returns the manifest"""
+    dist_dir = dist_dir or os.path.join(static_dir, 'dist')
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+
+    manifest = {}
+    for source_dir in SOURCE_DIRS:
+        root = os.path.join(static_dir, source_dir)
+        if not os.path.isdir(root):
+            continue
+        for dirpath, _dirnames, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                source = os.path.join(dirpath, filename)
+                logical = os.path.relpath(source, static_dir).replace(os.sep, '/')
+                with open(source, 'rb') as f:
+                    content = f.read()
+                digest = hashlib.sha256(content).hexdigest()[:12]
+                stem, ext = os.path.splitext(logical)
+                hashed = f'{stem}.{digest}{ext}'
+                target = os.path.join(dist_dir, hashed)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, 'wb') as f:
+                    f.write(content)
+                # mtime=0 keeps the .gz byte-identical across builds
+                with open(target + '.gz', 'wb') as f:
+                    f.write(gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(target + '.br', 'wb') as f:
+                        f.write(brotli.compress(content, quality=11))
+                manifest[logical] = hashed
+
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def asset_url(logical):
+    """URL of a static asset, fingerprinted when the build output exists"""
+    hashed = _manifest.get(logical)
+    if hashed:
+        return url_for('asset', filename=hashed)
+    return url_for('static', filename=logical)
+
+
+def serve_asset(filename):
+    """Serve a fingerprinted file, preferring a precompressed variant the client accepts"""
+    if filename not in _hashed_files:
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if candidate in request.accept_encodings and os.path.exists(os.path.join(DIST_DIR, filename + suffix)):
+            encoding = candidate
+            filename += suffix
+            break
+
+    response = send_from_directory(DIST_DIR, filename, mimetype=mimetype, max_age=31536000)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    """Load the manifest and register the asset route and template helper"""
+    _manifest.clear()
+    _manifest.update(load_manifest())
+    _hashed_files.clear()
+    _hashed_files.update(_manifest.values())
+    app.add_url_rule('/assets/<path:filename>', 'asset', serve_asset)
+    app.add_template_global(asset_url)
+
+
+if __name__ == '__main__':
+    result = build()
+    for logical, hashed in sorted(result.items()):
+        print(f'{logical} -> dist/{hashed}')
+    if brotli is None:
+        print('brotli not installed, only gzip variants were written', file=sys.stderr)
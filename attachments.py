@@ -0,0 +1,441 @@
+"""
+Content-addressed storage for leave attachments
+
+Uploads are streamed to a temporary file while their SHA-256 is
+computed, then stored once under `<UPLOAD_FOLDER>/blobs/ab/cd/<sha256>`.
+Each leave_attachments row records the hash of the blob it points to, so
+the same file submitted many times takes disk space once; a blob is
+unlinked only when the last row referencing it is deleted.
+
+Both placing a blob (add_attachment) and removing one (release_blobs)
+happen while the connection holds SQLite's write lock, so an upload can
+never reference a blob that a concurrent delete is about to unlink.
+
+Previews and thumbnails generated from a blob (media.py) live under
+`<UPLOAD_FOLDER>/previews/ab/` and are removed together with it.
+
+Files stored before this module existed (sha256 NULL) keep their own
+path until `flask --app app dedupe-attachments` moves them into the store.
+
+Large files can also arrive in chunks through the resumable upload API
+(app_uploads.py): chunks are appended to `blobs/tmp/<upload id>.part`,
+the finished file is checked against the SHA-256 the client declared.
+The leave form claims it under the write lock (claim_uploads) and links
+it into the store; the .part file is removed only after the commit, so a
+failed submit leaves the upload ready to attach again.
+
+send_stored_file() delivers stored files: streamed by the worker with
+ETag/Last-Modified, 304 and Range support, or handed to the front proxy
+with X-Accel-Redirect (nginx) / X-Sendfile (Apache, lighttpd) so the
+worker is free as soon as the headers are sent.
+"""
+import os
+import shutil
+import hashlib
+import mimetypes
+import tempfile
+import threading
+from urllib.parse import quote
+
+from flask import current_app, request
+from werkzeug.utils import send_file
+
+from timezone_utils import epoch_ms
+
+CHUNK_SIZE = 64 * 1024
+BLOB_DIR = 'blobs'
+PREVIEW_DIR = 'previews'
+
+# 'python' streams files from the worker; 'x-accel' and 'x-sendfile' let the front proxy do it
+ATTACHMENT_DELIVERY = os.getenv('ATTACHMENT_DELIVERY', 'python').lower()
+# nginx `internal` location that maps to UPLOAD_FOLDER (x-accel only)
+ATTACHMENT_ACCEL_PREFIX = os.getenv('ATTACHMENT_ACCEL_PREFIX', '/protected-uploads/')
+# Browser cache lifetime of attachments; they are only ever cached privately
+ATTACHMENT_MAX_AGE = int(os.getenv('ATTACHMENT_MAX_AGE', '3600'))
+if ATTACHMENT_DELIVERY not in ('python', 'x-accel', 'x-sendfile'):
+    raise ValueError('ATTACHMENT_DELIVERY must be one of: python, x-accel, x-sendfile')
+
+# Resumable uploads: largest file, largest chunk per request, and how long an unattached upload is kept
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', str(64 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+UPLOAD_EXPIRE_HOURS = int(os.getenv('UPLOAD_EXPIRE_HOURS', '24'))
+
+# Blobs checked per write transaction when many are released at once
+RELEASE_BATCH_SIZE = int(os.getenv('ATTACHMENT_RELEASE_BATCH', '200'))
+
+
+def store_root(upload_folder=None):
+    return os.path.join(upload_folder or current_app.config['UPLOAD_FOLDER'], BLOB_DIR)
+
+
+def blob_path(digest, upload_folder=None):
+    """Sharded location of a blob: two directory levels keep directories small"""
+    return os.path.join(store_root(upload_folder), digest[:2], digest[2:4], digest)
+
+
+def preview_path(digest, kind, fmt, upload_folder=None):
+    """Location of a preview ('preview' or 'thumb') generated from a blob"""
+    root = upload_folder or current_app.config['UPLOAD_FOLDER']
+    return os.path.join(root, PREVIEW_DIR, digest[:2], f'{digest}.{kind}.{fmt}')
+
+
+# Raster image types a browser may render inline; anything else (HTML, SVG,
+# XML, PDF...) could run script on the app's origin and is only downloaded
+INLINE_MIMETYPES = frozenset({'image/jpeg', 'image/png', 'image/gif', 'image/webp'})
+
+
+def inline_mimetype(filename):
+    """The mimetype to show a file inline with, or None if it must be downloaded"""
+    mimetype = mimetypes.guess_type(filename or '')[0]
+    return mimetype if mimetype in INLINE_MIMETYPES else None
+
+
+def send_stored_file(path, etag=None, mimetype=None, download_name=None, as_attachment=False):
+    """Response for a file under UPLOAD_FOLDER according to ATTACHMENT_DELIVERY
+
+    etag should identify the content (the blob's SHA-256); without one it
+    is derived from the file's mtime and size.
+    """
+    offload = ATTACHMENT_DELIVERY != 'python'
+    response = send_file(path, request.environ, mimetype=mimetype, as_attachment=as_attachment,
+                         download_name=download_name, conditional=not offload, etag=etag or True,
+                         max_age=ATTACHMENT_MAX_AGE, use_x_sendfile=offload,
+                         response_class=current_app.response_class)
+    # Admin-only content: the browser may keep it, shared caches must not
+    response.cache_control.public = None
+    response.cache_control.private = True
+    # Uploaded content: never let the browser guess a renderable type
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+
+    if not offload:
+        # Advertise resumable downloads on full responses too, not only on 206
+        response.accept_ranges = 'bytes'
+    else:
+        # Revalidations are answered here; the proxy serves the body and byte ranges
+        response.make_conditional(request.environ)
+        sendfile_path = response.headers.pop('X-Sendfile', None)
+        if response.status_code != 304:
+            if ATTACHMENT_DELIVERY == 'x-accel':
+                relative = os.path.relpath(sendfile_path, current_app.config['UPLOAD_FOLDER'])
+                response.headers['X-Accel-Redirect'] = (ATTACHMENT_ACCEL_PREFIX.rstrip('/') + '/'
+                                                        + quote(relative.replace(os.sep, '/')))
+            else:
+                response.headers['X-Sendfile'] = sendfile_path
+    return response
+
+
+def spool(stream, upload_folder=None):
+    """Copy a stream to a temporary file in the store, hashing it on the way
+
+    Returns (tmp_path, sha256, size). Memory use is one chunk regardless of
+    the file size.
+    """
+    tmp_dir = os.path.join(store_root(upload_folder), 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+def part_path(upload_id, upload_folder=None):
+    """Data of a resumable upload; kept next to the blobs so attaching it is a hard link"""
+    return os.path.join(store_root(upload_folder), 'tmp', f'{upload_id}.part')
+
+
+def write_chunk(path, offset, stream, limit):
+    """Write a request body into a partial upload at offset, one chunk of memory at a time
+
+    Anything after offset (left by an interrupted chunk) is discarded first.
+    Returns the number of bytes written; raises ValueError if the body is
+    longer than limit.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        written = 0
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > limit:
+                f.truncate(offset)
+                raise ValueError('chunk exceeds the declared size')
+            f.write(chunk)
+    return written
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def purge_stale_uploads(conn, upload_folder=None, max_age_hours=UPLOAD_EXPIRE_HOURS):
+    """Drop resumable uploads that were not attached within max_age_hours; returns how many"""
+    cutoff = epoch_ms() - max_age_hours * 3600 * 1000
+    rows = conn.execute('SELECT id FROM upload_sessions WHERE updated_at_ms < ?', (cutoff,)).fetchall()
+    for row in rows:
+        path = part_path(row['id'], upload_folder)
+        if os.path.exists(path):
+            os.remove(path)
+    conn.execute('DELETE FROM upload_sessions WHERE updated_at_ms < ?', (cutoff,))
+    conn.commit()
+    return len(rows)
+
+
+def _place_blob(tmp_path, digest, upload_folder=None):
+    """Move a spooled file to its blob path, or drop it if that blob is already stored"""
+    path = blob_path(digest, upload_folder)
+    if os.path.exists(path):
+        os.unlink(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    return path
+
+
+def _link_blob(source_path, digest, upload_folder=None):
+    """Put a blob in place from a file that has to survive a rollback (a finished upload)"""
+    path = blob_path(digest, upload_folder)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(source_path, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Filesystems without hard links
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+    return path
+
+
+def add_attachment(cursor, leave_request_id, filename, spooled, upload_folder=None, keep_source=False):
+    """Record an attachment for a spooled upload and put its blob in place
+
+    The INSERT takes the write lock before the blob is placed, so this must
+    run inside the caller's transaction (commit afterwards). With
+    keep_source the spooled file is linked rather than moved; the caller
+    removes it with discard() once the transaction has committed.
+    """
+    tmp_path, digest, size = spooled
+    path = blob_path(digest, upload_folder)
+    cursor.execute('''
+        INSERT INTO leave_attachments (leave_request_id, filename, filepath, sha256, size)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (leave_request_id, filename, path, digest, size))
+    if keep_source:
+        _link_blob(tmp_path, digest, upload_folder)
+    else:
+        _place_blob(tmp_path, digest, upload_folder)
+    return cursor.lastrowid
+
+
+def claim_uploads(cursor, user_id, upload_ids, upload_folder=None):
+    """Take a user's finished resumable uploads for attaching; run inside the write transaction
+
+    Deletes their upload_sessions rows and returns [(upload id, filename,
+    spooled)], or None when any of them is not (or no longer) available,
+    e.g. because the same form was submitted twice. Attach them with
+    keep_source=True so a rollback leaves both the rows and the files.
+    """
+    placeholders = ','.join('?' * len(upload_ids))
+    rows = cursor.execute(f'''
+        DELETE FROM upload_sessions
+        WHERE user_id = ? AND status = 'complete' AND id IN ({placeholders})
+        RETURNING id, filename, size, sha256
+    ''', (user_id, *upload_ids)).fetchall()
+    claimed = [(row['id'], row['filename'], (part_path(row['id'], upload_folder), row['sha256'], row['size']))
+               for row in rows]
+    if len(claimed) != len(upload_ids) or not all(os.path.exists(spooled[0]) for _id, _name, spooled in claimed):
+        return None
+    return claimed
+
+
+def discard(spooled):
+    """Remove a spooled upload that will not be stored"""
+    if spooled and os.path.exists(spooled[0]):
+        os.unlink(spooled[0])
+
+
+def release_blobs(conn, digests, upload_folder=None):
+    """Unlink the blobs that no attachment row references any more
+
+    Call after the rows were deleted and committed. Returns the number of
+    blobs removed.
+    """
+    digests = {digest for digest in digests if digest}
+    if not digests:
+        return 0
+    removed = 0
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for digest in digests:
+            referenced = conn.execute('SELECT 1 FROM leave_attachments WHERE sha256 = ? LIMIT 1',
+                                      (digest,)).fetchone()
+            if referenced is not None:
+                continue
+            path = blob_path(digest, upload_folder)
+            if os.path.exists(path):
+                os.remove(path)
+                removed += 1
+            job = conn.execute('SELECT preview_format FROM media_jobs WHERE sha256 = ?', (digest,)).fetchone()
+            if job is not None and job['preview_format']:
+                for kind in ('preview', 'thumb'):
+                    preview = preview_path(digest, kind, job['preview_format'], upload_folder)
+                    if os.path.exists(preview):
+                        os.remove(preview)
+            conn.execute('DELETE FROM media_jobs WHERE sha256 = ?', (digest,))
+    finally:
+        conn.commit()
+    return removed
+
+
+def release_files(conn, digests=(), legacy_paths=(), upload_ids=(), upload_folder=None):
+    """Remove the files left behind by a committed bulk delete (see bulk.py)
+
+    Blobs are released in batches of RELEASE_BATCH_SIZE so the write lock
+    is only held briefly. Returns the number of files removed.
+    """
+    digests = sorted(set(digests))
+    removed = 0
+    for start in range(0, len(digests), RELEASE_BATCH_SIZE):
+        removed += release_blobs(conn, digests[start:start + RELEASE_BATCH_SIZE], upload_folder)
+    for path in set(legacy_paths):
+        still_used = conn.execute('SELECT 1 FROM leave_attachments WHERE filepath = ? LIMIT 1', (path,)).fetchone()
+        if still_used is None and os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    for upload_id in upload_ids:
+        path = part_path(upload_id, upload_folder)
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def release_in_background(cleanup, upload_folder=None):
+    """Run release_files for a bulk delete's cleanup on a background thread
+
+    Returns the thread. If the process exits first, `flask gc-attachments`
+    removes whatever blobs were left unreferenced.
+    """
+    from database import get_db
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
+
+    def run():
+        conn = get_db()
+        try:
+            release_files(conn, upload_folder=upload_folder, **cleanup)
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=run, name='attachment-release', daemon=True)
+    thread.start()
+    return thread
+
+
+def collect_garbage(conn, upload_folder=None):
+    """Release every blob in the store that no attachment references; returns how many were removed"""
+    root = store_root(upload_folder)
+    digests = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if dirpath == root:
+            dirnames[:] = [name for name in dirnames if name != 'tmp']
+        digests.extend(name for name in filenames if len(name) == 64)
+    return release_files(conn, digests=digests, upload_folder=upload_folder)
+
+
+def dedupe_legacy(conn, upload_folder):
+    """Move files stored before content addressing into the blob store
+
+    Returns a summary: rows converted, rows whose file is missing, legacy
+    bytes before and blob bytes added.
+    """
+    stats = {'converted': 0, 'missing': 0, 'legacy_bytes': 0, 'stored_bytes': 0}
+    rows = conn.execute('SELECT id, filepath FROM leave_attachments WHERE sha256 IS NULL ORDER BY id').fetchall()
+    for row in rows:
+        legacy_path = row['filepath']
+        if not os.path.exists(legacy_path):
+            stats['missing'] += 1
+            continue
+        with open(legacy_path, 'rb') as f:
+            spooled = spool(f, upload_folder)
+        stored = os.path.exists(blob_path(spooled[1], upload_folder))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('UPDATE leave_attachments SET filepath = ?, sha256 = ?, size = ? WHERE id = ?',
+                         (blob_path(spooled[1], upload_folder), spooled[1], spooled[2], row['id']))
+            _place_blob(spooled[0], spooled[1], upload_folder)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            discard(spooled)
+            raise
+        still_used = conn.execute('SELECT 1 FROM leave_attachments WHERE filepath = ? LIMIT 1',
+                                  (legacy_path,)).fetchone()
+        if still_used is None:
+            os.remove(legacy_path)
+        stats['converted'] += 1
+        stats['legacy_bytes'] += spooled[2]
+        if not stored:
+            stats['stored_bytes'] += spooled[2]
+    return stats
+
+
+def init_app(app):
+    @app.cli.command('dedupe-attachments')
+    def dedupe_attachments_command():
+        """Move existing leave attachments into the content-addressed store"""
+        from database import get_db
+        conn = get_db()
+        try:
+            stats = dedupe_legacy(conn, app.config['UPLOAD_FOLDER'])
+        finally:
+            conn.close()
+        saved = stats['legacy_bytes'] - stats['stored_bytes']
+        print(f"已转换 {stats['converted']} 个附件，{stats['missing']} 个文件不存在，"
+              f"节省 {saved / 1024 / 1024:.1f} MB")
+
+    @app.cli.command('gc-attachments')
+    def gc_attachments_command():
+        """Remove attachment blobs that no leave request references"""
+        from database import get_db
+        conn = get_db()
+        try:
+            removed = collect_garbage(conn, app.config['UPLOAD_FOLDER'])
+        finally:
+            conn.close()
+        print(f'已删除 {removed} 个无引用的附件文件')
+
+    @app.cli.command('purge-uploads')
+    def purge_uploads_command():
+        """Remove resumable uploads that were never attached to a leave request"""
+        from database import get_db
+        conn = get_db()
+        try:
+            removed = purge_stale_uploads(conn, app.config['UPLOAD_FOLDER'])
+        finally:
+            conn.close()
+        print(f'已清理 {removed} 个未完成的上传')
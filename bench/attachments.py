@@ -0,0 +1,78 @@
+"""
+Disk savings of the content-addressed attachment store.
+
+Copies a database and its upload directory, moves every attachment into
+the blob store with attachments.dedupe_legacy (what `flask
+dedupe-attachments` does) and reports files, logical bytes and bytes on
+disk before and after. Works on the generated corpus or on a copy of a
+real deployment:
+
+    python -m bench.attachments
+    python -m bench.attachments --db /backup/database.db --uploads /backup/uploads
+"""
+import os
+import sys
+import time
+import argparse
+
+from bench.common import (BENCH_DATA, DEFAULT_DB, DEFAULT_UPLOADS, configure_env, working_copy,
+                          copy_uploads, run_metadata, write_report)
+
+
+def disk_usage(root):
+    """(files, logical bytes, allocated bytes) under a directory"""
+    files = logical = allocated = 0
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            st = os.stat(os.path.join(dirpath, filename))
+            files += 1
+            logical += st.st_size
+            allocated += st.st_blocks * 512
+    return {'files': files, 'bytes': logical, 'disk_bytes': allocated}
+
+
+def run(db_path, upload_dir, work_dir):
+    target = working_copy(db_path, work_dir)
+    uploads = copy_uploads(target, upload_dir, work_dir)
+    configure_env(target, work_dir, uploads)
+    import attachments
+    from database import init_db, get_db
+    init_db()
+
+    before = disk_usage(uploads)
+    conn = get_db()
+    rows = conn.execute('SELECT COUNT(*) FROM leave_attachments').fetchone()[0]
+    started = time.perf_counter()
+    stats = attachments.dedupe_legacy(conn, uploads)
+    elapsed = time.perf_counter() - started
+    unique = conn.execute('SELECT COUNT(DISTINCT sha256) FROM leave_attachments').fetchone()[0]
+    conn.close()
+    after = disk_usage(uploads)
+
+    return {
+        'meta': run_metadata(db_path=db_path, uploads=upload_dir),
+        'attachment_rows': rows,
+        'unique_blobs': unique,
+        'migration': {**stats, 'seconds': round(elapsed, 3)},
+        'before': before,
+        'after': after,
+        'saved_bytes': before['disk_bytes'] - after['disk_bytes'],
+        'saved_ratio': round(1 - after['disk_bytes'] / before['disk_bytes'], 4) if before['disk_bytes'] else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure attachment deduplication savings')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'attachments'))
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+    write_report(run(args.db, args.uploads, args.work_dir), args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
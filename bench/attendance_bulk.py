@@ -0,0 +1,126 @@
+"""
+Entering a paper sign-in sheet after a QR outage: one POST each vs bulk.
+
+On a copy of the generated database, --users students lose their record
+in the latest check-in session and are then marked present (half of
+them as sick leave) the way an admin would do it in the browser:
+
+    per-request   POST /admin/attendance/<id>/add_record for every
+                  student, then /admin/attendance/record/<id>/update for
+                  the sick ones, each followed by the redirect back to
+                  the records page
+    bulk          one POST /admin/attendance/<id>/records/bulk with the
+                  students selected, and one more for the sick ones
+    csv           the whole sheet as one CSV upload
+
+The report has the wall time, the number of HTTP round trips, the write
+transactions (commits) and the live points records of the session.
+
+    python -m bench.attendance_bulk --users 300
+"""
+import io
+import os
+import sys
+import time
+import argparse
+
+from bench.common import (BENCH_DATA, DEFAULT_DB, configure_env, working_copy, client_for, count_commits,
+                          run_metadata, write_report)
+
+VARIANTS = ('per-request', 'bulk', 'csv')
+
+
+def reset(conn, session_id, users):
+    """Drop the bench users' records for the session so every variant starts alike"""
+    user_ids = [user_id for user_id, _student_id in users]
+    placeholders = ','.join('?' * len(user_ids))
+    conn.execute(f'DELETE FROM attendance_records WHERE session_id = ? AND user_id IN ({placeholders})',
+                 [session_id] + user_ids)
+    conn.execute(f'DELETE FROM points_records WHERE session_id = ? AND user_id IN ({placeholders})',
+                 [session_id] + user_ids)
+    conn.commit()
+
+
+def measure(variant, client, conn, session_id, users):
+    reset(conn, session_id, users)
+    sick = users[::2]
+    round_trips = 0
+    started = time.perf_counter()
+    with count_commits() as commits:
+        if variant == 'per-request':
+            for user_id, _student_id in users:
+                client.post(f'/admin/attendance/{session_id}/add_record',
+                            data={'user_id': user_id, 'status': 'present'}, follow_redirects=True)
+                round_trips += 2
+            for user_id, _student_id in sick:
+                record_id = conn.execute('SELECT id FROM attendance_records WHERE session_id = ? AND user_id = ?',
+                                         (session_id, user_id)).fetchone()[0]
+                client.post(f'/admin/attendance/record/{record_id}/update',
+                            data={'status': 'sick_leave'}, follow_redirects=True)
+                round_trips += 2
+        elif variant == 'bulk':
+            for status, selected in (('present', users), ('sick_leave', sick)):
+                client.post(f'/admin/attendance/{session_id}/records/bulk',
+                            data={'status': status, 'user_ids': [user_id for user_id, _student_id in selected]},
+                            follow_redirects=True)
+                round_trips += 2
+        else:
+            sick_ids = {student_id for _user_id, student_id in sick}
+            text = '学工号,状态\n' + ''.join(f"{student_id},{'病假' if student_id in sick_ids else '已签到'}\n"
+                                          for _user_id, student_id in users)
+            client.post(f'/admin/attendance/{session_id}/records/bulk',
+                        data={'file': (io.BytesIO(text.encode()), 'sheet.csv')},
+                        content_type='multipart/form-data', follow_redirects=True)
+            round_trips += 2
+    elapsed = time.perf_counter() - started
+
+    user_ids = [user_id for user_id, _student_id in users]
+    placeholders = ','.join('?' * len(user_ids))
+    return {
+        'variant': variant,
+        'users': len(users),
+        'wall_s': round(elapsed, 3),
+        'round_trips': round_trips,
+        'commits': commits[0],
+        'records': conn.execute(f'SELECT COUNT(*) FROM attendance_records WHERE session_id = ? AND user_id IN ({placeholders})',
+                                [session_id] + user_ids).fetchone()[0],
+        'live_points_records': conn.execute(f'''
+            SELECT COUNT(*) FROM points_records WHERE session_id = ? AND is_deleted = 0 AND user_id IN ({placeholders})
+        ''', [session_id] + user_ids).fetchone()[0]
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare per-user and bulk attendance edits')
+    parser.add_argument('--variants', default=','.join(VARIANTS))
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'attendance_bulk'))
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    target = working_copy(args.db, args.work_dir)
+    configure_env(target, args.work_dir)
+    from app import app
+    from database import get_db, init_db
+    init_db()
+
+    conn = get_db()
+    admin_id = conn.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    conn.execute('UPDATE users SET must_change_password = 0 WHERE id = ?', (admin_id,))
+    session_id = conn.execute("SELECT MAX(id) FROM attendance_sessions WHERE session_type = 'checkin'").fetchone()[0]
+    conn.commit()
+    users = [tuple(row) for row in conn.execute(
+        'SELECT id, student_id FROM users WHERE is_admin = 0 ORDER BY id LIMIT ?', (args.users,))]
+    client = client_for(app, admin_id)
+
+    results = [measure(variant, client, conn, session_id, users) for variant in args.variants.split(',')]
+    conn.close()
+    write_report({'meta': run_metadata(db_path=args.db, users=args.users), 'variants': results}, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
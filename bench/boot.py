@@ -0,0 +1,198 @@
+"""
+Worker boot benchmark: import time and per-worker memory.
+
+Measures how long `import app` takes in a fresh interpreter (and whether
+qrcode/Pillow got imported on the way), then starts gunicorn with and
+without --preload and records time until the first request is answered
+plus RSS, PSS and USS (private memory) of the master and every worker
+from /proc. PSS/USS are what show copy-on-write sharing; RSS counts
+shared pages in every process. With --baseline the same is measured for
+another git revision:
+
+    python -m bench.boot --workers 4 --baseline HEAD~1
+"""
+import os
+import sys
+import json
+import time
+import socket
+import statistics
+import argparse
+import subprocess
+import urllib.request
+
+from bench.common import (ROOT, BENCH_DATA, DEFAULT_DB, DEFAULT_UPLOADS, configure_env, working_copy,
+                          run_at_revision, run_metadata, write_report)
+
+IMPORT_PROBE = '''
+import sys, json, time, resource
+started = time.perf_counter()
+import app
+print(json.dumps({
+    'seconds': time.perf_counter() - started,
+    'qrcode_loaded': 'qrcode' in sys.modules,
+    'pil_loaded': 'PIL' in sys.modules,
+    'modules': len(sys.modules),
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+}))
+'''
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def memory(pid):
+    """RSS/PSS/USS in MB from smaps_rollup"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss_mb': round(fields.get('Rss', 0) / 1024, 2),
+        'pss_mb': round(fields.get('Pss', 0) / 1024, 2),
+        'uss_mb': round((fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024, 2)
+    }
+
+
+def children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def import_time(root, runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', IMPORT_PROBE], cwd=root, env=os.environ,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    seconds = [s['seconds'] for s in samples]
+    return {
+        'runs': runs,
+        'median_ms': round(statistics.median(seconds) * 1000, 1),
+        'min_ms': round(min(seconds) * 1000, 1),
+        'qrcode_loaded': samples[-1]['qrcode_loaded'],
+        'pil_loaded': samples[-1]['pil_loaded'],
+        'modules': samples[-1]['modules'],
+        'max_rss_mb': round(samples[-1]['max_rss_mb'], 2)
+    }
+
+
+def boot(root, work_dir, workers, preload, warm_requests, settle):
+    """Start gunicorn, wait for it to answer, then sample memory of every process"""
+    port = free_port()
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers)]
+    env = dict(os.environ, GUNICORN_PRELOAD='1' if preload else '0')
+    if os.path.exists(os.path.join(root, 'gunicorn.conf.py')):
+        command += ['-c', 'gunicorn.conf.py']
+    elif preload:
+        command.append('--preload')
+    command.append('app:app')
+
+    log_path = os.path.join(work_dir, f"gunicorn-{'preload' if preload else 'default'}.log")
+    url = f'http://127.0.0.1:{port}/login'
+    started = time.perf_counter()
+    with open(log_path, 'wb') as log:
+        process = subprocess.Popen(command, cwd=root, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        ready = None
+        while time.perf_counter() - started < 60:
+            if process.poll() is not None:
+                raise RuntimeError(f'gunicorn exited, see {log_path}')
+            try:
+                with urllib.request.urlopen(url, timeout=2) as response:
+                    if response.status == 200:
+                        ready = time.perf_counter() - started
+                        break
+            except OSError:
+                time.sleep(0.05)
+        if ready is None:
+            raise RuntimeError(f'gunicorn did not come up, see {log_path}')
+
+        # Wait for every worker to exist, then spread some requests over them
+        while len(children(process.pid)) < workers and time.perf_counter() - started < 60:
+            time.sleep(0.05)
+        all_forked = time.perf_counter() - started
+        for _ in range(warm_requests):
+            with urllib.request.urlopen(url, timeout=10) as response:
+                response.read()
+        time.sleep(settle)
+
+        worker_memory = [memory(pid) for pid in children(process.pid)]
+        totals = {key: round(sum(w[key] for w in worker_memory), 2) for key in ('rss_mb', 'pss_mb', 'uss_mb')}
+        master = memory(process.pid)
+        return {
+            'preload': preload,
+            'first_response_ms': round(ready * 1000, 1),
+            'all_workers_forked_ms': round(all_forked * 1000, 1),
+            'master': master,
+            'workers': worker_memory,
+            'worker_mean': {key: round(value / max(len(worker_memory), 1), 2) for key, value in totals.items()},
+            'total_pss_mb': round(totals['pss_mb'] + master['pss_mb'], 2)
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def measure(db_path, upload_dir, work_dir, workers, runs, warm_requests, settle, app_root=None):
+    target = working_copy(db_path, work_dir)
+    configure_env(target, work_dir, upload_dir)
+    root = app_root or ROOT
+    return {
+        'import': import_time(root, runs),
+        'gunicorn': {
+            'default': boot(root, work_dir, workers, False, warm_requests, settle),
+            'preload': boot(root, work_dir, workers, True, warm_requests, settle)
+        }
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure app import time and per-worker memory')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'boot'))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters for the import timing')
+    parser.add_argument('--warm-requests', type=int, default=20)
+    parser.add_argument('--settle', type=float, default=1.0, help='seconds to wait before sampling memory')
+    parser.add_argument('--baseline', default=None, help='git revision to compare against')
+    parser.add_argument('--app-root', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--raw', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        parser.error('per-process memory needs Linux /proc/<pid>/smaps_rollup')
+
+    options = [args.workers, args.runs, args.warm_requests, args.settle]
+    if args.raw:
+        print(json.dumps(measure(args.db, args.uploads, args.work_dir, *options, app_root=args.app_root)))
+        return
+
+    baseline = None
+    if args.baseline:
+        baseline = run_at_revision('bench.boot', args.baseline, [
+            '--db', args.db, '--uploads', args.uploads, '--workers', str(args.workers),
+            '--runs', str(args.runs), '--warm-requests', str(args.warm_requests), '--settle', str(args.settle),
+            '--work-dir', os.path.join(args.work_dir, 'baseline')])
+    current = measure(args.db, args.uploads, os.path.join(args.work_dir, 'current'), *options)
+    report = {'meta': run_metadata(db_path=args.db, workers=args.workers, baseline=args.baseline),
+              'current': current}
+    if baseline:
+        report['baseline'] = baseline
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Deleting a graduating class: per-id statements vs the set-based engine.
+
+Each variant runs on a fresh copy of the database and its uploads
+(attachments moved into the blob store first) and deletes the --students
+earliest-enrolled students:
+
+    legacy     what /admin/users/delete did before: group membership and
+               user row per id, everything else left orphaned
+    per-user   the full cascade, but one statement per table per id
+    bulk       bulk.delete_users (TEMP table joins, one transaction),
+               then attachments.release_files as the background step does
+
+The report has the time the write lock was held, the cleanup time, the
+rows deleted and what is left orphaned afterwards. Use a generated
+database with enough students:
+
+    python -m bench.generate --users 12000 --class-size 100 \\
+        --db bench/data/large/database.db --uploads bench/data/large/uploads
+    python -m bench.bulk_delete --db bench/data/large/database.db \\
+        --uploads bench/data/large/uploads --students 5000
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+
+from bench.common import (ROOT, BENCH_DATA, DEFAULT_DB, DEFAULT_UPLOADS, working_copy, copy_uploads,
+                          run_metadata, write_report)
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import bulk
+import attachments
+from database import register_functions
+
+VARIANTS = ('legacy', 'per-user', 'bulk')
+PER_USER_STATEMENTS = (
+    'DELETE FROM leave_attachments WHERE leave_request_id IN (SELECT id FROM leave_requests WHERE user_id = ?)',
+    'DELETE FROM points_records WHERE user_id = ?',
+    'DELETE FROM leave_requests WHERE user_id = ?',
+    'DELETE FROM attendance_records WHERE user_id = ?',
+    'DELETE FROM group_members WHERE user_id = ?',
+    'DELETE FROM upload_sessions WHERE user_id = ?',
+    'DELETE FROM users WHERE id = ? AND is_admin = 0',
+)
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    register_functions(conn)
+    return conn
+
+
+def orphans(conn, uploads):
+    referenced = {row[0] for row in conn.execute('SELECT DISTINCT sha256 FROM leave_attachments WHERE sha256 IS NOT NULL')}
+    blobs = set()
+    for dirpath, _dirnames, filenames in os.walk(attachments.store_root(uploads)):
+        blobs.update(name for name in filenames if len(name) == 64)
+    return {
+        'attendance_records': conn.execute(
+            'SELECT COUNT(*) FROM attendance_records WHERE user_id NOT IN (SELECT id FROM users)').fetchone()[0],
+        'points_records': conn.execute(
+            'SELECT COUNT(*) FROM points_records WHERE user_id NOT IN (SELECT id FROM users)').fetchone()[0],
+        'leave_requests': conn.execute(
+            'SELECT COUNT(*) FROM leave_requests WHERE user_id NOT IN (SELECT id FROM users)').fetchone()[0],
+        'leave_attachments': conn.execute(
+            'SELECT COUNT(*) FROM leave_attachments WHERE leave_request_id NOT IN (SELECT id FROM leave_requests)'
+        ).fetchone()[0],
+        'blob_files': len(blobs - referenced)
+    }
+
+
+def measure(variant, db_path, upload_dir, work_dir, students):
+    target = working_copy(db_path, work_dir)
+    uploads = copy_uploads(target, upload_dir, work_dir)
+    conn = connect(target)
+    attachments.dedupe_legacy(conn, uploads)
+    user_ids = [row[0] for row in conn.execute(
+        'SELECT id FROM users WHERE is_admin = 0 ORDER BY id LIMIT ?', (students,))]
+
+    counts, cleanup, statements = None, None, 0
+    started = time.perf_counter()
+    if variant == 'legacy':
+        for user_id in user_ids:
+            conn.execute('DELETE FROM group_members WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM users WHERE id = ? AND is_admin = 0', (user_id,))
+            statements += 2
+        conn.commit()
+    elif variant == 'per-user':
+        conn.execute('BEGIN IMMEDIATE')
+        for user_id in user_ids:
+            for sql in PER_USER_STATEMENTS:
+                conn.execute(sql, (user_id,))
+                statements += 1
+        conn.commit()
+    else:
+        counts, cleanup = bulk.delete_users(conn, user_ids)
+        statements = None
+    locked = time.perf_counter() - started
+
+    cleanup_seconds = None
+    if cleanup is not None:
+        started = time.perf_counter()
+        cleanup['removed'] = attachments.release_files(conn, upload_folder=uploads, **cleanup)
+        cleanup_seconds = time.perf_counter() - started
+
+    result = {
+        'variant': variant,
+        'students': len(user_ids),
+        'write_lock_s': round(locked, 3),
+        'statements': statements,
+        'deleted': counts,
+        'cleanup_s': round(cleanup_seconds, 3) if cleanup_seconds is not None else None,
+        'files_removed': cleanup['removed'] if cleanup else None,
+        'orphans_after': orphans(conn, uploads)
+    }
+    conn.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark deleting a class of students')
+    parser.add_argument('--variants', default=','.join(VARIANTS))
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'bulk_delete'))
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    results = [measure(variant, args.db, args.uploads, os.path.join(args.work_dir, variant), args.students)
+               for variant in args.variants.split(',')]
+    write_report({'meta': run_metadata(db_path=args.db, students=args.students), 'variants': results}, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Shared helpers for the benchmark scripts
+"""
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import tempfile
+import contextlib
+import platform
+import resource
+import sqlite3
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DATA = os.path.join(ROOT, 'bench', 'data')
+DEFAULT_DB = os.path.join(BENCH_DATA, 'database.db')
+DEFAULT_UPLOADS = os.path.join(BENCH_DATA, 'uploads')
+
+
+def configure_env(db_path, work_dir, upload_dir=None):
+    """Point the app at a benchmark database before it is imported"""
+    os.makedirs(work_dir, exist_ok=True)
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ['UPLOAD_FOLDER'] = upload_dir or os.path.join(work_dir, 'uploads')
+    os.environ['METRICS_DIR'] = os.path.join(work_dir, 'metrics')
+    os.environ['SQL_LOG_PATH'] = os.path.join(work_dir, 'logs', 'sql.log')
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def working_copy(db_path, work_dir):
+    """Copy a generated database so every run starts from the same state"""
+    os.makedirs(work_dir, exist_ok=True)
+    target = os.path.join(work_dir, 'database.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    shutil.copyfile(db_path, target)
+    return target
+
+
+def copy_uploads(db_path, upload_dir, work_dir):
+    """Copy an upload directory next to a working database and repoint its attachment rows
+
+    Attachment rows hold absolute paths; returns the new upload directory.
+    """
+    uploads = os.path.join(work_dir, 'uploads')
+    if os.path.isdir(uploads):
+        shutil.rmtree(uploads)
+    shutil.copytree(upload_dir, uploads)
+    source = os.path.abspath(upload_dir) + os.sep
+    conn = sqlite3.connect(db_path)
+    # Paths may have been stored relative to the working directory
+    rows = conn.execute('SELECT id, filepath FROM leave_attachments').fetchall()
+    conn.executemany('UPDATE leave_attachments SET filepath = ? WHERE id = ?', [
+        (os.path.join(uploads, os.path.abspath(path)[len(source):]), row_id)
+        for row_id, path in rows if os.path.abspath(path).startswith(source)
+    ])
+    conn.commit()
+    conn.close()
+    return uploads
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def summarize(latencies, elapsed, status_codes=None):
+    """Throughput and latency percentiles (ms) of one measured route"""
+    result = {
+        'requests': len(latencies),
+        'total_s': round(elapsed, 4),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        'peak_rss_mb': peak_rss_mb()
+    }
+    if status_codes is not None:
+        result['status_codes'] = status_codes
+    return result
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def client_for(app, user_id):
+    """Test client logged in as a user without going through the password hash"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+@contextlib.contextmanager
+def count_commits():
+    """Count the commits made through the app's connections inside the block; yields a one-item list"""
+    from instrumentation import TracedConnection
+    commits = [0]
+    original = TracedConnection.commit
+
+    def counting_commit(self):
+        commits[0] += 1
+        return original(self)
+
+    TracedConnection.commit = counting_commit
+    try:
+        yield commits
+    finally:
+        TracedConnection.commit = original
+
+
+def table_counts(db_path, tables):
+    conn = sqlite3.connect(db_path)
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in tables}
+    conn.close()
+    return counts
+
+
+def run_metadata(**extra):
+    """Environment details recorded with every report"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                  capture_output=True, text=True, check=False).stdout.strip()
+    except OSError:
+        revision = ''
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_revision': revision or None,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        **extra
+    }
+
+
+@contextlib.contextmanager
+def revision_tree(revision):
+    """Check out a git revision into a temporary directory"""
+    with tempfile.TemporaryDirectory(prefix='bench-rev-') as tree:
+        archive = subprocess.run(['git', 'archive', revision], cwd=ROOT, capture_output=True, check=True)
+        subprocess.run(['tar', '-x', '-C', tree], input=archive.stdout, check=True)
+        yield tree
+
+
+def run_at_revision(module, revision, args):
+    """Run a bench module with the app code of another revision; returns its JSON output
+
+    The module is run from this checkout with `--app-root <tree> --raw`,
+    in its own process so the two app versions never share imports.
+    """
+    with revision_tree(revision) as tree:
+        command = [sys.executable, '-m', module, *args, '--app-root', tree, '--raw']
+        output = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+def write_report(report, output=None):
+    """Print the JSON report and optionally save it"""
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
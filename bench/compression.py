@@ -0,0 +1,109 @@
+"""
+Bytes on the wire and CPU cost of response compression.
+
+Fetches the roster JSON and the large admin tables with each encoding
+(identity, gzip, and br when the brotli package is installed), and
+reports transferred bytes, compression ratio, end-to-end latency and the
+CPU time spent compressing one response body:
+
+    python -m bench.compression --iterations 30
+"""
+import os
+import sys
+import time
+import argparse
+
+from bench.common import (BENCH_DATA, DEFAULT_DB, DEFAULT_UPLOADS, configure_env, working_copy,
+                          percentile, client_for, run_metadata, write_report)
+
+
+def ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def run(db_path=DEFAULT_DB, upload_dir=DEFAULT_UPLOADS, work_dir=None, iterations=30):
+    work_dir = work_dir or os.path.join(BENCH_DATA, 'compression')
+    target = working_copy(db_path, work_dir)
+    configure_env(target, work_dir, upload_dir)
+
+    import compression
+    from app import app
+    from database import get_db
+    app.config['TESTING'] = True
+
+    conn = get_db()
+    admin_id = conn.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    session_id = conn.execute('''
+        SELECT sg.session_id FROM session_groups sg
+        JOIN group_members gm ON gm.group_id = sg.group_id
+        GROUP BY sg.session_id ORDER BY COUNT(*) DESC LIMIT 1
+    ''').fetchone()
+    conn.close()
+    admin = client_for(app, admin_id)
+
+    routes = {
+        'qr_status': f'/api/qr/status/{session_id[0] if session_id else 1}',
+        'admin_points': '/admin/points',
+        'admin_leave': '/admin/leave',
+        'admin_users': '/admin/users'
+    }
+    encodings = ['identity', 'gzip'] + (['br'] if compression.brotli is not None else [])
+
+    results = {}
+    for name, path in routes.items():
+        identity_body = admin.get(path, headers={'Accept-Encoding': 'identity'}).get_data()
+        route = {'body_bytes': len(identity_body)}
+        for encoding in encodings:
+            latencies, cpu = [], []
+            wire_bytes = None
+            for _ in range(iterations):
+                wall, proc = time.perf_counter(), time.process_time()
+                response = admin.get(path, headers={'Accept-Encoding': encoding})
+                data = response.get_data()
+                cpu.append(time.process_time() - proc)
+                latencies.append(time.perf_counter() - wall)
+                wire_bytes = len(data)
+                response.close()
+
+            # Isolated cost of compressing this body once
+            compress_cpu = None
+            if encoding != 'identity':
+                started = time.process_time()
+                for _ in range(iterations):
+                    compression.compress_body(identity_body, encoding)
+                compress_cpu = (time.process_time() - started) / iterations
+
+            route[encoding] = {
+                'wire_bytes': wire_bytes,
+                'ratio': round(wire_bytes / len(identity_body), 4) if identity_body else None,
+                'p50_ms': ms(percentile(latencies, 50)),
+                'p99_ms': ms(percentile(latencies, 99)),
+                'cpu_per_response_ms': ms(sum(cpu) / len(cpu)),
+                'compress_cpu_ms': ms(compress_cpu) if compress_cpu is not None else None
+            }
+        results[name] = route
+
+    return {
+        'meta': run_metadata(db_path=db_path, iterations=iterations, gzip_level=compression.GZIP_LEVEL,
+                             brotli_quality=compression.BROTLI_QUALITY if compression.brotli else None,
+                             min_size=compression.MIN_SIZE),
+        'routes': results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure response compression savings and cost')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--work-dir', default=None)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+    write_report(run(args.db, args.uploads, args.work_dir, args.iterations), args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
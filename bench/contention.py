@@ -0,0 +1,132 @@
+"""
+Reporting vs check-in contention.
+
+Runs a check-in storm (see bench/storm.py) while admin clients loop over
+the heavy read-only pages (leave history export, points table, the
+largest session's records), once per database configuration:
+
+    rollback   DB_JOURNAL_MODE=delete, ordinary connections for every read
+    wal        DB_JOURNAL_MODE=wal,    ordinary connections for every read
+    wal-ro     DB_JOURNAL_MODE=wal,    read-only connections for GET pages
+
+and reports check-in success/latency, export latency and the number of
+"database is locked" errors in the server log:
+
+    python -m bench.contention --phones 300 --exporters 4
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+from bench.common import BENCH_DATA, DEFAULT_DB, DEFAULT_UPLOADS, summarize, run_metadata, write_report
+from bench.storm import DEFAULT_SECRET, Browser, spawn_server, start_session, load_students, storm
+from bench.workers import Client, pick_targets
+
+CONFIGS = {
+    'rollback': {'DB_JOURNAL_MODE': 'delete', 'DB_READONLY_CONNECTIONS': '0'},
+    'wal': {'DB_JOURNAL_MODE': 'wal', 'DB_READONLY_CONNECTIONS': '0'},
+    'wal-ro': {'DB_JOURNAL_MODE': 'wal', 'DB_READONLY_CONNECTIONS': '1'},
+}
+
+
+def measure(config, args):
+    work_dir = os.path.join(args.work_dir, config)
+    saved = {key: os.environ.get(key) for key in CONFIGS[config]}
+    os.environ.update(CONFIGS[config])
+    try:
+        process, base_url, log_path = spawn_server(args.db, args.uploads, work_dir, args.port, args.workers,
+                                                   DEFAULT_SECRET, args.gunicorn_args)
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    try:
+        group_id, records_session = pick_targets(os.path.join(work_dir, 'database.db'))
+        group_id = group_id if args.group_only else None
+        session_id, _activity_code = start_session(base_url, admin_user='admin', admin_password='admin123',
+                                                   group_id=group_id)
+        students = load_students(args.db, args.phones, group_id)
+        report_paths = ['/admin/export/leave-history', '/admin/points']
+        if records_session:
+            report_paths.append(f'/admin/attendance/{records_session}/records')
+
+        stop = threading.Event()
+        exporters = []
+        for _ in range(args.exporters):
+            browser = Browser(base_url, timeout=120)
+            browser.request('/login', form={'student_id': 'admin', 'password': 'admin123'})
+            exporters.append(Client(browser, report_paths, stop))
+        started = time.perf_counter()
+        for exporter in exporters:
+            exporter.start()
+        checkins = storm(base_url, session_id, DEFAULT_SECRET, students, curve=args.curve,
+                         duration=args.duration, think_time=args.think_time, drain=args.drain,
+                         seed=args.seed, log_path=log_path)
+        stop.set()
+        for exporter in exporters:
+            exporter.join()
+
+        codes = {}
+        for exporter in exporters:
+            for status, count in exporter.codes.items():
+                codes[status] = codes.get(status, 0) + count
+        reports = summarize([s for e in exporters for s in e.latencies], time.perf_counter() - started, codes)
+        del reports['peak_rss_mb']
+        checkin_step = checkins['steps'].get('checkin', {})
+        return {
+            'env': CONFIGS[config],
+            'checkin_success_rate': checkins['success_rate'],
+            'checkin_p50_ms': checkin_step.get('p50_ms'),
+            'checkin_p99_ms': checkin_step.get('p99_ms'),
+            'server_errors': checkins['server_errors'],
+            'lock_errors': checkins['lock_errors'],
+            'reports': reports,
+            'storm': checkins
+        }
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure check-in/reporting contention per journal mode')
+    parser.add_argument('--configs', default=','.join(CONFIGS), help=f"comma-separated: {', '.join(CONFIGS)}")
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'contention'))
+    parser.add_argument('--port', type=int, default=5057)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--gunicorn-args', default='--worker-class gthread --threads 8')
+    parser.add_argument('--phones', type=int, default=300)
+    parser.add_argument('--group-only', action='store_true',
+                        help='bind the session to the largest group and use its members as phones')
+    parser.add_argument('--exporters', type=int, default=4)
+    parser.add_argument('--curve', default='burst')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--think-time', type=float, default=3.0)
+    parser.add_argument('--drain', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+    configs = args.configs.split(',')
+    unknown = [c for c in configs if c not in CONFIGS]
+    if unknown:
+        parser.error(f"unknown config: {', '.join(unknown)}")
+
+    report = {
+        'meta': run_metadata(db_path=args.db, workers=args.workers, gunicorn_args=args.gunicorn_args,
+                             phones=args.phones, exporters=args.exporters, curve=args.curve),
+        'configs': {config: measure(config, args) for config in configs}
+    }
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+Worker occupancy while large leave attachments are downloaded.
+
+For each ATTACHMENT_DELIVERY mode a gunicorn instance (sync workers) is
+started on a fresh copy of the generated database with one large
+attachment added. Download clients fetch it concurrently at a capped
+bandwidth, like phones on a campus network, while probe clients loop
+over `/login`:
+
+    python -m bench.downloads --modes python,x-sendfile --size-mb 20 --downloads 8
+
+With 'python' every download holds a sync worker until the last byte has
+been handed to the client's socket, so once downloads outnumber workers
+the probes queue behind them. With 'x-sendfile'/'x-accel' the worker only
+sends the headers. Worker occupancy is taken from gunicorn's access log
+(request time per download); no proxy runs here, so in the offload modes
+the clients receive no body and the transfer itself is not measured.
+A revalidation (If-None-Match) and a resumed download (Range) are also
+checked once per mode.
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import threading
+import http.client
+import urllib.error
+import urllib.request
+
+from bench.common import (BENCH_DATA, DEFAULT_DB, summarize, run_metadata, write_report)
+from bench.storm import DEFAULT_SECRET, Browser, spawn_server
+from bench.workers import Client
+
+READ_SIZE = 64 * 1024
+
+
+def read_body(resp):
+    """Body of a response; offloaded responses announce the file's length but carry no body without a proxy"""
+    try:
+        return resp.read()
+    except http.client.IncompleteRead as e:
+        return e.partial
+
+
+def add_large_attachment(db_path, upload_dir, size_mb):
+    """Store a random file of size_mb as an attachment of the first student's leave; returns its id"""
+    import attachments
+    from database import register_functions
+
+    source = os.path.join(upload_dir, 'large.bin')
+    os.makedirs(upload_dir, exist_ok=True)
+    with open(source, 'wb') as f:
+        for _ in range(size_mb * 16):
+            f.write(os.urandom(READ_SIZE))
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    register_functions(conn)
+    try:
+        with open(source, 'rb') as f:
+            spooled = attachments.spool(f, upload_dir)
+        user_id = conn.execute('SELECT id FROM users WHERE is_admin = 0 ORDER BY id LIMIT 1').fetchone()[0]
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO leave_requests (user_id, leave_type, reason, status)
+            VALUES (?, 'sick', 'bench', 'pending')
+        ''', (user_id,))
+        attachment_id = attachments.add_attachment(cursor, cursor.lastrowid, 'scan.bin', spooled, upload_dir)
+        conn.commit()
+    finally:
+        conn.close()
+    os.remove(source)
+    return attachment_id
+
+
+class Downloader(threading.Thread):
+    """Downloads a path once, reading at most kbps kilobytes per second"""
+
+    def __init__(self, browser, path, kbps):
+        super().__init__(daemon=True)
+        self.browser, self.path, self.kbps = browser, path, kbps
+        self.status, self.total_s, self.bytes = 0, None, 0
+
+    def run(self):
+        url = self.browser.base_url + self.path
+        started = time.perf_counter()
+        try:
+            with self.browser.opener.open(url, timeout=self.browser.timeout) as resp:
+                self.status = resp.status
+                while self.bytes < int(resp.headers.get('Content-Length') or 0):
+                    chunk = resp.read1(READ_SIZE)
+                    if not chunk:
+                        break
+                    self.bytes += len(chunk)
+                    # Sleep until the bytes read so far fit the bandwidth cap
+                    ahead = self.bytes / (self.kbps * 1024) - (time.perf_counter() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (urllib.error.URLError, OSError):
+            pass
+        self.total_s = time.perf_counter() - started
+
+
+def check_conditional(browser, path, size):
+    """Status and body size of a revalidation and of a request for the last megabyte"""
+    url = browser.base_url + path
+    result = {}
+    with browser.opener.open(url, timeout=browser.timeout) as resp:
+        etag = resp.headers.get('ETag')
+        result['headers'] = {name: resp.headers.get(name) for name in
+                             ('ETag', 'Last-Modified', 'Cache-Control', 'Accept-Ranges',
+                              'X-Sendfile', 'X-Accel-Redirect')}
+    for name, headers in (('if_none_match', {'If-None-Match': etag or ''}),
+                          ('range', {'Range': f'bytes={size - 1024 * 1024}-'})):
+        try:
+            with browser.opener.open(urllib.request.Request(url, headers=headers), timeout=browser.timeout) as resp:
+                result[name] = {'status': resp.status, 'bytes': len(read_body(resp))}
+        except urllib.error.HTTPError as e:
+            result[name] = {'status': e.code, 'bytes': len(e.read())}
+    return result
+
+
+def worker_seconds(access_log, path):
+    """Request times (seconds) of the completed responses to a path, from the access log"""
+    seconds = []
+    with open(access_log) as f:
+        for line in f:
+            logged_path, _status, micros = line.split()
+            if logged_path == path:
+                seconds.append(int(micros) / 1e6)
+    return seconds
+
+
+def measure(mode, db_path, work_dir, port, workers, size_mb, downloads, probes, kbps):
+    os.environ['ATTACHMENT_DELIVERY'] = mode
+    upload_dir = os.path.join(work_dir, 'uploads')
+    access_log = os.path.join(work_dir, 'access.log')
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    if os.path.exists(access_log):
+        os.remove(access_log)
+    process, base_url, _log_path = spawn_server(
+        db_path, upload_dir, work_dir, port, workers, DEFAULT_SECRET,
+        f'--access-logfile {access_log} --access-logformat "%(U)s %(s)s %(D)s"')
+    try:
+        attachment_id = add_large_attachment(os.path.join(work_dir, 'database.db'), upload_dir, size_mb)
+        path = f'/admin/leave/attachment/{attachment_id}'
+        admin = Browser(base_url, timeout=600)
+        admin.request('/login', form={'student_id': 'admin', 'password': 'admin123'})
+        conditional = check_conditional(admin, path, size_mb * 1024 * 1024)
+
+        stop = threading.Event()
+        probe_clients = [Client(Browser(base_url, timeout=600), ['/login'], stop) for _ in range(probes)]
+        downloaders = [Downloader(admin, path, kbps) for _ in range(downloads)]
+        started = time.perf_counter()
+        for client in probe_clients + downloaders:
+            client.start()
+        for downloader in downloaders:
+            downloader.join()
+        stop.set()
+        for client in probe_clients:
+            client.join()
+        elapsed = time.perf_counter() - started
+
+        probe_codes = {}
+        for client in probe_clients:
+            for status, count in client.codes.items():
+                probe_codes[status] = probe_codes.get(status, 0) + count
+        probe_latencies = [s for client in probe_clients for s in client.latencies]
+        probe = summarize(probe_latencies, elapsed, probe_codes)
+        del probe['peak_rss_mb']  # of this client process, not the server
+        # A probe that queued behind downloads shows up here, not in the percentiles
+        probe['max_ms'] = round(max(probe_latencies) * 1000, 3) if probe_latencies else None
+
+        download_codes = {}
+        for downloader in downloaders:
+            download_codes[downloader.status] = download_codes.get(downloader.status, 0) + 1
+        process.terminate()
+        process.wait(30)
+        # The first three responses are check_conditional's
+        busy = worker_seconds(access_log, path)[3:]
+        return {
+            'mode': mode,
+            'workers': workers,
+            'elapsed_s': round(elapsed, 3),
+            'downloads': {
+                'status_codes': download_codes,
+                'bytes_per_download': round(sum(d.bytes for d in downloaders) / len(downloaders)),
+                'client_seconds_per_download': round(sum(d.total_s for d in downloaders) / len(downloaders), 3),
+                'worker_seconds_per_download': round(sum(busy) / len(busy), 3) if busy else None,
+                'worker_seconds_total': round(sum(busy), 3)
+            },
+            'probe': probe,
+            'conditional': conditional
+        }
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure worker occupancy during large attachment downloads')
+    parser.add_argument('--modes', default='python,x-sendfile', help='comma-separated ATTACHMENT_DELIVERY modes')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'downloads'))
+    parser.add_argument('--port', type=int, default=5057)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--size-mb', type=int, default=20)
+    parser.add_argument('--downloads', type=int, default=8, help='concurrent downloads')
+    parser.add_argument('--probes', type=int, default=4, help='clients looping over /login')
+    parser.add_argument('--kbps', type=int, default=2048, help='bandwidth of each download client (KB/s)')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    results = []
+    for mode in args.modes.split(','):
+        results.append(measure(mode, args.db, os.path.join(args.work_dir, mode), args.port, args.workers,
+                               args.size_mb, args.downloads, args.probes, args.kbps))
+
+    report = {
+        'meta': run_metadata(db_path=args.db, workers=args.workers, size_mb=args.size_mb,
+                             downloads=args.downloads, probes=args.probes, kbps=args.kbps),
+        'modes': results
+    }
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""
+Synthetic data generator for benchmarks.
+
+Builds a realistic database at configurable scale: students split into
+class groups, a semester of (optionally paired) check-in/check-out
+sessions with their QR tokens, attendance records, leave requests with
+attachment files, and a points ledger padded to the requested size.
+
+    python -m bench.generate --users 5000 --weeks 18 --points-rows 2000000
+
+Every student's password is their student id (hashed with a cheap
+PBKDF2 round count so generation stays fast). The admin account is
+`admin` / `admin123` and does not have to change its password.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+
+from bench.common import DEFAULT_DB, DEFAULT_UPLOADS, configure_env
+
+CHUNK = 50000
+LEAVE_TYPES = ('public', 'personal', 'sick')
+LEAVE_STATUS = {'public': 'public_leave', 'personal': 'personal_leave', 'sick': 'sick_leave'}
+LEAVE_NAMES = {'public': '公假', 'personal': '事假', 'sick': '病假'}
+POINTS = {'checkin': 1.0, 'public': 0.0, 'personal': -1.0, 'sick': -0.5, 'absent': -2.0}
+
+
+def _fmt(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _chunks(rows, size=CHUNK):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _insert(conn, sql, rows):
+    for chunk in _chunks(rows):
+        conn.executemany(sql, chunk)
+
+
+def generate(db_path=DEFAULT_DB, upload_dir=DEFAULT_UPLOADS, users=2000, class_size=50,
+             weeks=18, sessions_per_day=4, paired_ratio=0.5, attendance_rate=0.92,
+             leave_rate=0.03, attachment_rate=0.6, attachment_kb=64, duplicate_rate=0.3,
+             points_rows=200000, qr_interval=15, session_minutes=10, seed=42,
+             start_date='2025-02-17'):
+    """Generate a benchmark database and return a summary of what was written"""
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    if os.path.isdir(upload_dir):
+        shutil.rmtree(upload_dir)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    os.makedirs(upload_dir, exist_ok=True)
+
+    configure_env(db_path, os.path.dirname(os.path.abspath(db_path)), upload_dir)
+    import database
+    database.DATABASE_PATH = db_path
+    database.init_db()
+
+    from werkzeug.security import generate_password_hash
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA journal_mode = MEMORY')
+    conn.execute("UPDATE users SET must_change_password = 0 WHERE is_admin = 1")
+    admin_id = conn.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    semester_start = datetime.fromisoformat(start_date).replace(hour=8)
+
+    # Users
+    user_rows = []
+    for i in range(users):
+        student_id = f'2025{i:06d}'
+        user_rows.append((student_id, f'学生{i:06d}',
+                          generate_password_hash(student_id, method='pbkdf2:sha256:1000'),
+                          _fmt(semester_start - timedelta(days=7))))
+    _insert(conn, '''
+        INSERT INTO users (student_id, name, password_hash, is_admin, must_change_password, created_at)
+        VALUES (?, ?, ?, 0, 0, ?)
+    ''', user_rows)
+    user_ids = [row[0] for row in conn.execute('SELECT id FROM users WHERE is_admin = 0 ORDER BY id')]
+
+    # Class groups
+    groups = []
+    for g, offset in enumerate(range(0, len(user_ids), class_size)):
+        cursor = conn.execute('INSERT INTO user_groups (name, created_by) VALUES (?, ?)',
+                              (f'班级{g + 1:03d}', admin_id))
+        members = user_ids[offset:offset + class_size]
+        conn.executemany('INSERT INTO group_members (group_id, user_id) VALUES (?, ?)',
+                         [(cursor.lastrowid, uid) for uid in members])
+        groups.append((cursor.lastrowid, members))
+
+    # Attachment corpus: a pool of documents, some re-submitted verbatim
+    document_pool = []
+
+    def attachment_bytes():
+        if document_pool and rng.random() < duplicate_rate:
+            return rng.choice(document_pool)
+        size = max(1, int(rng.lognormvariate(0, 0.6) * attachment_kb * 1024))
+        data = rng.randbytes(size)
+        document_pool.append(data)
+        return data
+
+    session_rows = []
+    record_rows = []
+    points_rowset = []
+    qr_rows = []
+    leave_rows = []
+    attachment_rows = []
+    session_groups = []
+    session_id = 0
+    leave_id = 0
+    attachment_count = 0
+    qr_per_session = max(1, session_minutes * 60 // qr_interval)
+
+    for day in range(weeks * 7):
+        if day % 7 >= 5:
+            continue
+        for slot in range(sessions_per_day):
+            start = semester_start + timedelta(days=day, hours=2 * slot)
+            group_id, members = rng.choice(groups)
+            paired = rng.random() < paired_ratio
+
+            session_id += 1
+            checkin_id = session_id
+            session_rows.append((checkin_id, f'C{checkin_id:07d}', 0, 'checkin', None, admin_id, _fmt(start)))
+            session_groups.append((checkin_id, group_id))
+            ids = [(checkin_id, 'checkin', start)]
+            if paired:
+                session_id += 1
+                session_rows.append((session_id, f'C{session_id:07d}', 0, 'checkout', checkin_id,
+                                     admin_id, _fmt(start + timedelta(hours=1))))
+                session_groups.append((session_id, group_id))
+                ids.append((session_id, 'checkout', start + timedelta(hours=1)))
+
+            for sid, _kind, opened in ids:
+                for q in range(qr_per_session):
+                    qr_at = opened + timedelta(seconds=q * qr_interval)
+                    qr_rows.append((sid, f'tok-{sid}-{q}', _fmt(qr_at),
+                                    _fmt(qr_at + timedelta(seconds=qr_interval + 5))))
+
+            for uid in members:
+                roll = rng.random()
+                if roll < leave_rate:
+                    leave_type = rng.choice(LEAVE_TYPES)
+                    leave_id += 1
+                    requested = start - timedelta(hours=rng.randint(2, 48))
+                    leave_rows.append((leave_id, uid, checkin_id, ids[-1][0] if paired else None, leave_type,
+                                       '生病就医' if leave_type == 'sick' else '参加活动', 'used', admin_id,
+                                       _fmt(requested + timedelta(hours=1)), _fmt(start), _fmt(requested)))
+                    if rng.random() < attachment_rate:
+                        for _ in range(rng.randint(1, 2)):
+                            attachment_count += 1
+                            filename = f'note_{attachment_count}.jpg'
+                            filepath = os.path.join(upload_dir, f'{requested:%Y%m%d%H%M%S}_{attachment_count}_{filename}')
+                            with open(filepath, 'wb') as f:
+                                f.write(attachment_bytes())
+                            attachment_rows.append((leave_id, filename, filepath, _fmt(requested)))
+                    for sid, _kind, opened in ids:
+                        record_rows.append((sid, uid, _fmt(opened), LEAVE_STATUS[leave_type]))
+                    if POINTS[leave_type] != 0:
+                        points_rowset.append((uid, POINTS[leave_type], LEAVE_NAMES[leave_type], 'leave',
+                                              checkin_id, leave_id, admin_id, _fmt(start), 0))
+                elif roll < leave_rate + attendance_rate:
+                    for sid, _kind, opened in ids:
+                        record_rows.append((sid, uid, _fmt(opened + timedelta(seconds=rng.randint(5, 300))), 'present'))
+                    points_rowset.append((uid, POINTS['checkin'], '签到成功', 'checkin',
+                                          ids[-1][0], None, None, _fmt(ids[-1][2]), 0))
+                else:
+                    for sid, kind, opened in ids:
+                        record_rows.append((sid, uid, _fmt(opened + timedelta(minutes=session_minutes)), 'absent'))
+                    points_rowset.append((uid, POINTS['absent'], '签到缺勤', 'absence',
+                                          checkin_id, None, admin_id, _fmt(start + timedelta(minutes=session_minutes)), 0))
+
+    _insert(conn, '''
+        INSERT INTO attendance_sessions (id, activity_code, is_active, session_type, paired_session_id, created_by, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', session_rows)
+    _insert(conn, 'INSERT INTO session_groups (session_id, group_id) VALUES (?, ?)', session_groups)
+    _insert(conn, '''
+        INSERT INTO qr_codes (session_id, qr_token, created_at, expires_at)
+        VALUES (?, ?, ?, ?)
+    ''', qr_rows)
+    _insert(conn, '''
+        INSERT INTO leave_requests (id, user_id, session_id, paired_session_id, leave_type, reason, status,
+                                    approved_by, approved_at, used_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', leave_rows)
+    _insert(conn, '''
+        INSERT INTO leave_attachments (leave_request_id, filename, filepath, uploaded_at)
+        VALUES (?, ?, ?, ?)
+    ''', attachment_rows)
+    _insert(conn, '''
+        INSERT INTO attendance_records (session_id, user_id, checked_in_at, status)
+        VALUES (?, ?, ?, ?)
+    ''', record_rows)
+
+    # Pad the ledger with manual adjustments spread over the semester
+    semester_seconds = weeks * 7 * 86400
+    while len(points_rowset) < points_rows:
+        created = semester_start + timedelta(seconds=rng.randrange(semester_seconds))
+        points_rowset.append((rng.choice(user_ids), rng.choice((0.5, 1.0, 2.0, -1.0)), '活动加分', 'manual',
+                              None, None, admin_id, _fmt(created), 1 if rng.random() < 0.02 else 0))
+    points_rowset.sort(key=lambda row: row[7])
+    _insert(conn, '''
+        INSERT INTO points_records (user_id, points, reason, record_type, session_id, leave_request_id,
+                                    created_by, created_at, is_deleted)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', points_rowset)
+
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+    return {
+        'db_path': db_path,
+        'users': users,
+        'groups': len(groups),
+        'sessions': len(session_rows),
+        'qr_codes': len(qr_rows),
+        'attendance_records': len(record_rows),
+        'leave_requests': len(leave_rows),
+        'leave_attachments': len(attachment_rows),
+        'points_records': len(points_rowset),
+        'db_size_mb': round(os.path.getsize(db_path) / 1024 / 1024, 1),
+        'seconds': round(time.perf_counter() - started, 1)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic benchmark database')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--class-size', type=int, default=50)
+    parser.add_argument('--weeks', type=int, default=18)
+    parser.add_argument('--sessions-per-day', type=int, default=4)
+    parser.add_argument('--paired-ratio', type=float, default=0.5)
+    parser.add_argument('--attendance-rate', type=float, default=0.92)
+    parser.add_argument('--leave-rate', type=float, default=0.03)
+    parser.add_argument('--attachment-rate', type=float, default=0.6)
+    parser.add_argument('--attachment-kb', type=int, default=64)
+    parser.add_argument('--duplicate-rate', type=float, default=0.3)
+    parser.add_argument('--points-rows', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    summary = generate(db_path=args.db, upload_dir=args.uploads, users=args.users,
+                       class_size=args.class_size, weeks=args.weeks,
+                       sessions_per_day=args.sessions_per_day, paired_ratio=args.paired_ratio,
+                       attendance_rate=args.attendance_rate, leave_rate=args.leave_rate,
+                       attachment_rate=args.attachment_rate, attachment_kb=args.attachment_kb,
+                       duplicate_rate=args.duplicate_rate, points_rows=args.points_rows,
+                       seed=args.seed)
+    for key, value in summary.items():
+        print(f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Approving a pile of leave requests before an event: one POST each vs bulk.
+
+A copy of the generated database gets --requests pending leave requests
+from the members of one session. Each variant starts from that state
+and clears the list the way an admin would in the browser:
+
+    per-request   POST /admin/leave/<id>/approve for every request, each
+                  followed by the redirect back to the approval page
+    bulk          one POST /admin/leave/<session>/approval/bulk with all
+                  of them selected, followed by the redirect
+
+The report has the wall time, the number of HTTP round trips and the
+write transactions (commits) each variant needed.
+
+    python -m bench.leave_approval --requests 300
+"""
+import os
+import sys
+import time
+import argparse
+
+from bench.common import (BENCH_DATA, DEFAULT_DB, configure_env, working_copy, client_for, count_commits,
+                          run_metadata, write_report)
+
+
+def seed_pending(conn, session_id, count):
+    """Reset the bench's leave requests to pending, creating them on the first call"""
+    from database import roster_cte
+    existing = [row[0] for row in conn.execute("SELECT id FROM leave_requests WHERE reason = 'bench-approval'")]
+    if not existing:
+        roster_sql, roster_params = roster_cte(session_id)
+        user_ids = [row[0] for row in conn.execute(roster_sql + 'SELECT user_id FROM roster', roster_params)]
+        # Rosters can be smaller than the pile; a student may have several pending requests
+        conn.executemany('''
+            INSERT INTO leave_requests (user_id, leave_type, reason, status) VALUES (?, ?, 'bench-approval', 'pending')
+        ''', ((user_ids[i % len(user_ids)], ('public', 'personal', 'sick')[i % 3]) for i in range(count)))
+        existing = [row[0] for row in conn.execute("SELECT id FROM leave_requests WHERE reason = 'bench-approval'")]
+    conn.execute('''
+        UPDATE leave_requests SET status = 'pending', approved_by = NULL, approved_at = NULL
+        WHERE reason = 'bench-approval'
+    ''')
+    conn.commit()
+    return existing
+
+
+def approved_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM leave_requests WHERE reason = 'bench-approval' AND status = 'approved'"
+                        ).fetchone()[0]
+
+
+def measure(variant, client, conn, session_id, count):
+    leave_ids = seed_pending(conn, session_id, count)
+    round_trips = 0
+    started = time.perf_counter()
+    with count_commits() as commits:
+        client.get(f'/admin/leave/{session_id}/approval')
+        round_trips += 1
+        if variant == 'per-request':
+            for leave_id in leave_ids:
+                client.post(f'/admin/leave/{leave_id}/approve',
+                            data={'action': 'approve', 'session_id': session_id}, follow_redirects=True)
+                round_trips += 2
+        else:
+            client.post(f'/admin/leave/{session_id}/approval/bulk',
+                        data={'action': 'approve', 'leave_ids': leave_ids}, follow_redirects=True)
+            round_trips += 2
+    elapsed = time.perf_counter() - started
+
+    return {
+        'variant': variant,
+        'requests': len(leave_ids),
+        'approved': approved_count(conn),
+        'wall_s': round(elapsed, 3),
+        'round_trips': round_trips,
+        'commits': commits[0]
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare approving leave requests one by one and in bulk')
+    parser.add_argument('--variants', default='per-request,bulk')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'leave_approval'))
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    target = working_copy(args.db, args.work_dir)
+    configure_env(target, args.work_dir)
+    from app import app
+    from database import get_db
+
+    conn = get_db()
+    admin_id = conn.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    conn.execute('UPDATE users SET must_change_password = 0 WHERE id = ?', (admin_id,))
+    session_id = conn.execute("SELECT MAX(id) FROM attendance_sessions WHERE session_type = 'checkin'").fetchone()[0]
+    conn.commit()
+    client = client_for(app, admin_id)
+
+    results = [measure(variant, client, conn, session_id, args.requests)
+               for variant in args.variants.split(',')]
+    conn.close()
+    write_report({'meta': run_metadata(db_path=args.db, requests=args.requests), 'variants': results}, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Page weight measurement: bytes a browser downloads per page.
+
+For each page it records the HTML size (raw and gzip-compressed), every
+stylesheet/script the page references with the bytes actually served for
+`Accept-Encoding: br, gzip`, and the resulting first-visit and
+repeat-visit totals (assets with immutable cache headers are not
+re-fetched on repeat visits). --baseline compares with another revision:
+
+    python -m bench.pages --baseline HEAD~1
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import argparse
+import subprocess
+
+from bench.common import (BENCH_DATA, DEFAULT_DB, DEFAULT_UPLOADS, configure_env, working_copy,
+                          client_for, run_at_revision, run_metadata, write_report)
+
+ASSET_PATTERN = re.compile(r'<(?:link[^>]+href|script[^>]+src)="([^"]+)"')
+ACCEPT = {'Accept-Encoding': 'br, gzip'}
+
+
+def transfer_size(response):
+    """Body bytes on the wire; uncompressed responses are counted as a gzip-6 proxy would send them"""
+    body = response.get_data()
+    if response.headers.get('Content-Encoding'):
+        return len(body)
+    return len(gzip.compress(body, compresslevel=6))
+
+
+def measure(db_path, upload_dir, work_dir, app_root=None):
+    target = working_copy(db_path, work_dir)
+    configure_env(target, work_dir, upload_dir)
+    root = app_root or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if os.path.exists(os.path.join(root, 'assets.py')):
+        # Measure what production serves: the fingerprinted, precompressed build
+        subprocess.run([sys.executable, 'assets.py'], cwd=root, check=True, capture_output=True)
+    if app_root:
+        sys.path.insert(0, app_root)
+
+    from app import app
+    from database import get_db
+    app.config['TESTING'] = True
+    conn = get_db()
+    admin_id = conn.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    student_id = conn.execute('SELECT id FROM users WHERE is_admin = 0 ORDER BY id LIMIT 1').fetchone()[0]
+    conn.close()
+
+    anonymous = app.test_client()
+    clients = {'anonymous': anonymous, 'student': client_for(app, student_id), 'admin': client_for(app, admin_id)}
+    pages = {
+        'login': ('anonymous', '/login'),
+        'qr_screen': ('anonymous', '/qr'),
+        'index': ('student', '/'),
+        'admin_dashboard': ('admin', '/admin'),
+        'admin_attendance': ('admin', '/admin/attendance')
+    }
+
+    results = {}
+    for name, (who, path) in pages.items():
+        response = clients[who].get(path, headers=ACCEPT)
+        html_transfer = transfer_size(response)
+        response.close()
+        response = clients[who].get(path, headers={'Accept-Encoding': 'identity'})
+        html = response.get_data()
+        assets = []
+        for url in ASSET_PATTERN.findall(html.decode('utf-8', 'replace')):
+            if not url.startswith('/'):
+                continue
+            asset = anonymous.get(url, headers=ACCEPT)
+            cache_control = asset.headers.get('Cache-Control', '')
+            assets.append({
+                'url': url,
+                'status': asset.status_code,
+                'transfer_bytes': transfer_size(asset),
+                'content_encoding': asset.headers.get('Content-Encoding'),
+                'immutable': 'immutable' in cache_control
+            })
+            asset.close()
+        response.close()
+        results[name] = {
+            'status': response.status_code,
+            'html_bytes': len(html),
+            'html_transfer_bytes': html_transfer,
+            'assets': assets,
+            'first_visit_bytes': html_transfer + sum(a['transfer_bytes'] for a in assets),
+            'repeat_visit_bytes': html_transfer,
+            'repeat_visit_revalidations': sum(1 for a in assets if not a['immutable'])
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure page weight in bytes')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'pages'))
+    parser.add_argument('--baseline', default=None, help='git revision to compare against')
+    parser.add_argument('--app-root', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--raw', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    if args.raw:
+        print(json.dumps(measure(args.db, args.uploads, args.work_dir, args.app_root)))
+        return
+
+    baseline = None
+    if args.baseline:
+        baseline = run_at_revision('bench.pages', args.baseline, [
+            '--db', args.db, '--uploads', args.uploads, '--work-dir', os.path.join(args.work_dir, 'baseline')])
+    current = measure(args.db, args.uploads, os.path.join(args.work_dir, 'current'))
+    report = {'meta': run_metadata(db_path=args.db, baseline=args.baseline), 'current': current}
+    if baseline:
+        report['baseline'] = baseline
+        report['comparison'] = {
+            page: {key: {'before': baseline[page][key], 'after': current[page][key]}
+                   for key in ('html_bytes', 'html_transfer_bytes', 'first_visit_bytes', 'repeat_visit_bytes')}
+            for page in current if page in baseline
+        }
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Awarding a bonus to many students: one form POST each vs a batch.
+
+On a copy of the generated database, --students students get the same
+points adjustment the way an admin would submit it:
+
+    per-request   POST /admin/points/add for every student, each followed
+                  by the redirect back to /admin/points
+    batch         one POST /admin/points/batch with the students selected
+                  (plus the preview before it), then the redirect
+    csv           the same as a CSV upload: preview, then the confirm post
+
+The report has the wall time, the number of HTTP round trips, the
+write transactions (commits) and the records added.
+
+    python -m bench.points_batch --students 300
+"""
+import io
+import os
+import sys
+import time
+import argparse
+
+from bench.common import (BENCH_DATA, DEFAULT_DB, configure_env, working_copy, client_for, count_commits,
+                          run_metadata, write_report)
+
+VARIANTS = ('per-request', 'batch', 'csv')
+
+
+def measure(variant, client, conn, students):
+    before = conn.execute('SELECT COUNT(*) FROM points_records').fetchone()[0]
+    reason = f'bench-{variant}'
+    round_trips = 0
+    started = time.perf_counter()
+    with count_commits() as commits:
+        if variant == 'per-request':
+            for user_id, _student_id in students:
+                client.post('/admin/points/add', data={'user_id': user_id, 'points': '2', 'reason': reason},
+                            follow_redirects=True)
+                round_trips += 2
+        elif variant == 'batch':
+            form = {'student_ids': [student_id for _user_id, student_id in students], 'points': '2', 'reason': reason}
+            client.post('/admin/points/batch', data={**form, 'dry_run': '1'})
+            client.post('/admin/points/batch', data={**form, 'dry_run': '0'}, follow_redirects=True)
+            round_trips += 3
+        else:
+            text = '学工号,分数,理由\n' + ''.join(f'{student_id},2,{reason}\n' for _user_id, student_id in students)
+            client.post('/admin/points/batch', data={'dry_run': '1', 'file': (io.BytesIO(text.encode()), 'bonus.csv')},
+                        content_type='multipart/form-data')
+            client.post('/admin/points/batch', data={'csv_text': text}, follow_redirects=True)
+            round_trips += 3
+    elapsed = time.perf_counter() - started
+
+    return {
+        'variant': variant,
+        'students': len(students),
+        'wall_s': round(elapsed, 3),
+        'round_trips': round_trips,
+        'commits': commits[0],
+        'records_added': conn.execute('SELECT COUNT(*) FROM points_records').fetchone()[0] - before
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare per-student and batch points adjustments')
+    parser.add_argument('--variants', default=','.join(VARIANTS))
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'points_batch'))
+    parser.add_argument('--students', type=int, default=300)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    target = working_copy(args.db, args.work_dir)
+    configure_env(target, args.work_dir)
+    from app import app
+    from database import get_db
+
+    conn = get_db()
+    admin_id = conn.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    conn.execute('UPDATE users SET must_change_password = 0 WHERE id = ?', (admin_id,))
+    conn.commit()
+    students = [tuple(row) for row in conn.execute(
+        'SELECT id, student_id FROM users WHERE is_admin = 0 ORDER BY id LIMIT ?', (args.students,))]
+    client = client_for(app, admin_id)
+
+    results = [measure(variant, client, conn, students) for variant in args.variants.split(',')]
+    conn.close()
+    write_report({'meta': run_metadata(db_path=args.db, students=args.students), 'variants': results}, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+SQLite performance profiles on the aggregate admin pages.
+
+For each DB_PROFILE (see database.DB_PROFILES) a fresh copy of the
+generated database is opened by the app (so a page size change is
+applied, and timed, like a real upgrade) and `/admin/points` and
+`/admin/export/leave-history` are measured twice:
+
+    cold   the database file is evicted from the OS page cache
+           (posix_fadvise DONTNEED) before every request
+    warm   the file stays cached between requests
+
+Each profile runs in its own process because the profile is read at
+import time:
+
+    python -m bench.profiles --profiles default,large --iterations 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from bench.common import (ROOT, BENCH_DATA, DEFAULT_DB, DEFAULT_UPLOADS, configure_env, working_copy,
+                          summarize, client_for, run_metadata, write_report)
+
+ROUTES = {
+    'admin_points': '/admin/points',
+    'export_leave_history': '/admin/export/leave-history'
+}
+
+
+def evict(path):
+    """Drop a file's pages from the OS page cache"""
+    for name in (path, path + '-wal'):
+        if not os.path.exists(name):
+            continue
+        fd = os.open(name, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def measure(profile, db_path, upload_dir, work_dir, iterations):
+    target = working_copy(db_path, work_dir)
+    configure_env(target, work_dir, upload_dir)
+    os.environ['DB_PROFILE'] = profile
+
+    started = time.perf_counter()
+    from app import app
+    import database
+    startup = time.perf_counter() - started
+    app.config['TESTING'] = True
+
+    conn = database.get_db(readonly=True)
+    pragmas = {name: conn.execute(f'PRAGMA {name}').fetchone()[0]
+               for name in ('page_size', 'cache_size', 'mmap_size', 'temp_store', 'journal_mode')}
+    admin_id = conn.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    conn.close()
+    admin = client_for(app, admin_id)
+
+    results = {}
+    for name, path in ROUTES.items():
+        results[name] = {}
+        for cache in ('cold', 'warm'):
+            admin.get(path).close()
+            latencies, codes = [], {}
+            total = 0.0
+            for _ in range(iterations):
+                if cache == 'cold':
+                    evict(target)
+                t0 = time.perf_counter()
+                response = admin.get(path)
+                response.get_data()
+                latencies.append(time.perf_counter() - t0)
+                total += latencies[-1]
+                codes[response.status_code] = codes.get(response.status_code, 0) + 1
+                response.close()
+            results[name][cache] = summarize(latencies, total, codes)
+    return {
+        'profile': profile,
+        'settings': database.DB_PRAGMAS,
+        'pragmas': pragmas,
+        'file_mb': round(os.path.getsize(target) / 1024 / 1024, 2),
+        'startup_s': round(startup, 3),
+        'routes': results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare SQLite performance profiles')
+    parser.add_argument('--profiles', default='default,large')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'profiles'))
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--profile', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--raw', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    if args.raw:
+        print(json.dumps(measure(args.profile, args.db, args.uploads, args.work_dir, args.iterations)))
+        return
+
+    results = {}
+    for profile in args.profiles.split(','):
+        command = [sys.executable, '-m', 'bench.profiles', '--raw', '--profile', profile,
+                   '--db', args.db, '--uploads', args.uploads, '--iterations', str(args.iterations),
+                   '--work-dir', os.path.join(args.work_dir, profile)]
+        output = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        results[profile] = json.loads(output)
+
+    report = {'meta': run_metadata(db_path=args.db, iterations=args.iterations), 'profiles': results}
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Rendering micro-benchmark for the timestamp-heavy pages.
+
+Measures `/admin/attendance/<id>/records` for the session with the most
+records and `/` for the student with the longest points history. With
+--baseline the same measurement is repeated against another git revision
+(checked out to a temporary directory) so the two can be compared:
+
+    python -m bench.render --baseline HEAD~1
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+from bench.common import (BENCH_DATA, DEFAULT_DB, DEFAULT_UPLOADS, configure_env, working_copy,
+                          summarize, client_for, run_at_revision, run_metadata, write_report)
+
+
+def pick_targets(db_path):
+    import sqlite3
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    session_id, records = conn.execute('''
+        SELECT session_id, COUNT(*) FROM attendance_records
+        GROUP BY session_id ORDER BY 2 DESC LIMIT 1
+    ''').fetchone()
+    user_id, points = conn.execute('''
+        SELECT user_id, COUNT(*) FROM points_records
+        WHERE is_deleted = 0 GROUP BY user_id ORDER BY 2 DESC LIMIT 1
+    ''').fetchone()
+    admin_id = conn.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    conn.close()
+    return {'session_id': session_id, 'session_records': records,
+            'user_id': user_id, 'user_points_rows': points, 'admin_id': admin_id}
+
+
+def measure(db_path, upload_dir, work_dir, iterations, app_root=None):
+    target = working_copy(db_path, work_dir)
+    configure_env(target, work_dir, upload_dir)
+    if app_root:
+        sys.path.insert(0, app_root)
+    targets = pick_targets(target)
+
+    from app import app
+    app.config['TESTING'] = True
+    admin = client_for(app, targets['admin_id'])
+    student = client_for(app, targets['user_id'])
+    pages = {
+        'attendance_records': lambda: admin.get(f"/admin/attendance/{targets['session_id']}/records"),
+        'index': lambda: student.get('/')
+    }
+
+    results = {}
+    for name, fetch in pages.items():
+        fetch().close()  # warm up templates and caches
+        latencies, codes = [], {}
+        started = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            response = fetch()
+            response.get_data()
+            latencies.append(time.perf_counter() - t0)
+            codes[response.status_code] = codes.get(response.status_code, 0) + 1
+            response.close()
+        results[name] = summarize(latencies, time.perf_counter() - started, codes)
+    return {'targets': targets, 'pages': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark rendering of timestamp-heavy pages')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'render'))
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--baseline', default=None, help='git revision to compare against')
+    parser.add_argument('--app-root', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--raw', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    if args.raw:
+        print(json.dumps(measure(args.db, args.uploads, args.work_dir, args.iterations, args.app_root)))
+        return
+
+    baseline = None
+    if args.baseline:
+        baseline = run_at_revision('bench.render', args.baseline, [
+            '--db', args.db, '--uploads', args.uploads, '--iterations', str(args.iterations),
+            '--work-dir', os.path.join(args.work_dir, 'baseline')])
+    current = measure(args.db, args.uploads, os.path.join(args.work_dir, 'current'), args.iterations)
+    report = {'meta': run_metadata(db_path=args.db, iterations=args.iterations, baseline=args.baseline),
+              'targets': current['targets'], 'current': current['pages']}
+    if baseline:
+        report['baseline'] = baseline['pages']
+        report['speedup_p50'] = {
+            page: round(baseline['pages'][page]['p50_ms'] / current['pages'][page]['p50_ms'], 2)
+            for page in current['pages']
+        }
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Re-scoring past sessions after a points setting change: one transaction vs the chunked job.
+
+Each variant runs on a fresh copy of the database while a writer thread
+keeps writing attendance records into the newest session (a check-in
+running elsewhere) and records how long each of its commits took:
+
+    preview    the rescore_points job as a dry run (the diff report)
+    single     the job with a single batch applied in one write
+               transaction
+    chunked    the rescore_points job: batches of sessions holding about
+               BULK_CHUNK_ROWS attendance records, each applied in write
+               transactions of RESCORE_WRITE_ROWS changes
+
+The values mimic a new scale: absences -2 -> -3, check-ins 1 -> 2 and
+public leave 0 -> 0.5 (which adds records where none were written). The
+report has the wall time, the writer's commit latency (p50/p99/max)
+while it ran, and the job's diff. Use the large generated database:
+
+    python -m bench.rescore --db bench/data/large/database.db
+"""
+import os
+import sys
+import time
+import argparse
+
+from bench.common import BENCH_DATA, DEFAULT_DB, configure_env, working_copy, percentile, run_metadata, write_report
+from bench.session_delete import Writer, connect
+
+VARIANTS = ('preview', 'single', 'chunked')
+VALUES = {'absent': (-2, -3), 'present': (1, 2), 'public_leave': (0, 0.5)}
+
+
+def measure(variant, db_path, work_dir):
+    import bulk
+    import jobs
+
+    target = working_copy(db_path, work_dir)
+    conn = connect(target)
+    conn.execute('PRAGMA journal_mode = WAL')
+    session_ids = [row[0] for row in conn.execute('SELECT id FROM attendance_sessions')]
+    other = max(session_ids)
+    user_ids = [row[0] for row in conn.execute('SELECT id FROM users WHERE is_admin = 0 LIMIT 500')]
+
+    writer = Writer(target, other, user_ids)
+    writer.start()
+    time.sleep(0.5)
+    baseline = len(writer.latencies)
+
+    chunk_rows, write_rows = bulk.BULK_CHUNK_ROWS, bulk.RESCORE_WRITE_ROWS
+    if variant == 'single':
+        bulk.BULK_CHUNK_ROWS = bulk.RESCORE_WRITE_ROWS = sys.maxsize
+    started = time.perf_counter()
+    try:
+        job_id = bulk.queue_rescore(conn, session_ids, VALUES, dry_run=variant == 'preview')
+        job = jobs.run(conn, job_id)
+    finally:
+        bulk.BULK_CHUNK_ROWS, bulk.RESCORE_WRITE_ROWS = chunk_rows, write_rows
+    elapsed = time.perf_counter() - started
+
+    time.sleep(0.2)
+    writer.stop.set()
+    writer.join()
+    during = writer.latencies[baseline:]
+    conn.close()
+
+    return {
+        'variant': variant,
+        'sessions': len(session_ids),
+        'rescore_s': round(elapsed, 3),
+        'status': job['status'],
+        'writer_commits': len(during),
+        'writer_p50_ms': round(percentile(during, 50) * 1000, 2),
+        'writer_p99_ms': round(percentile(during, 99) * 1000, 2),
+        'writer_max_ms': round(max(during) * 1000, 2),
+        'diff': job['result']['statuses'] if job['result'] else job['error']
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark re-scoring past sessions for new point values')
+    parser.add_argument('--variants', default=','.join(VARIANTS))
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'rescore'))
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    # Bring the generated database up to the current schema (adds the jobs table)
+    configure_env(args.db, args.work_dir)
+    from database import init_db
+    init_db()
+
+    results = [measure(variant, args.db, os.path.join(args.work_dir, variant))
+               for variant in args.variants.split(',')]
+    write_report({'meta': run_metadata(db_path=args.db, chunk_rows=int(os.getenv('BULK_CHUNK_ROWS', '20000'))),
+                  'variants': results}, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Drive the hot routes through the Flask test client and report as JSON.
+
+Each run works on a fresh copy of a generated database (see
+bench/generate.py), so numbers are comparable run to run:
+
+    python -m bench.generate --users 5000 --points-rows 2000000
+    python -m bench.run --output bench/data/report.json
+"""
+import os
+import sys
+import time
+import argparse
+
+from bench.common import (BENCH_DATA, DEFAULT_DB, DEFAULT_UPLOADS, configure_env, working_copy,
+                          summarize, client_for, table_counts, run_metadata, write_report)
+
+ROUTES = ('checkin', 'qr_status', 'qr_generate', 'index', 'admin_points', 'export', 'end_session')
+
+
+def measure(fn, iterations):
+    """Call fn(i) `iterations` times and summarize latencies and status codes"""
+    latencies = []
+    status_codes = {}
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        response = fn(i)
+        latencies.append(time.perf_counter() - t0)
+        status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+        response.close()
+    return summarize(latencies, time.perf_counter() - started, status_codes)
+
+
+def open_session(get_db, admin_id, group_id):
+    """Open a paired check-in/check-out session for one group, as the admin page would"""
+    conn = get_db()
+    cursor = conn.cursor()
+    code = f'BENCH{time.time_ns()}'
+    cursor.execute('''
+        INSERT INTO attendance_sessions (activity_code, session_type, created_by)
+        VALUES (?, 'checkin', ?)
+    ''', (code, admin_id))
+    checkin_id = cursor.lastrowid
+    cursor.execute('''
+        INSERT INTO attendance_sessions (activity_code, session_type, paired_session_id, created_by)
+        VALUES (?, 'checkout', ?, ?)
+    ''', (code + '-OUT', checkin_id, admin_id))
+    checkout_id = cursor.lastrowid
+    cursor.executemany('INSERT INTO session_groups (session_id, group_id) VALUES (?, ?)',
+                       [(checkin_id, group_id), (checkout_id, group_id)])
+    conn.commit()
+    conn.close()
+    return checkin_id, checkout_id
+
+
+def run(db_path=DEFAULT_DB, upload_dir=DEFAULT_UPLOADS, work_dir=None, iterations=200,
+        heavy_iterations=5, routes=ROUTES):
+    work_dir = work_dir or os.path.join(BENCH_DATA, 'run')
+    target = working_copy(db_path, work_dir)
+    configure_env(target, work_dir, upload_dir)
+
+    from app import app
+    from database import get_db, get_setting
+    app.config['TESTING'] = True
+
+    conn = get_db()
+    admin_id = conn.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    group = conn.execute('''
+        SELECT g.id, COUNT(*) AS members
+        FROM user_groups g JOIN group_members gm ON gm.group_id = g.id
+        GROUP BY g.id ORDER BY members DESC LIMIT 1
+    ''').fetchone()
+    students = [row[0] for row in conn.execute('SELECT id FROM users WHERE is_admin = 0 ORDER BY id')]
+    conn.close()
+
+    admin = client_for(app, admin_id)
+    checkin_id, checkout_id = open_session(get_db, admin_id, group['id'])
+    interval = max(int(get_setting('qr_refresh_interval', '15')), 1)
+    results = {}
+
+    if 'qr_generate' in routes:
+        results['qr_generate'] = measure(lambda i: admin.get(f'/api/qr/generate/{checkin_id}'), iterations)
+
+    if 'checkin' in routes:
+        clients = [client_for(app, uid) for uid in students[:iterations]]
+        issued = {}
+        rejected = []
+
+        def checkin(i):
+            # The screen inserts each slot's token; refresh it when the slot rotates. Use the
+            # token it stored: near a slot boundary the route may already be in the next slot
+            slot = int(time.time() // interval)
+            if slot not in issued:
+                admin.get(f'/api/qr/generate/{checkin_id}').close()
+                conn = get_db(readonly=True)
+                issued[slot] = conn.execute('SELECT qr_token FROM qr_codes WHERE session_id = ? ORDER BY id DESC LIMIT 1',
+                                            (checkin_id,)).fetchone()[0]
+                conn.close()
+            response = clients[i].get(f'/checkin/{issued[slot]}')
+            # An expired token still answers 200, with an error page
+            if '签到成功' not in response.get_data(as_text=True):
+                rejected.append(i)
+            return response
+        results['checkin'] = measure(checkin, min(iterations, len(clients)))
+        conn = get_db(readonly=True)
+        results['checkin']['recorded'] = conn.execute(
+            'SELECT COUNT(*) FROM attendance_records WHERE session_id = ?', (checkin_id,)).fetchone()[0]
+        conn.close()
+        results['checkin']['rejected'] = len(rejected)
+
+    if 'qr_status' in routes:
+        results['qr_status'] = measure(lambda i: admin.get(f'/api/qr/status/{checkin_id}'), iterations)
+
+    if 'index' in routes:
+        clients = [client_for(app, uid) for uid in students[:iterations]]
+        results['index'] = measure(lambda i: clients[i % len(clients)].get('/'), iterations)
+
+    if 'admin_points' in routes:
+        results['admin_points'] = measure(lambda i: admin.get('/admin/points'), heavy_iterations)
+
+    if 'export' in routes:
+        results['export'] = measure(lambda i: admin.get('/admin/export/leave-history'), heavy_iterations)
+
+    if 'end_session' in routes:
+        sessions = [checkin_id] + [open_session(get_db, admin_id, group['id'])[0]
+                                   for _ in range(heavy_iterations - 1)]
+        results['end_session'] = measure(
+            lambda i: admin.post(f'/admin/attendance/{sessions[i]}/end'), len(sessions))
+
+    return {
+        'meta': run_metadata(db_path=db_path, iterations=iterations, heavy_iterations=heavy_iterations,
+                             group_size=group['members']),
+        'dataset': table_counts(target, ('users', 'attendance_sessions', 'attendance_records',
+                                         'leave_requests', 'leave_attachments', 'points_records',
+                                         'qr_codes')),
+        'routes': results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hot routes on a generated database')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--work-dir', default=None)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--heavy-iterations', type=int, default=5,
+                        help='iterations for admin pages, export and end-session')
+    parser.add_argument('--routes', default=','.join(ROUTES))
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    report = run(db_path=args.db, upload_dir=args.uploads, work_dir=args.work_dir,
+                 iterations=args.iterations, heavy_iterations=args.heavy_iterations,
+                 routes=tuple(args.routes.split(',')))
+    write_report(report, args.output)
+
+    checkin = report['routes'].get('checkin')
+    if checkin and checkin['recorded'] != checkin['requests']:
+        print(f"only {checkin['recorded']} of {checkin['requests']} check-ins were recorded "
+              f"({checkin['rejected']} rejected); the check-in numbers are not comparable", file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
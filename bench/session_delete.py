@@ -0,0 +1,177 @@
+"""
+Deleting a week of attendance sessions: one transaction vs the chunked job.
+
+Each variant runs on a fresh copy of the database while a writer thread
+keeps writing attendance records into a session that is not being
+deleted (a check-in running elsewhere) and records how long each of its
+commits took:
+
+    single     what /admin/attendance/<id>/delete did before, for every
+               session of the range: the per-session statements in one
+               transaction
+    chunked    bulk.queue_session_delete + the delete_sessions job, at
+               most BULK_CHUNK_ROWS rows per transaction
+
+The report has the wall time of the delete, the writer's commit latency
+(p50/p99/max) while it ran, and the rows left pointing at deleted
+sessions. Use the large generated database:
+
+    python -m bench.session_delete --db bench/data/large/database.db --days 7
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+
+from bench.common import BENCH_DATA, DEFAULT_DB, configure_env, working_copy, percentile, run_metadata, write_report
+
+VARIANTS = ('single', 'chunked')
+PER_SESSION_STATEMENTS = (
+    'UPDATE points_records SET is_deleted = 1 WHERE session_id = ? AND is_deleted = 0',
+    'DELETE FROM qr_codes WHERE session_id = ?',
+    'DELETE FROM attendance_records WHERE session_id = ?',
+    'UPDATE leave_requests SET session_id = NULL WHERE session_id = ?',
+    'UPDATE leave_requests SET paired_session_id = NULL WHERE paired_session_id = ?',
+    'DELETE FROM attendance_sessions WHERE id = ?',
+)
+
+
+def connect(db_path):
+    from database import register_functions
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.row_factory = sqlite3.Row
+    register_functions(conn)
+    return conn
+
+
+def week_sessions(conn, days):
+    """The sessions created in the first `days` days of the data (plus their pairs)"""
+    first = conn.execute('SELECT MIN(created_at_ms) FROM attendance_sessions').fetchone()[0]
+    ids = [row[0] for row in conn.execute(
+        'SELECT id FROM attendance_sessions WHERE created_at_ms < ?', (first + days * 86400 * 1000,))]
+    placeholders = ','.join('?' * len(ids))
+    ids += [row[0] for row in conn.execute(f'''
+        SELECT paired_session_id FROM attendance_sessions WHERE id IN ({placeholders}) AND paired_session_id IS NOT NULL
+        UNION SELECT id FROM attendance_sessions WHERE paired_session_id IN ({placeholders})
+    ''', ids + ids)]
+    return sorted(set(ids))
+
+
+class Writer(threading.Thread):
+    """Writes one attendance record per iteration and times each commit"""
+
+    def __init__(self, db_path, session_id, user_ids):
+        super().__init__(daemon=True)
+        self.db_path, self.session_id, self.user_ids = db_path, session_id, user_ids
+        self.latencies = []
+        self.stop = threading.Event()
+
+    def run(self):
+        conn = connect(self.db_path)
+        i = 0
+        while not self.stop.is_set():
+            started = time.perf_counter()
+            conn.execute('''
+                INSERT OR REPLACE INTO attendance_records (session_id, user_id, status)
+                VALUES (?, ?, 'present')
+            ''', (self.session_id, self.user_ids[i % len(self.user_ids)]))
+            conn.commit()
+            self.latencies.append(time.perf_counter() - started)
+            i += 1
+            time.sleep(0.005)
+        conn.close()
+
+
+def leftovers(conn, session_ids):
+    placeholders = ','.join('?' * len(session_ids))
+    return {
+        'attendance_records': conn.execute(
+            f'SELECT COUNT(*) FROM attendance_records WHERE session_id IN ({placeholders})', session_ids).fetchone()[0],
+        'qr_codes': conn.execute(
+            f'SELECT COUNT(*) FROM qr_codes WHERE session_id IN ({placeholders})', session_ids).fetchone()[0],
+        'points_records': conn.execute(
+            f'SELECT COUNT(*) FROM points_records WHERE is_deleted = 0 AND session_id IN ({placeholders})',
+            session_ids).fetchone()[0],
+        'session_groups': conn.execute(
+            f'SELECT COUNT(*) FROM session_groups WHERE session_id IN ({placeholders})', session_ids).fetchone()[0]
+    }
+
+
+def measure(variant, db_path, work_dir, days):
+    import bulk
+    import jobs
+
+    target = working_copy(db_path, work_dir)
+    conn = connect(target)
+    conn.execute('PRAGMA journal_mode = WAL')
+    session_ids = week_sessions(conn, days)
+    other = conn.execute('SELECT MAX(id) FROM attendance_sessions').fetchone()[0]
+    user_ids = [row[0] for row in conn.execute('SELECT id FROM users WHERE is_admin = 0 LIMIT 500')]
+
+    writer = Writer(target, other, user_ids)
+    writer.start()
+    time.sleep(0.5)
+    baseline = len(writer.latencies)
+
+    started = time.perf_counter()
+    transactions = 1
+    if variant == 'single':
+        conn.execute('BEGIN IMMEDIATE')
+        for sid in session_ids:
+            for sql in PER_SESSION_STATEMENTS:
+                conn.execute(sql, (sid,))
+        conn.commit()
+    else:
+        job_id, _codes = bulk.queue_session_delete(conn, session_ids)
+        job = jobs.run(conn, job_id)
+        # The queueing transaction, then one per full chunk plus the last one
+        transactions = 1 + job['progress'] // bulk.BULK_CHUNK_ROWS + 1
+    elapsed = time.perf_counter() - started
+
+    time.sleep(0.2)
+    writer.stop.set()
+    writer.join()
+    during = writer.latencies[baseline:]
+
+    result = {
+        'variant': variant,
+        'sessions': len(session_ids),
+        'delete_s': round(elapsed, 3),
+        'transactions': transactions,
+        'writer_commits': len(during),
+        'writer_p50_ms': round(percentile(during, 50) * 1000, 2),
+        'writer_p99_ms': round(percentile(during, 99) * 1000, 2),
+        'writer_max_ms': round(max(during) * 1000, 2),
+        'leftovers': leftovers(conn, session_ids)
+    }
+    conn.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark deleting a range of attendance sessions')
+    parser.add_argument('--variants', default=','.join(VARIANTS))
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'session_delete'))
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    # Bring the generated database up to the current schema (adds the jobs table)
+    configure_env(args.db, args.work_dir)
+    from database import init_db
+    init_db()
+
+    results = [measure(variant, args.db, os.path.join(args.work_dir, variant), args.days)
+               for variant in args.variants.split(',')]
+    write_report({'meta': run_metadata(db_path=args.db, days=args.days, chunk_rows=int(os.getenv('BULK_CHUNK_ROWS', '20000'))),
+                  'variants': results}, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
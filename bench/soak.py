@@ -0,0 +1,280 @@
+"""
+Semester-scale soak test: simulate weeks of daily sessions at accelerated speed.
+
+Each simulated day opens paired check-in/check-out sessions for class
+groups, rotates their QR codes through the real `/api/qr/generate` route
+(the rotation clock is fast-forwarded), checks students in, approves a few
+leaves, adds manual points and ends the sessions. After every day it
+records the database file size, table row counts, per-table/index sizes
+(from dbstat) and route latencies, then emits a trend report:
+
+    python -m bench.generate --users 2000 --weeks 0 --points-rows 0
+    python -m bench.soak --days 90 --output bench/data/soak.json --max-drift 0.5
+
+With --max-drift the command exits non-zero when any probed route got
+slower than that fraction between the first and last days.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+
+from bench.common import (BENCH_DATA, DEFAULT_DB, DEFAULT_UPLOADS, configure_env, working_copy,
+                          percentile, client_for, peak_rss_mb, run_metadata, write_report)
+
+TABLES = ('users', 'attendance_sessions', 'attendance_records', 'leave_requests', 'leave_attachments',
+          'points_records', 'qr_codes', 'session_groups')
+PROBES = ('index', 'qr_status', 'admin_attendance', 'admin_points', 'admin_leave', 'export')
+
+
+class SimClock:
+    """Stand-in for the `time` module of app_attendance so QR slots rotate at simulated speed"""
+
+    def __init__(self):
+        self.offset = 0.0
+
+    def time(self):
+        return time.time() + self.offset
+
+    def advance(self, seconds):
+        self.offset += seconds
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def p50_ms(latencies):
+    return round(percentile(latencies, 50) * 1000, 3) if latencies else None
+
+
+def timed_call(latencies, fn):
+    started = time.perf_counter()
+    response = fn()
+    latencies.append(time.perf_counter() - started)
+    response.close()
+    return response
+
+
+def storage_stats(db_path):
+    """File size, row counts and per-table/index sizes of the database"""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    rows = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in TABLES}
+    try:
+        sizes = {name: round(size / 1024, 1) for name, size in conn.execute(
+            'SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC')}
+    except sqlite3.OperationalError:
+        # SQLite built without SQLITE_ENABLE_DBSTAT_VTAB
+        sizes = {}
+    conn.close()
+    size = os.path.getsize(db_path)
+    if os.path.exists(db_path + '-wal'):
+        size += os.path.getsize(db_path + '-wal')
+    return round(size / 1024 / 1024, 3), rows, sizes
+
+
+def slope(values):
+    """Least-squares slope per day of a series (None values skipped)"""
+    points = [(x, y) for x, y in enumerate(values) if y is not None]
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var if var else None
+
+
+def drift(values, window=3):
+    """Relative change between the mean of the first and last `window` days"""
+    values = [v for v in values if v is not None]
+    if len(values) < 2:
+        return None
+    window = max(1, min(window, len(values) // 2))
+    first = sum(values[:window]) / window
+    last = sum(values[-window:]) / window
+    return round((last - first) / first, 4) if first else None
+
+
+def trend(days, max_drift=None):
+    summary = {'latency': {}, 'rows_per_day': {}, 'regressions': []}
+    for route in days[0]['latency_ms']:
+        series = [day['latency_ms'].get(route) for day in days]
+        route_drift = drift(series)
+        summary['latency'][route] = {
+            'first_ms': series[0],
+            'last_ms': series[-1],
+            'slope_ms_per_day': round(slope(series), 4) if slope(series) is not None else None,
+            'drift': route_drift
+        }
+        if max_drift is not None and route_drift is not None and route_drift > max_drift:
+            summary['regressions'].append(route)
+    for table in TABLES:
+        growth = slope([day['rows'][table] for day in days])
+        summary['rows_per_day'][table] = round(growth, 1) if growth is not None else None
+    size_growth = slope([day['db_size_mb'] for day in days])
+    summary['db_mb_per_day'] = round(size_growth, 4) if size_growth is not None else None
+    summary['db_size_mb'] = {'first': days[0]['db_size_mb'], 'last': days[-1]['db_size_mb']}
+    largest = days[-1]['object_kb']
+    summary['largest_objects_kb'] = dict(list(largest.items())[:10])
+    return summary
+
+
+def soak(db_path=DEFAULT_DB, upload_dir=DEFAULT_UPLOADS, work_dir=None, days=90, sessions_per_day=4,
+         rotations=40, attendance_rate=0.92, leave_rate=0.02, manual_points=20, probe_iterations=5,
+         seed=42, progress=None):
+    rng = random.Random(seed)
+    work_dir = work_dir or os.path.join(BENCH_DATA, 'soak')
+    target = working_copy(db_path, work_dir)
+    configure_env(target, work_dir, upload_dir)
+
+    import app_attendance
+    from app import app, generate_qr_token
+    from database import get_db, get_setting
+    app.config['TESTING'] = True
+    clock = SimClock()
+    app_attendance.time = clock
+
+    conn = get_db()
+    admin_id = conn.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    groups = {}
+    for row in conn.execute('SELECT group_id, user_id FROM group_members ORDER BY group_id, user_id'):
+        groups.setdefault(row['group_id'], []).append(row['user_id'])
+    students = [row[0] for row in conn.execute('SELECT id FROM users WHERE is_admin = 0 ORDER BY id')]
+    conn.close()
+    if not groups:
+        groups = {None: students}
+
+    admin = client_for(app, admin_id)
+    clients = {}
+
+    def student(uid):
+        if uid not in clients:
+            clients[uid] = client_for(app, uid)
+        return clients[uid]
+
+    interval = max(int(get_setting('qr_refresh_interval', '15')), 1)
+    history = []
+    log_path = os.path.join(work_dir, 'soak.jsonl')
+    log = open(log_path, 'w', encoding='utf-8')
+
+    for day in range(1, days + 1):
+        latencies = {'qr_generate': [], 'checkin': [], 'end_session': []}
+        last_session = None
+        for _ in range(sessions_per_day):
+            group_id = rng.choice(list(groups))
+            members = groups[group_id]
+
+            # Leaves are requested and approved before class
+            for uid in members:
+                if rng.random() < leave_rate:
+                    student(uid).post('/leave/request', data={
+                        'leave_type': rng.choice(('public', 'personal', 'sick')), 'reason': '参加活动'}).close()
+            conn = get_db()
+            pending = [row[0] for row in conn.execute("SELECT id FROM leave_requests WHERE status = 'pending'")]
+            conn.close()
+            for leave_id in pending:
+                admin.post(f'/admin/leave/{leave_id}/approve', data={'action': 'approve'}).close()
+
+            form = {'create_checkout': 'on'}
+            if group_id is not None:
+                form['group_ids'] = str(group_id)
+            admin.post('/admin/attendance/create', data=form).close()
+            conn = get_db()
+            checkout_id, checkin_id = [row[0] for row in conn.execute(
+                'SELECT id FROM attendance_sessions ORDER BY id DESC LIMIT 2')]
+            conn.close()
+
+            for session_id in (checkin_id, checkout_id):
+                present = [uid for uid in members if rng.random() < attendance_rate]
+                per_slot = max(1, len(present) // rotations + 1)
+                for slot_index in range(rotations):
+                    timed_call(latencies['qr_generate'], lambda: admin.get(f'/api/qr/generate/{session_id}'))
+                    token = generate_qr_token(session_id, int(clock.time() // interval))
+                    for uid in present[slot_index * per_slot:(slot_index + 1) * per_slot]:
+                        timed_call(latencies['checkin'], lambda: student(uid).get(f'/checkin/{token}'))
+                    clock.advance(interval)
+            for session_id in (checkin_id, checkout_id):
+                timed_call(latencies['end_session'], lambda: admin.post(f'/admin/attendance/{session_id}/end'))
+            last_session = checkin_id
+
+        for _ in range(manual_points):
+            admin.post('/admin/points/add', data={
+                'user_id': str(rng.choice(students)), 'points': '1', 'reason': '活动加分'}).close()
+
+        # Overnight: probe the read-heavy routes on the grown database
+        probes = {name: [] for name in PROBES}
+        for i in range(probe_iterations):
+            timed_call(probes['index'], lambda: student(students[i % len(students)]).get('/'))
+            timed_call(probes['qr_status'], lambda: admin.get(f'/api/qr/status/{last_session}'))
+            timed_call(probes['admin_attendance'], lambda: admin.get('/admin/attendance'))
+            timed_call(probes['admin_points'], lambda: admin.get('/admin/points'))
+            timed_call(probes['admin_leave'], lambda: admin.get('/admin/leave'))
+            timed_call(probes['export'], lambda: admin.get('/admin/export/leave-history'))
+        clock.advance(max(0, 86400 - sessions_per_day * 2 * rotations * interval))
+
+        db_size_mb, rows, object_kb = storage_stats(target)
+        snapshot = {
+            'day': day,
+            'db_size_mb': db_size_mb,
+            'rows': rows,
+            'object_kb': object_kb,
+            'latency_ms': {name: p50_ms(values) for name, values in {**latencies, **probes}.items()},
+            'peak_rss_mb': peak_rss_mb()
+        }
+        history.append(snapshot)
+        log.write(json.dumps(snapshot, ensure_ascii=False) + '\n')
+        log.flush()
+        if progress:
+            progress(snapshot)
+
+    log.close()
+    return history
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate a semester and track DB growth and latency drift')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--work-dir', default=None)
+    parser.add_argument('--days', type=int, default=90, help='simulated school days')
+    parser.add_argument('--sessions-per-day', type=int, default=4)
+    parser.add_argument('--rotations', type=int, default=40, help='QR rotations per session')
+    parser.add_argument('--attendance-rate', type=float, default=0.92)
+    parser.add_argument('--leave-rate', type=float, default=0.02)
+    parser.add_argument('--manual-points', type=int, default=20, help='manual point entries per day')
+    parser.add_argument('--probe-iterations', type=int, default=5)
+    parser.add_argument('--max-drift', type=float, default=None,
+                        help='fail when a route slows down by more than this fraction')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    def progress(snapshot):
+        print(f"day {snapshot['day']}: {snapshot['db_size_mb']} MB, "
+              f"qr_codes={snapshot['rows']['qr_codes']}, points_records={snapshot['rows']['points_records']}, "
+              f"admin_points p50={snapshot['latency_ms']['admin_points']} ms", file=sys.stderr)
+
+    history = soak(db_path=args.db, upload_dir=args.uploads, work_dir=args.work_dir, days=args.days,
+                   sessions_per_day=args.sessions_per_day, rotations=args.rotations,
+                   attendance_rate=args.attendance_rate, leave_rate=args.leave_rate,
+                   manual_points=args.manual_points, probe_iterations=args.probe_iterations,
+                   seed=args.seed, progress=progress)
+    summary = trend(history, args.max_drift)
+    report = {
+        'meta': run_metadata(db_path=args.db, days=args.days, sessions_per_day=args.sessions_per_day,
+                             rotations=args.rotations, max_drift=args.max_drift),
+        'trend': summary,
+        'days': history
+    }
+    write_report(report, args.output)
+    return 1 if summary['regressions'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,416 @@
+"""
+Class-start check-in storm against a running gunicorn instance.
+
+Every simulated phone scans the token currently on the screen, lands on
+`/login?next=/checkin/<token>`, types its credentials, and follows
+`/complete-checkin` back to `/checkin/<token>`. Meanwhile a screen thread
+rotates the QR code through `/api/qr/generate` and polls `/api/qr/status`,
+exactly like templates/qr_screen.html.
+
+    # start gunicorn on a copy of the generated database and storm it
+    python -m bench.storm --spawn --phones 400 --duration 20 --curve burst
+
+    # or hit an instance that is already running
+    python -m bench.storm --url http://127.0.0.1:5000 --activity-code AbC123 \\
+        --secret-key "$FLASK_SECRET_KEY"
+
+Phones log in with the generator's accounts (password = student id)
+unless --password is given. Tokens are derived from the app secret the
+same way app.generate_qr_token does, so --secret-key must match the server.
+"""
+import os
+import re
+import sys
+import json
+import time
+import hmac
+import shlex
+import base64
+import random
+import hashlib
+import sqlite3
+import argparse
+import threading
+import subprocess
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from bench.common import (ROOT, BENCH_DATA, DEFAULT_DB, DEFAULT_UPLOADS, configure_env, working_copy,
+                          percentile, run_metadata, write_report)
+
+CURVES = ('burst', 'uniform', 'ramp', 'poisson', 'normal')
+DEFAULT_SECRET = 'bench-storm-secret'
+
+
+def qr_token(secret, session_id, slot):
+    """Same derivation as app.generate_qr_token (the app itself is not imported here)"""
+    digest = hmac.new(secret.encode(), f'{session_id}:{slot}'.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def arrival_times(curve, phones, duration, rng):
+    """Offsets (seconds from start) at which each phone scans the code"""
+    if curve == 'burst':
+        # Everybody pulls out their phone within the first second
+        times = [rng.uniform(0, min(duration, 1.0)) for _ in range(phones)]
+    elif curve == 'uniform':
+        times = [rng.uniform(0, duration) for _ in range(phones)]
+    elif curve == 'ramp':
+        # Linearly increasing arrival rate
+        times = [duration * rng.random() ** 0.5 for _ in range(phones)]
+    elif curve == 'poisson':
+        rate = phones / duration if duration > 0 else float('inf')
+        times, t = [], 0.0
+        for _ in range(phones):
+            t += rng.expovariate(rate) if rate != float('inf') else 0.0
+            times.append(t)
+    elif curve == 'normal':
+        times = [min(max(rng.gauss(duration / 2, duration / 6), 0.0), duration) for _ in range(phones)]
+    else:
+        raise ValueError(f'unknown arrival curve: {curve}')
+    return sorted(times)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Browser:
+    """A phone's browser: its own cookie jar, redirects followed by hand so every hop is timed"""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+
+    def request(self, path, form=None, json_body=None):
+        """Return (status, location, body, seconds); status 0 means the connection failed"""
+        url = urllib.parse.urljoin(self.base_url + '/', path)
+        data, headers = None, {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+        elif json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        started = time.perf_counter()
+        try:
+            with self.opener.open(urllib.request.Request(url, data, headers), timeout=self.timeout) as resp:
+                status, location, body = resp.status, resp.headers.get('Location'), resp.read()
+        except urllib.error.HTTPError as e:
+            status, location, body = e.code, e.headers.get('Location'), e.read()
+        except (urllib.error.URLError, OSError):
+            status, location, body = 0, None, b''
+        return status, location, body, time.perf_counter() - started
+
+
+class Recorder:
+    """Thread-safe per-step latencies and outcome counters"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = {}
+        self.status = {}
+        self.outcomes = {}
+
+    def step(self, name, result):
+        status, _location, _body, seconds = result
+        with self.lock:
+            self.steps.setdefault(name, []).append(seconds)
+            codes = self.status.setdefault(name, {})
+            codes[status] = codes.get(status, 0) + 1
+        return result
+
+    def outcome(self, name):
+        with self.lock:
+            self.outcomes[name] = self.outcomes.get(name, 0) + 1
+
+    def server_errors(self):
+        return sum(count for codes in self.status.values()
+                   for status, count in codes.items() if status >= 500 or status == 0)
+
+    def report(self):
+        steps = {}
+        for name, latencies in self.steps.items():
+            steps[name] = {
+                'requests': len(latencies),
+                'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+                'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+                'max_ms': round(max(latencies) * 1000, 3),
+                'status_codes': {str(k): v for k, v in sorted(self.status[name].items())}
+            }
+        return steps
+
+
+class Screen(threading.Thread):
+    """The classroom screen: rotate the QR code and poll the check-in status"""
+
+    def __init__(self, base_url, session_id, secret, recorder, status_interval=3.0):
+        super().__init__(daemon=True)
+        self.browser = Browser(base_url)
+        self.session_id = session_id
+        self.secret = secret
+        self.recorder = recorder
+        self.status_interval = status_interval
+        self.stopped = threading.Event()
+        self.ready = threading.Event()
+        self.token = None
+        self.token_expires = 0.0
+        self.interval = None
+        self.rotations = 0
+
+    def refresh(self):
+        status, _location, body, _seconds = self.recorder.step(
+            'qr_generate', self.browser.request(f'/api/qr/generate/{self.session_id}'))
+        if status != 200:
+            return 1.0
+        data = json.loads(body)
+        if not data.get('success'):
+            return 1.0
+        self.interval = data['refresh_interval']
+        slot_end = time.time() + data['expires_in']
+        slot = round(slot_end / self.interval) - 1
+        self.token = qr_token(self.secret, self.session_id, slot)
+        # The server accepts a token for 5 seconds after its slot ends
+        self.token_expires = slot_end + 5
+        self.rotations += 1
+        self.ready.set()
+        return data['expires_in'] + 0.1
+
+    def run(self):
+        next_refresh = next_status = time.monotonic()
+        while not self.stopped.is_set():
+            current = time.monotonic()
+            if current >= next_refresh:
+                next_refresh = current + self.refresh()
+            if current >= next_status:
+                self.recorder.step('qr_status', self.browser.request(f'/api/qr/status/{self.session_id}'))
+                next_status = current + self.status_interval
+            self.stopped.wait(max(0.0, min(next_refresh, next_status) - time.monotonic()))
+
+    def scan(self):
+        """What a phone camera reads off the screen right now"""
+        return self.token, self.token_expires
+
+
+def phone(base_url, screen, recorder, student_id, password, think_time):
+    """One student's scan → login → complete-checkin → checkin flow"""
+    browser = Browser(base_url)
+    token, token_expires = screen.scan()
+
+    status, location, _body, _seconds = recorder.step('scan', browser.request(f'/checkin/{token}'))
+    if status != 302 or not location or '/login' not in location:
+        recorder.outcome('error' if status == 0 or status >= 500 else 'unexpected_scan')
+        return
+    recorder.step('login_page', browser.request(location))
+
+    # Typing the student id and password
+    if think_time:
+        time.sleep(think_time)
+
+    status, location, _body, _seconds = recorder.step(
+        'login', browser.request(location, form={'student_id': student_id, 'password': password}))
+    if status != 302 or not location or 'complete-checkin' not in location:
+        recorder.outcome('error' if status == 0 or status >= 500 else 'login_failed')
+        return
+
+    status, location, _body, _seconds = recorder.step('complete', browser.request(location))
+    if status != 302 or not location or '/checkin/' not in location:
+        recorder.outcome('error' if status == 0 or status >= 500 else 'password_change_required')
+        return
+
+    checkin_started = time.time()
+    status, _location, body, _seconds = recorder.step('checkin', browser.request(location))
+    text = body.decode('utf-8', 'replace')
+    if status == 200 and ('签到成功' in text or '无需重复' in text):
+        recorder.outcome('success')
+    elif status == 200 and '已过期' in text:
+        # Only count expiries caused by the token rotating away, not ended sessions
+        recorder.outcome('token_expired' if checkin_started > token_expires - 1 else 'rejected')
+    else:
+        recorder.outcome('error' if status == 0 or status >= 500 else 'rejected')
+
+
+def load_students(db_path, phones, group_id=None):
+    """Student ids of the phones, taken from a generated database"""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    if group_id:
+        rows = conn.execute('''
+            SELECT u.student_id FROM group_members gm JOIN users u ON u.id = gm.user_id
+            WHERE gm.group_id = ? AND u.is_admin = 0 ORDER BY u.id LIMIT ?
+        ''', (group_id, phones)).fetchall()
+    else:
+        rows = conn.execute('SELECT student_id FROM users WHERE is_admin = 0 ORDER BY id LIMIT ?',
+                            (phones,)).fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+def start_session(base_url, activity_code=None, admin_user=None, admin_password=None, group_id=None):
+    """Resolve an existing activity code, or log in as admin and create a fresh session"""
+    browser = Browser(base_url)
+    if not activity_code:
+        status, location, _body, _seconds = browser.request(
+            '/login', form={'student_id': admin_user, 'password': admin_password})
+        if status != 302 or (location and '/login' in location):
+            raise RuntimeError('admin login failed')
+        form = {'group_ids': str(group_id)} if group_id else {}
+        browser.request('/admin/attendance/create', form=form)
+        _status, _location, body, _seconds = browser.request('/admin/attendance')
+        match = re.search(r'活动码：([A-Za-z0-9]+)', body.decode('utf-8', 'replace'))
+        if not match:
+            raise RuntimeError('could not create an attendance session')
+        activity_code = match.group(1)
+    _status, _location, body, _seconds = browser.request('/api/qr/start', json_body={'activity_code': activity_code})
+    data = json.loads(body)
+    if not data.get('success'):
+        raise RuntimeError(data.get('message', 'activity code rejected'))
+    return data['session_id'], activity_code
+
+
+def spawn_server(db_path, upload_dir, work_dir, port, workers, secret, extra_args=''):
+    """Run gunicorn on a copy of the database; returns (process, base_url, log_path)"""
+    target = working_copy(db_path, work_dir)
+    configure_env(target, work_dir, upload_dir)
+    env = dict(os.environ, FLASK_SECRET_KEY=secret, METRICS_FLUSH_INTERVAL='1')
+    log_path = os.path.join(work_dir, 'gunicorn.log')
+    command = ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+               '--timeout', '120', *shlex.split(extra_args), 'app:app']
+    with open(log_path, 'wb') as log:
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited, see {log_path}')
+        if Browser(base_url, timeout=2).request('/login')[0] == 200:
+            return process, base_url, log_path
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'gunicorn did not come up, see {log_path}')
+
+
+def count_lock_errors(log_path):
+    if not log_path or not os.path.exists(log_path):
+        return None
+    with open(log_path, encoding='utf-8', errors='replace') as f:
+        return sum(line.count('database is locked') for line in f)
+
+
+def storm(base_url, session_id, secret, students, password=None, curve='burst', duration=10.0,
+          think_time=3.0, status_interval=3.0, drain=60.0, seed=42, log_path=None):
+    rng = random.Random(seed)
+    recorder = Recorder()
+    screen = Screen(base_url, session_id, secret, recorder, status_interval)
+    screen.start()
+    if not screen.ready.wait(30):
+        screen.stopped.set()
+        raise RuntimeError('the screen could not generate a QR code')
+
+    offsets = arrival_times(curve, len(students), duration, rng)
+    # Typing time is log-normal around the configured mean
+    thinks = [rng.lognormvariate(0, 0.5) * think_time if think_time else 0.0 for _ in students]
+    threads = []
+    started = time.monotonic()
+    for offset, student_id, think in zip(offsets, students, thinks):
+        delay = started + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        thread = threading.Thread(target=phone, daemon=True,
+                                  args=(base_url, screen, recorder, student_id, password or student_id, think))
+        thread.start()
+        threads.append(thread)
+    deadline = time.monotonic() + drain
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    elapsed = time.monotonic() - started
+    screen.stopped.set()
+    screen.join(5)
+
+    unfinished = sum(thread.is_alive() for thread in threads)
+    outcomes = dict(recorder.outcomes)
+    if unfinished:
+        outcomes['unfinished'] = unfinished
+    phones = len(students)
+    return {
+        'phones': phones,
+        'elapsed_s': round(elapsed, 2),
+        'success_rate': round(outcomes.get('success', 0) / phones, 4) if phones else None,
+        'token_expiry_misses': outcomes.get('token_expired', 0),
+        'server_errors': recorder.server_errors(),
+        'lock_errors': count_lock_errors(log_path),
+        'qr_rotations': screen.rotations,
+        'outcomes': outcomes,
+        'steps': recorder.report()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate a class-start check-in storm')
+    parser.add_argument('--url', default=None, help='base URL of a running instance')
+    parser.add_argument('--spawn', action='store_true', help='start gunicorn on a copy of --db')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--gunicorn-args', default='', help='extra arguments for the spawned gunicorn')
+    parser.add_argument('--server-log', default=None, help='gunicorn log to scan for lock errors')
+    parser.add_argument('--db', default=DEFAULT_DB, help='generated database (student accounts, spawn source)')
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'storm'))
+    parser.add_argument('--secret-key', default=None,
+                        help=f'server FLASK_SECRET_KEY (default {DEFAULT_SECRET} when spawning)')
+    parser.add_argument('--activity-code', default=None, help='use an existing session instead of creating one')
+    parser.add_argument('--admin-user', default='admin')
+    parser.add_argument('--admin-password', default='admin123')
+    parser.add_argument('--group-id', type=int, default=None, help='bind the new session to a group')
+    parser.add_argument('--phones', type=int, default=200)
+    parser.add_argument('--password', default=None, help='password of every phone (default: student id)')
+    parser.add_argument('--curve', choices=CURVES, default='burst')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds over which phones arrive')
+    parser.add_argument('--think-time', type=float, default=3.0, help='mean seconds spent typing credentials')
+    parser.add_argument('--status-interval', type=float, default=3.0)
+    parser.add_argument('--drain', type=float, default=60.0, help='seconds to wait for stragglers')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not args.spawn and not args.url:
+        parser.error('either --url or --spawn is required')
+    secret = args.secret_key or (DEFAULT_SECRET if args.spawn else os.getenv('FLASK_SECRET_KEY'))
+    if not secret:
+        parser.error('--secret-key (or FLASK_SECRET_KEY) is required to derive QR tokens')
+
+    process = None
+    base_url, log_path = args.url, args.server_log
+    try:
+        if args.spawn:
+            process, base_url, log_path = spawn_server(args.db, args.uploads, args.work_dir, args.port,
+                                                       args.workers, secret, args.gunicorn_args)
+        session_id, activity_code = start_session(base_url, args.activity_code, args.admin_user,
+                                                  args.admin_password, args.group_id)
+        students = load_students(args.db, args.phones, args.group_id)
+        result = storm(base_url, session_id, secret, students, password=args.password, curve=args.curve,
+                       duration=args.duration, think_time=args.think_time,
+                       status_interval=args.status_interval, drain=args.drain, seed=args.seed,
+                       log_path=log_path)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(30)
+
+    report = {
+        'meta': run_metadata(url=base_url, spawned=args.spawn, workers=args.workers if args.spawn else None,
+                             gunicorn_args=args.gunicorn_args or None, curve=args.curve,
+                             duration=args.duration, think_time=args.think_time,
+                             session_id=session_id, activity_code=activity_code),
+        **result
+    }
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Worker time per uploaded megabyte: multipart form vs resumable chunks.
+
+For each mode a gunicorn instance with one sync worker is started on a
+fresh copy of the generated database, and a student submits a leave
+request with a large attachment at a capped bandwidth, like a phone on
+a slow network:
+
+    multipart   the file is posted with the form to /leave/request
+    chunked     the file goes through /api/uploads in UPLOAD_CHUNK_SIZE
+                pieces, then the form is posted with the upload id
+
+Each mode runs twice: a clean upload, and one whose connection drops
+partway (--drop-at) and is retried the way each client would: the form
+is posted again from the start, the chunked upload resumes from the
+offset the server reports.
+
+    python -m bench.uploads --size-mb 8 --kbps 512
+
+Worker time is the request time from gunicorn's access log, which
+includes the requests cut short by the drop (a sync worker reads the
+body until the connection closes). A dropped form post is rejected as
+incomplete; a dropped chunk keeps the bytes that arrived. The longest
+single request shows how long other users can be kept waiting for the
+worker. CPU time and peak memory are read from the worker's /proc
+entries. With --kbps 0 the upload is not throttled, which approximates
+a proxy that buffers request bodies.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import http.client
+import urllib.parse
+import urllib.request
+
+from bench.common import BENCH_DATA, DEFAULT_DB, run_metadata, write_report
+from bench.storm import DEFAULT_SECRET, Browser, spawn_server, load_students
+
+SEND_SIZE = 16 * 1024
+UPLOAD_PATHS = ('/leave/request', '/api/uploads')
+
+
+def session_cookie(browser):
+    for handler in browser.opener.handlers:
+        if isinstance(handler, urllib.request.HTTPCookieProcessor):
+            return '; '.join(f'{cookie.name}={cookie.value}' for cookie in handler.cookiejar)
+    return ''
+
+
+class Uploader:
+    """Sends request bodies at a capped bandwidth and keeps count of what it sent"""
+
+    def __init__(self, base_url, cookie, kbps):
+        parts = urllib.parse.urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port
+        self.cookie, self.kbps = cookie, kbps
+        self.bytes_sent = 0
+
+    def send(self, method, path, body, content_type, drop_at=None):
+        """Returns (status, parsed JSON or None); status is None if the connection was dropped"""
+        body = memoryview(body)
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=600)
+        conn.putrequest(method, path)
+        conn.putheader('Cookie', self.cookie)
+        conn.putheader('Content-Type', content_type)
+        conn.putheader('Content-Length', str(len(body)))
+        conn.endheaders()
+
+        limit = len(body) if drop_at is None else drop_at
+        started = time.perf_counter()
+        sent = 0
+        while sent < limit:
+            piece = body[sent:min(sent + SEND_SIZE, limit)]
+            conn.send(piece)
+            sent += len(piece)
+            if self.kbps:
+                ahead = sent / (self.kbps * 1024) - (time.perf_counter() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        self.bytes_sent += sent
+
+        if drop_at is not None:
+            conn.close()
+            return None, None
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+
+
+def multipart_body(fields, filename, data):
+    boundary = 'bench' + hashlib.sha1(os.urandom(8)).hexdigest()
+    head = b''.join(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+                    for name, value in fields.items())
+    head += (f'--{boundary}\r\nContent-Disposition: form-data; name="attachments"; filename="{filename}"\r\n'
+             f'Content-Type: application/octet-stream\r\n\r\n').encode()
+    return head + data + f'\r\n--{boundary}--\r\n'.encode(), f'multipart/form-data; boundary={boundary}'
+
+
+def upload_multipart(uploader, data, drop_at):
+    body, content_type = multipart_body({'leave_type': 'sick', 'reason': 'bench'}, 'scan.bin', data)
+    if drop_at is not None:
+        uploader.send('POST', '/leave/request', body, content_type, drop_at=drop_at)
+    # Browsers post the whole form again
+    status, _data = uploader.send('POST', '/leave/request', body, content_type)
+    return status == 302
+
+
+def upload_chunked(uploader, data, drop_at):
+    declared = json.dumps({'filename': 'scan.bin', 'size': len(data),
+                           'sha256': hashlib.sha256(data).hexdigest()}).encode()
+    _status, state = uploader.send('POST', '/api/uploads', declared, 'application/json')
+    upload_id, offset, chunk_size = state['upload_id'], state['offset'], state['chunk_size']
+    while offset < len(data):
+        piece = data[offset:offset + chunk_size]
+        drop = None
+        if drop_at is not None and offset <= drop_at < offset + len(piece):
+            drop, drop_at = drop_at - offset, None
+        status, state = uploader.send('PUT', f'/api/uploads/{upload_id}?offset={offset}', piece,
+                                      'application/octet-stream', drop_at=drop)
+        if status is None:
+            # Ask the server where to continue, as static/js/leave_upload.js does
+            _status, state = uploader.send('POST', '/api/uploads', declared, 'application/json')
+        offset = state['offset']
+    _status, state = uploader.send('POST', f'/api/uploads/{upload_id}/finalize', b'', 'application/json')
+    if not state or not state.get('success'):
+        return False
+    form = urllib.parse.urlencode({'leave_type': 'sick', 'reason': 'bench', 'upload_ids': upload_id}).encode()
+    status, _data = uploader.send('POST', '/leave/request', form, 'application/x-www-form-urlencoded')
+    return status == 302
+
+
+def worker_pids(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def cpu_seconds(pids):
+    total = 0
+    for pid in pids:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        total += int(fields[11]) + int(fields[12])  # utime + stime
+    return total / os.sysconf('SC_CLK_TCK')
+
+
+def peak_rss_mb(pids):
+    peak = 0
+    for pid in pids:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    peak = max(peak, int(line.split()[1]))
+    return round(peak / 1024, 1)
+
+
+def logged_seconds(access_log, skip):
+    """Request times (seconds) of the upload requests logged after line skip"""
+    seconds = []
+    with open(access_log) as f:
+        for line in list(f)[skip:]:
+            path, _method, _status, micros = line.split()
+            if path.startswith(UPLOAD_PATHS):
+                seconds.append(int(micros) / 1e6)
+    return seconds
+
+
+def line_count(path):
+    with open(path) as f:
+        return sum(1 for _ in f)
+
+
+def measure(mode, db_path, work_dir, port, size_mb, kbps, drop_fraction):
+    upload_dir = os.path.join(work_dir, 'uploads')
+    access_log = os.path.join(work_dir, 'access.log')
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    if os.path.exists(access_log):
+        os.remove(access_log)
+    process, base_url, _log_path = spawn_server(
+        db_path, upload_dir, work_dir, port, 1, DEFAULT_SECRET,
+        f'--timeout 600 --access-logfile {access_log} --access-logformat "%(U)s %(m)s %(s)s %(D)s"')
+    try:
+        student_id = load_students(os.path.join(work_dir, 'database.db'), 1)[0]
+        browser = Browser(base_url)
+        browser.request('/login', form={'student_id': student_id, 'password': student_id})
+        cookie = session_cookie(browser)
+        pids = worker_pids(process.pid)
+        upload = upload_multipart if mode == 'multipart' else upload_chunked
+
+        results = {}
+        for scenario in ('clean', 'dropped'):
+            data = os.urandom(size_mb * 1024 * 1024)
+            drop_at = int(len(data) * drop_fraction) if scenario == 'dropped' else None
+            uploader = Uploader(base_url, cookie, kbps)
+            skip = line_count(access_log)
+            cpu_before = cpu_seconds(pids)
+            started = time.perf_counter()
+            ok = upload(uploader, data, drop_at)
+            elapsed = time.perf_counter() - started
+            time.sleep(0.5)  # let the worker write its access log line
+            requests = logged_seconds(access_log, skip)
+            worker_s = sum(requests)
+            results[scenario] = {
+                'ok': ok,
+                'wall_s': round(elapsed, 3),
+                'requests': len(requests),
+                'longest_request_s': round(max(requests), 3) if requests else None,
+                'mb_sent': round(uploader.bytes_sent / 1024 / 1024, 2),
+                'worker_s': round(worker_s, 3),
+                'worker_s_per_mb': round(worker_s / size_mb, 3),
+                'worker_cpu_s_per_mb': round((cpu_seconds(pids) - cpu_before) / size_mb, 4)
+            }
+        results['worker_peak_rss_mb'] = peak_rss_mb(pids)
+        return {'mode': mode, **results}
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare worker time per MB of multipart and chunked uploads')
+    parser.add_argument('--modes', default='multipart,chunked')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'uploads-bench'))
+    parser.add_argument('--port', type=int, default=5058)
+    parser.add_argument('--size-mb', type=int, default=8)
+    parser.add_argument('--kbps', type=int, default=512, help='client upload bandwidth in KB/s, 0 = unlimited')
+    parser.add_argument('--drop-at', type=float, default=0.6, help='fraction of the file sent before the drop')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    results = [measure(mode, args.db, os.path.join(args.work_dir, mode), args.port,
+                       args.size_mb, args.kbps, args.drop_at)
+               for mode in args.modes.split(',')]
+    report = {
+        'meta': run_metadata(db_path=args.db, size_mb=args.size_mb, kbps=args.kbps, drop_at=args.drop_at,
+                             chunk_size=int(os.getenv('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))),
+        'modes': results
+    }
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
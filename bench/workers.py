@@ -0,0 +1,145 @@
+"""
+Sync vs threaded gunicorn workers under mixed slow/fast traffic.
+
+For each worker mode a gunicorn instance is started on a fresh copy of
+the generated database. Admin clients loop over slow pages (leave
+history export, the user table, a large session's records) while
+phone-like clients loop over fast ones (QR screen status, the login
+page). With sync workers every slow request occupies a whole process and
+the fast requests queue behind it; the report shows the latency the fast
+clients see in each mode:
+
+    python -m bench.workers --modes sync:4,gthread:4x8 --duration 20
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+
+from bench.common import (BENCH_DATA, DEFAULT_DB, DEFAULT_UPLOADS, summarize, run_metadata, write_report)
+from bench.storm import DEFAULT_SECRET, Browser, spawn_server, start_session, count_lock_errors
+
+
+def parse_mode(spec):
+    """`sync:4`, `gthread:4x8` or `gevent:4x100` -> (name, gunicorn arguments, workers)"""
+    worker_class, _, size = spec.partition(':')
+    workers, _, threads = (size or '4').partition('x')
+    args = f'--worker-class {worker_class}'
+    if worker_class == 'gthread':
+        args += f' --threads {threads or 8}'
+    elif worker_class == 'gevent':
+        args += f' --worker-connections {threads or 100}'
+    return spec, args, int(workers)
+
+
+def pick_targets(db_path):
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    group_id = conn.execute('''
+        SELECT group_id FROM group_members GROUP BY group_id ORDER BY COUNT(*) DESC LIMIT 1
+    ''').fetchone()
+    session_id = conn.execute('''
+        SELECT session_id FROM attendance_records GROUP BY session_id ORDER BY COUNT(*) DESC LIMIT 1
+    ''').fetchone()
+    conn.close()
+    return (group_id[0] if group_id else None), (session_id[0] if session_id else None)
+
+
+class Client(threading.Thread):
+    """Requests its paths in a closed loop until told to stop"""
+
+    def __init__(self, browser, paths, stop):
+        super().__init__(daemon=True)
+        self.browser, self.paths, self.stop = browser, paths, stop
+        self.latencies, self.codes = [], {}
+
+    def run(self):
+        i = 0
+        while not self.stop.is_set():
+            status, _location, _body, seconds = self.browser.request(self.paths[i % len(self.paths)])
+            self.latencies.append(seconds)
+            self.codes[status] = self.codes.get(status, 0) + 1
+            i += 1
+
+
+def measure(mode, db_path, upload_dir, work_dir, port, fast_clients, slow_clients, duration):
+    name, gunicorn_args, workers = parse_mode(mode)
+    process, base_url, log_path = spawn_server(db_path, upload_dir, work_dir, port, workers,
+                                               DEFAULT_SECRET, gunicorn_args)
+    try:
+        group_id, records_session = pick_targets(os.path.join(work_dir, 'database.db'))
+        session_id, _activity_code = start_session(base_url, admin_user='admin', admin_password='admin123',
+                                                   group_id=group_id)
+        fast_paths = [f'/api/qr/status/{session_id}', '/login']
+        slow_paths = ['/admin/export/leave-history', '/admin/users']
+        if records_session:
+            slow_paths.append(f'/admin/attendance/{records_session}/records')
+
+        stop = threading.Event()
+        clients = {'fast': [], 'slow': []}
+        for _ in range(slow_clients):
+            browser = Browser(base_url, timeout=120)
+            browser.request('/login', form={'student_id': 'admin', 'password': 'admin123'})
+            clients['slow'].append(Client(browser, slow_paths, stop))
+        for _ in range(fast_clients):
+            clients['fast'].append(Client(Browser(base_url, timeout=120), fast_paths, stop))
+
+        started = time.perf_counter()
+        for client in clients['slow'] + clients['fast']:
+            client.start()
+        time.sleep(duration)
+        stop.set()
+        for client in clients['slow'] + clients['fast']:
+            client.join()
+        elapsed = time.perf_counter() - started
+
+        result = {'mode': name, 'workers': workers, 'gunicorn_args': gunicorn_args}
+        for kind, group in clients.items():
+            latencies = [s for client in group for s in client.latencies]
+            codes = {}
+            for client in group:
+                for status, count in client.codes.items():
+                    codes[status] = codes.get(status, 0) + count
+            result[kind] = summarize(latencies, elapsed, codes)
+            del result[kind]['peak_rss_mb']  # of this client process, not the server
+        result['lock_errors'] = count_lock_errors(log_path)
+        return result
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare gunicorn worker modes under mixed traffic')
+    parser.add_argument('--modes', default='sync:4,gthread:4x8',
+                        help='comma-separated worker modes: sync:N, gthread:NxT, gevent:NxC')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DATA, 'workers'))
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--fast-clients', type=int, default=16)
+    parser.add_argument('--slow-clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of traffic per mode')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found, run `python -m bench.generate` first')
+
+    results = []
+    for mode in args.modes.split(','):
+        work_dir = os.path.join(args.work_dir, mode.replace(':', '-'))
+        results.append(measure(mode, args.db, args.uploads, work_dir, args.port,
+                               args.fast_clients, args.slow_clients, args.duration))
+
+    report = {
+        'meta': run_metadata(db_path=args.db, fast_clients=args.fast_clients, slow_clients=args.slow_clients,
+                             duration=args.duration),
+        'modes': results
+    }
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,706 @@
+"""
+Set-based bulk operations
+
+Roster-sized changes (a graduating class, a cancelled week) are applied
+as a handful of statements joined against a TEMP table of ids instead
+of one statement per row, inside a single write transaction, so either
+everything is removed or nothing is.
+
+Files are never unlinked inside the transaction: the operations return
+what has to be cleaned up and the caller hands it to
+attachments.release_in_background() after the commit.
+
+Deleting a range of attendance sessions can touch hundreds of thousands
+of rows, so one transaction would hold the write lock for seconds. It
+runs as a job instead (see jobs.py): the sessions are closed up front,
+then their rows are found through the session_id indexes and removed at
+most BULK_CHUNK_ROWS per transaction, so check-ins in other sessions
+keep going. A single session usually fits in one transaction.
+
+Re-scoring past sessions for new point values is a job too: each batch
+of sessions is diffed in a read transaction (the report a dry run
+shows), then written in small transactions.
+"""
+import os
+import math
+import time
+
+import jobs
+from timezone_utils import now as tz_now
+
+BULK_CHUNK_ROWS = int(os.getenv('BULK_CHUNK_ROWS', '20000'))
+# Pause between chunks. A writer blocked by a chunk retries on SQLite's
+# busy-handler backoff (up to 25 ms apart at first); without a gap the
+# next chunk would take the lock again before it gets a turn.
+BULK_CHUNK_PAUSE = int(os.getenv('BULK_CHUNK_PAUSE_MS', '30')) / 1000
+TEMP_IDS = '''
+    CREATE TEMP TABLE IF NOT EXISTS {name} (id INTEGER PRIMARY KEY)
+'''
+TEMP_STUDENT_IDS = '''
+    CREATE TEMP TABLE IF NOT EXISTS bulk_student_ids (student_id TEXT PRIMARY KEY)
+'''
+
+
+def _load_ids(conn, name, ids):
+    """Fill a TEMP table with integer ids (duplicates and non-numeric values are dropped)"""
+    conn.execute(TEMP_IDS.format(name=name))
+    conn.execute(f'DELETE FROM {name}')
+    conn.executemany(f'INSERT OR IGNORE INTO {name} (id) VALUES (?)',
+                     ((int(value),) for value in ids if str(value).strip().isdigit()))
+
+
+def delete_users(conn, user_ids):
+    """Delete non-admin users and everything that belongs to them
+
+    Removes their group memberships, attendance records, points records,
+    leave requests with their attachment rows, and unfinished uploads.
+    Returns (counts, cleanup): counts maps each table to the rows
+    deleted; cleanup holds the attachment blobs, legacy attachment paths
+    and upload ids whose files can be removed once committed.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        _load_ids(conn, 'bulk_user_ids', user_ids)
+        # Admin accounts and unknown ids are never part of the set
+        conn.execute('DELETE FROM bulk_user_ids WHERE id NOT IN (SELECT id FROM users WHERE is_admin = 0)')
+
+        conn.execute(TEMP_IDS.format(name='bulk_leave_ids'))
+        conn.execute('DELETE FROM bulk_leave_ids')
+        conn.execute('''
+            INSERT INTO bulk_leave_ids (id)
+            SELECT lr.id FROM leave_requests lr JOIN bulk_user_ids b ON b.id = lr.user_id
+        ''')
+
+        cleanup = {
+            'digests': [row[0] for row in conn.execute('''
+                SELECT DISTINCT la.sha256 FROM leave_attachments la
+                JOIN bulk_leave_ids b ON b.id = la.leave_request_id
+                WHERE la.sha256 IS NOT NULL
+            ''')],
+            'legacy_paths': [row[0] for row in conn.execute('''
+                SELECT la.filepath FROM leave_attachments la
+                JOIN bulk_leave_ids b ON b.id = la.leave_request_id
+                WHERE la.sha256 IS NULL
+            ''')],
+            'upload_ids': [row[0] for row in conn.execute('''
+                SELECT id FROM upload_sessions WHERE user_id IN (SELECT id FROM bulk_user_ids)
+            ''')]
+        }
+
+        counts = {}
+        # Children first; SQLite does not enforce the foreign keys, so nothing cascades by itself
+        statements = (
+            ('leave_attachments', 'DELETE FROM leave_attachments WHERE leave_request_id IN (SELECT id FROM bulk_leave_ids)'),
+            ('points_records', 'DELETE FROM points_records WHERE user_id IN (SELECT id FROM bulk_user_ids)'),
+            ('leave_requests', 'DELETE FROM leave_requests WHERE id IN (SELECT id FROM bulk_leave_ids)'),
+            ('attendance_records', 'DELETE FROM attendance_records WHERE user_id IN (SELECT id FROM bulk_user_ids)'),
+            ('group_members', 'DELETE FROM group_members WHERE user_id IN (SELECT id FROM bulk_user_ids)'),
+            ('upload_sessions', 'DELETE FROM upload_sessions WHERE user_id IN (SELECT id FROM bulk_user_ids)'),
+            ('users', 'DELETE FROM users WHERE id IN (SELECT id FROM bulk_user_ids)'),
+        )
+        for table, sql in statements:
+            counts[table] = conn.execute(sql).rowcount
+
+        conn.execute('DELETE FROM bulk_user_ids')
+        conn.execute('DELETE FROM bulk_leave_ids')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return counts, cleanup
+
+
+def resolve_students(conn, student_ids):
+    """{student_id: row with id, student_id, name} for the non-admin users among student_ids
+
+    One join of a TEMP table against the unique student_id index, however
+    many ids there are; unknown ids are simply missing from the result.
+    """
+    conn.execute(TEMP_STUDENT_IDS)
+    conn.execute('DELETE FROM bulk_student_ids')
+    conn.executemany('INSERT OR IGNORE INTO bulk_student_ids (student_id) VALUES (?)',
+                     ((str(value).strip(),) for value in student_ids if str(value).strip()))
+    rows = conn.execute('''
+        SELECT u.id, u.student_id, u.name
+        FROM bulk_student_ids b
+        JOIN users u ON u.student_id = b.student_id
+        WHERE u.is_admin = 0
+    ''').fetchall()
+    conn.execute('DELETE FROM bulk_student_ids')
+    conn.commit()
+    return {row['student_id']: row for row in rows}
+
+
+def plan_points(conn, rows):
+    """Check the (line, student_id, points, reason) rows of a batch points adjustment
+
+    Returns (entries, errors). Entries carry user_id, student_id, name,
+    points (a float) and reason; errors carry line, student_id and a
+    message. Nothing is written.
+    """
+    students = resolve_students(conn, [row[1] for row in rows])
+    entries, errors = [], []
+    for line, student_id, points, reason in rows:
+        student_id, reason = str(student_id or '').strip(), str(reason or '').strip()
+        try:
+            points = float(points)
+            message = None if math.isfinite(points) and points != 0 else '分数无效'
+        except (TypeError, ValueError):
+            message = '分数格式错误'
+        if not reason:
+            message = message or '缺少理由'
+        if student_id not in students:
+            message = '学工号不存在' if student_id else '缺少学工号'
+        if message:
+            errors.append({'line': line, 'student_id': student_id, 'message': message})
+            continue
+        user = students[student_id]
+        entries.append({'user_id': user['id'], 'student_id': student_id, 'name': user['name'],
+                        'points': points, 'reason': reason})
+    return entries, errors
+
+
+def add_points(conn, entries, created_by):
+    """Insert manual points records for planned entries in one transaction; returns how many"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        added = conn.executemany('''
+            INSERT INTO points_records (user_id, points, reason, record_type, created_by)
+            VALUES (?, ?, ?, 'manual', ?)
+        ''', ((entry['user_id'], entry['points'], entry['reason'], created_by) for entry in entries)).rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return added
+
+
+def revoke_points(conn, record_ids):
+    """Revoke manual points records by id in one transaction
+
+    Records created by attendance or leave handling are left to those
+    flows, as are records already revoked. Returns (revoked, skipped).
+    """
+    record_ids = sorted({int(value) for value in record_ids if str(value).strip().isdigit()})
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        revoked = conn.executemany('''
+            UPDATE points_records SET is_deleted = 1
+            WHERE id = ? AND is_deleted = 0 AND record_type = 'manual'
+        ''', ((record_id,) for record_id in record_ids)).rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return revoked, len(record_ids) - revoked
+
+
+# Attendance status -> (points setting, its default, reason, record_type) of an
+# admin edit, as update_attendance_status scores it; 'present' carries no points
+ATTENDANCE_EDITS = {
+    'present': (None, '0', '管理员标记为已签到', 'manual'),
+    'absent': ('absent_points', '-2', '管理员标记为缺勤', 'absence'),
+    'public_leave': ('public_leave_points', '0', '管理员标记为公假', 'manual_leave'),
+    'personal_leave': ('personal_leave_points', '-1', '管理员标记为事假', 'manual_leave'),
+    'sick_leave': ('sick_leave_points', '-0.5', '管理员标记为病假', 'manual_leave'),
+}
+
+
+def status_points(conn):
+    """{attendance status: points} from the current settings, in one query"""
+    keys = [key for key, _default, _reason, _type in ATTENDANCE_EDITS.values() if key]
+    placeholders = ','.join('?' * len(keys))
+    values = dict(conn.execute(f'SELECT key, value FROM system_settings WHERE key IN ({placeholders})', keys).fetchall())
+    return {status: float(values.get(key, default)) if key else 0.0
+            for status, (key, default, _reason, _type) in ATTENDANCE_EDITS.items()}
+
+
+def apply_attendance_changes(conn, session_id, changes, created_by):
+    """Set the attendance status of many users in a session, re-scoring them
+
+    changes is a list of (user_id, status); the last change for a user
+    wins. Users get an attendance record if they have none; their live
+    points records for the session are soft-deleted and replaced by one
+    for the new status, all set-wise in one transaction. Unknown (or
+    admin) users and unchanged statuses are skipped. Returns counts.
+    """
+    points = status_points(conn)
+    edits = {}
+    for user_id, status in changes:
+        if str(user_id).strip().isdigit() and status in ATTENDANCE_EDITS:
+            edits[int(user_id)] = status
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS bulk_attendance_edits (
+                user_id INTEGER PRIMARY KEY, status TEXT, points REAL, reason TEXT, record_type TEXT
+            )
+        ''')
+        conn.execute('DELETE FROM bulk_attendance_edits')
+        conn.executemany('''
+            INSERT INTO bulk_attendance_edits (user_id, status, points, reason, record_type) VALUES (?, ?, ?, ?, ?)
+        ''', ((user_id, status, points[status], ATTENDANCE_EDITS[status][2], ATTENDANCE_EDITS[status][3])
+              for user_id, status in edits.items()))
+
+        counts = {
+            'unknown': conn.execute('''
+                DELETE FROM bulk_attendance_edits WHERE user_id NOT IN (SELECT id FROM users WHERE is_admin = 0)
+            ''').rowcount,
+            'unchanged': conn.execute('''
+                DELETE FROM bulk_attendance_edits WHERE EXISTS (
+                    SELECT 1 FROM attendance_records ar
+                    WHERE ar.session_id = ? AND ar.user_id = bulk_attendance_edits.user_id
+                      AND ar.status = bulk_attendance_edits.status
+                )
+            ''', (session_id,)).rowcount,
+            'updated': conn.execute('''
+                SELECT COUNT(*) FROM bulk_attendance_edits e
+                JOIN attendance_records ar ON ar.session_id = ? AND ar.user_id = e.user_id
+            ''', (session_id,)).fetchone()[0]
+        }
+        counts['added'] = conn.execute('SELECT COUNT(*) FROM bulk_attendance_edits').fetchone()[0] - counts['updated']
+
+        conn.execute('''
+            INSERT INTO attendance_records (session_id, user_id, status, checked_in_at)
+            SELECT ?, user_id, status, ? FROM bulk_attendance_edits WHERE true
+            ON CONFLICT(session_id, user_id) DO UPDATE SET status = excluded.status
+        ''', (session_id, tz_now()))
+        counts['points_revoked'] = conn.execute('''
+            UPDATE points_records SET is_deleted = 1
+            WHERE user_id IN (SELECT user_id FROM bulk_attendance_edits) AND session_id = ? AND is_deleted = 0
+        ''', (session_id,)).rowcount
+        counts['points_added'] = conn.execute('''
+            INSERT INTO points_records (user_id, points, reason, record_type, session_id, created_by)
+            SELECT user_id, points, reason, record_type, ?, ? FROM bulk_attendance_edits WHERE points != 0
+        ''', (session_id, created_by)).rowcount
+
+        conn.execute('DELETE FROM bulk_attendance_edits')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return counts
+
+
+LEAVE_DECISIONS = {'approve': 'approved', 'reject': 'rejected'}
+
+
+def decide_leaves(conn, leave_ids, action, approver_id):
+    """Approve or reject leave requests in one transaction
+
+    Only requests that are still pending change; one decided meanwhile
+    (another admin, another tab) is left as it is. Returns
+    (updated, skipped).
+    """
+    status = LEAVE_DECISIONS[action]
+    leave_ids = sorted({int(value) for value in leave_ids if str(value).strip().isdigit()})
+    decided_at = tz_now()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        updated = conn.executemany('''
+            UPDATE leave_requests SET status = ?, approved_by = ?, approved_at = ?
+            WHERE id = ? AND status = 'pending'
+        ''', ((status, approver_id, decided_at, leave_id) for leave_id in leave_ids)).rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return updated, len(leave_ids) - updated
+
+
+# Statements removing up to :limit rows each, in order; children first so an
+# interrupted job never leaves rows pointing at a missing session. A step is
+# finished once it touches fewer rows than the limit.
+SESSION_DELETE_STEPS = (
+    ('points_records', '''
+        UPDATE points_records SET is_deleted = 1
+        WHERE id IN (
+            SELECT id FROM points_records
+            WHERE session_id IN (SELECT id FROM bulk_session_ids) AND is_deleted = 0
+            LIMIT :limit
+        )
+    '''),
+    ('qr_codes', '''
+        DELETE FROM qr_codes
+        WHERE id IN (SELECT id FROM qr_codes WHERE session_id IN (SELECT id FROM bulk_session_ids) LIMIT :limit)
+    '''),
+    ('attendance_records', '''
+        DELETE FROM attendance_records
+        WHERE id IN (
+            SELECT id FROM attendance_records WHERE session_id IN (SELECT id FROM bulk_session_ids) LIMIT :limit
+        )
+    '''),
+    ('leave_requests', '''
+        UPDATE leave_requests
+        SET session_id = CASE WHEN session_id IN (SELECT id FROM bulk_session_ids) THEN NULL ELSE session_id END,
+            paired_session_id = CASE WHEN paired_session_id IN (SELECT id FROM bulk_session_ids)
+                                     THEN NULL ELSE paired_session_id END
+        WHERE id IN (
+            SELECT id FROM leave_requests WHERE session_id IN (SELECT id FROM bulk_session_ids)
+            UNION
+            SELECT id FROM leave_requests WHERE paired_session_id IN (SELECT id FROM bulk_session_ids)
+            LIMIT :limit
+        )
+    '''),
+    ('attendance_sessions', '''
+        DELETE FROM attendance_sessions
+        WHERE id IN (
+            SELECT id FROM attendance_sessions WHERE id IN (SELECT id FROM bulk_session_ids) LIMIT :limit
+        )
+    '''),
+)
+SESSION_DELETE_COUNTS = '''
+    SELECT (SELECT COUNT(*) FROM points_records
+            WHERE session_id IN (SELECT id FROM bulk_session_ids) AND is_deleted = 0)
+         + (SELECT COUNT(*) FROM qr_codes WHERE session_id IN (SELECT id FROM bulk_session_ids))
+         + (SELECT COUNT(*) FROM attendance_records WHERE session_id IN (SELECT id FROM bulk_session_ids))
+         + (SELECT COUNT(*) FROM leave_requests
+            WHERE session_id IN (SELECT id FROM bulk_session_ids)
+               OR paired_session_id IN (SELECT id FROM bulk_session_ids))
+         + (SELECT COUNT(*) FROM bulk_session_ids)
+'''
+
+
+def queue_session_delete(conn, session_ids, created_by=None):
+    """Close attendance sessions and queue a job that deletes them with all their data
+
+    Paired check-in/check-out sessions are always deleted together.
+    Returns (job_id, activity codes), or (None, []) if none of the
+    sessions exist. The caller runs the job (jobs.run or
+    jobs.start_in_background).
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        _load_ids(conn, 'bulk_session_ids', session_ids)
+        conn.execute('''
+            INSERT OR IGNORE INTO bulk_session_ids (id)
+            SELECT paired_session_id FROM attendance_sessions
+            WHERE id IN (SELECT id FROM bulk_session_ids) AND paired_session_id IS NOT NULL
+        ''')
+        conn.execute('''
+            INSERT OR IGNORE INTO bulk_session_ids (id)
+            SELECT id FROM attendance_sessions WHERE paired_session_id IN (SELECT id FROM bulk_session_ids)
+        ''')
+        rows = conn.execute('''
+            SELECT id, activity_code FROM attendance_sessions
+            WHERE id IN (SELECT id FROM bulk_session_ids) ORDER BY id
+        ''').fetchall()
+        if not rows:
+            conn.rollback()
+            return None, []
+
+        # No new check-ins, QR tokens or records while the rows are being removed
+        conn.execute('UPDATE attendance_sessions SET is_active = 0 WHERE id IN (SELECT id FROM bulk_session_ids)')
+        # Group bindings are a handful of rows per session
+        conn.execute('DELETE FROM session_groups WHERE session_id IN (SELECT id FROM bulk_session_ids)')
+
+        codes = [row['activity_code'] for row in rows]
+        total = conn.execute(SESSION_DELETE_COUNTS).fetchone()[0]
+        job_id = jobs.create(conn, 'delete_sessions', {'session_ids': [row['id'] for row in rows], 'codes': codes},
+                             total=total, created_by=created_by)
+        conn.execute('DELETE FROM bulk_session_ids')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return job_id, codes
+
+
+@jobs.handler('delete_sessions')
+def delete_sessions_job(conn, job):
+    """Job handler for queue_session_delete: at most BULK_CHUNK_ROWS rows per transaction"""
+    _load_ids(conn, 'bulk_session_ids', job['params']['session_ids'])
+    conn.commit()
+
+    step = (job['state'] or {'step': 0})['step']
+    counts = job['result'] or {table: 0 for table, _sql in SESSION_DELETE_STEPS}
+    progress = job['progress']
+    while step < len(SESSION_DELETE_STEPS):
+        conn.execute('BEGIN IMMEDIATE')
+        budget = BULK_CHUNK_ROWS
+        while step < len(SESSION_DELETE_STEPS) and budget > 0:
+            table, sql = SESSION_DELETE_STEPS[step]
+            done = conn.execute(sql, {'limit': budget}).rowcount
+            counts[table] += done
+            progress += done
+            budget -= done
+            if budget > 0:
+                step += 1
+        jobs.checkpoint(conn, job['id'], progress, {'step': step}, counts)
+        if step < len(SESSION_DELETE_STEPS):
+            time.sleep(BULK_CHUNK_PAUSE)
+
+    conn.execute('DELETE FROM bulk_session_ids')
+    conn.commit()
+    return counts
+
+
+# status -> (setting, default, ledger record types it produces, record type and
+# reason of a new entry; absences get 签到缺勤/签退缺勤 like end_attendance_session)
+RESCORE_STATUSES = {
+    'present': ('checkin_points', '1', ('checkin',), 'checkin', '签到成功'),
+    'absent': ('absent_points', '-2', ('absence',), 'absence', None),
+    'public_leave': ('public_leave_points', '0', ('leave', 'manual_leave'), 'manual_leave', '公假'),
+    'personal_leave': ('personal_leave_points', '-1', ('leave', 'manual_leave'), 'manual_leave', '事假'),
+    'sick_leave': ('sick_leave_points', '-0.5', ('leave', 'manual_leave'), 'manual_leave', '病假')
+}
+RESCORE_SAMPLES = 20
+# Changes applied per write transaction; a revalued entry is an INSERT plus
+# an UPDATE, each firing the created_at_ms trigger (about 20 ms per window
+# on the large bench database)
+RESCORE_WRITE_ROWS = 500
+# The first two hold the job's parameters, the rest one batch
+RESCORE_TEMP_TABLES = ('bulk_rescore_values', 'bulk_rescore_types', 'bulk_rescore_sessions',
+                       'bulk_rescore_entries', 'bulk_rescore')
+
+
+def queue_rescore(conn, session_ids, values, dry_run=True, created_by=None, label=None):
+    """Queue a job that re-scores the ledger of sessions for new point values
+
+    values is {status: (previous points, new points)} for the statuses
+    to re-score. Live points records produced by those statuses are
+    replaced by copies carrying the new value (same type, reason and
+    date); where the previous value was 0 no record was written, so one
+    is added wherever check-in or ending the session would have written
+    it. A dry run only reports the difference; confirm it by queueing
+    the same params with dry_run=False. Paired sessions are always
+    re-scored together. Returns the job id, or None if none of the
+    sessions exist.
+    """
+    values = {status: [float(previous), float(points)] for status, (previous, points) in values.items()
+              if status in RESCORE_STATUSES}
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        _load_ids(conn, 'bulk_session_ids', session_ids)
+        conn.execute('''
+            INSERT OR IGNORE INTO bulk_session_ids (id)
+            SELECT paired_session_id FROM attendance_sessions
+            WHERE id IN (SELECT id FROM bulk_session_ids) AND paired_session_id IS NOT NULL
+        ''')
+        conn.execute('''
+            INSERT OR IGNORE INTO bulk_session_ids (id)
+            SELECT id FROM attendance_sessions WHERE paired_session_id IN (SELECT id FROM bulk_session_ids)
+        ''')
+        session_ids = [row[0] for row in conn.execute('''
+            SELECT id FROM attendance_sessions WHERE id IN (SELECT id FROM bulk_session_ids) ORDER BY id
+        ''')]
+        conn.execute('DELETE FROM bulk_session_ids')
+        job_id = jobs.create(conn, 'rescore_points',
+                             {'session_ids': session_ids, 'values': values, 'dry_run': bool(dry_run), 'label': label},
+                             total=len(session_ids), created_by=created_by) if session_ids else None
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return job_id
+
+
+def _load_rescore_values(conn, values):
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS bulk_rescore_values (
+            status TEXT PRIMARY KEY, previous REAL, points REAL, record_type TEXT, reason TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS bulk_rescore_types (
+            status TEXT, record_type TEXT, PRIMARY KEY (status, record_type)
+        )
+    ''')
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS bulk_rescore_sessions (
+            id INTEGER PRIMARY KEY, session_type TEXT, paired_session_id INTEGER, has_checkout INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS bulk_rescore_entries (
+            id INTEGER PRIMARY KEY, session_id INTEGER, user_id INTEGER, status TEXT, points REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS temp.idx_bulk_rescore_entries ON bulk_rescore_entries (session_id, user_id)')
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS bulk_rescore (
+            id INTEGER PRIMARY KEY, entry_id INTEGER, session_id INTEGER, user_id INTEGER, status TEXT, old_points REAL, points REAL
+        )
+    ''')
+    for table in RESCORE_TEMP_TABLES:
+        conn.execute(f'DELETE FROM {table}')
+    conn.executemany('''
+        INSERT INTO bulk_rescore_values (status, previous, points, record_type, reason) VALUES (?, ?, ?, ?, ?)
+    ''', ((status, previous, points, RESCORE_STATUSES[status][3], RESCORE_STATUSES[status][4])
+          for status, (previous, points) in values.items()))
+    conn.executemany('INSERT INTO bulk_rescore_types (status, record_type) VALUES (?, ?)',
+                     ((status, record_type) for status in values for record_type in RESCORE_STATUSES[status][2]))
+
+
+def _rescore_batch(conn, after, upto):
+    """Fill bulk_rescore with the changes for the sessions in (after, upto]"""
+    conn.execute('''
+        INSERT INTO bulk_rescore_sessions (id, session_type, paired_session_id, has_checkout)
+        SELECT s.id, s.session_type, s.paired_session_id,
+               EXISTS (SELECT 1 FROM attendance_sessions co WHERE co.paired_session_id = s.id)
+        FROM attendance_sessions s
+        WHERE s.id > ? AND s.id <= ? AND s.id IN (SELECT id FROM bulk_session_ids)
+    ''', (after, upto))
+    # The batch's live entries through the points_records session_id index
+    # (CROSS JOIN pins that order; the planner would scan attendance_records)
+    conn.execute('''
+        INSERT INTO bulk_rescore_entries (id, session_id, user_id, status, points)
+        SELECT pr.id, pr.session_id, pr.user_id, ar.status, pr.points
+        FROM bulk_rescore_sessions s
+        CROSS JOIN points_records pr ON pr.session_id = s.id
+        CROSS JOIN attendance_records ar ON ar.session_id = pr.session_id AND ar.user_id = pr.user_id
+        JOIN bulk_rescore_types t ON t.status = ar.status AND t.record_type = pr.record_type
+        WHERE pr.is_deleted = 0
+    ''')
+    # Entries that carry another value than the new one
+    conn.execute('''
+        INSERT INTO bulk_rescore (entry_id, session_id, user_id, status, old_points, points)
+        SELECT e.id, e.session_id, e.user_id, e.status, e.points, v.points
+        FROM bulk_rescore_entries e
+        JOIN bulk_rescore_values v ON v.status = e.status
+        WHERE e.points != v.points
+    ''')
+    # Entries that were skipped because the value was 0: check-in points
+    # once per pair (on the check-out), absences and leaves not charged
+    # again on a check-out when the check-in already had them
+    conn.execute('''
+        INSERT INTO bulk_rescore (entry_id, session_id, user_id, status, old_points, points)
+        SELECT NULL, ar.session_id, ar.user_id, ar.status, 0, v.points
+        FROM bulk_rescore_sessions s
+        JOIN attendance_records ar ON ar.session_id = s.id
+        JOIN bulk_rescore_values v ON v.status = ar.status AND v.previous = 0 AND v.points != 0
+        LEFT JOIN attendance_records pair
+               ON s.session_type = 'checkout' AND pair.session_id = s.paired_session_id AND pair.user_id = ar.user_id
+        WHERE NOT EXISTS (
+                SELECT 1 FROM bulk_rescore_entries e WHERE e.session_id = ar.session_id AND e.user_id = ar.user_id
+            )
+          AND CASE ar.status
+                WHEN 'present' THEN CASE WHEN s.session_type = 'checkout' THEN pair.status IS 'present'
+                                         ELSE NOT s.has_checkout END
+                WHEN 'absent' THEN pair.status IS NOT 'absent'
+                ELSE pair.status IS NULL OR pair.status NOT IN ('public_leave', 'personal_leave', 'sick_leave')
+              END
+    ''')
+
+
+def _apply_rescore(conn, lo, hi, created_by):
+    """Apply the bulk_rescore rows in (lo, hi]; the caller holds the write transaction
+
+    The rows were computed in an earlier read transaction, so an entry
+    is only replaced if it is still live and a record is only added if
+    the status is unchanged and no live entry appeared meanwhile. That
+    also makes a batch safe to apply twice.
+    """
+    conn.execute('''
+        INSERT INTO points_records (user_id, points, reason, record_type, session_id, leave_request_id,
+                                    created_by, created_at, created_at_ms)
+        SELECT pr.user_id, r.points, pr.reason, pr.record_type, pr.session_id, pr.leave_request_id, ?,
+               pr.created_at, pr.created_at_ms
+        FROM bulk_rescore r
+        JOIN points_records pr ON pr.id = r.entry_id
+        WHERE r.id > ? AND r.id <= ? AND r.points != 0 AND pr.is_deleted = 0
+    ''', (created_by, lo, hi))
+    conn.execute('''
+        UPDATE points_records SET is_deleted = 1
+        WHERE id IN (SELECT entry_id FROM bulk_rescore WHERE id > ? AND id <= ? AND entry_id IS NOT NULL)
+          AND is_deleted = 0
+    ''', (lo, hi))
+    conn.execute('''
+        INSERT INTO points_records (user_id, points, reason, record_type, session_id, created_by,
+                                    created_at, created_at_ms)
+        SELECT r.user_id, r.points,
+               COALESCE(v.reason, CASE s.session_type WHEN 'checkout' THEN '签退缺勤' ELSE '签到缺勤' END),
+               v.record_type, r.session_id, ?, ar.checked_in_at, ar.checked_in_at_ms
+        FROM bulk_rescore r
+        JOIN bulk_rescore_values v ON v.status = r.status
+        JOIN bulk_rescore_sessions s ON s.id = r.session_id
+        JOIN attendance_records ar ON ar.session_id = r.session_id AND ar.user_id = r.user_id AND ar.status = r.status
+        WHERE r.id > ? AND r.id <= ? AND r.entry_id IS NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM points_records pr
+              JOIN bulk_rescore_types t ON t.status = r.status AND t.record_type = pr.record_type
+              WHERE pr.user_id = r.user_id AND pr.session_id = r.session_id AND pr.is_deleted = 0
+          )
+    ''', (created_by, lo, hi))
+
+
+@jobs.handler('rescore_points')
+def rescore_points_job(conn, job):
+    """Job handler for queue_rescore: sessions in batches of about BULK_CHUNK_ROWS attendance records
+
+    Each batch's changes are computed first, then applied in write
+    transactions of RESCORE_WRITE_ROWS changes. The result is the diff
+    report: per status the entries revalued, removed (new value 0) and
+    added, the total change, and a sample of the affected rows. A batch
+    interrupted half-way is recomputed on resume, so the report leaves
+    out what it had already applied.
+    """
+    params = job['params']
+    dry_run = params['dry_run']
+    _load_ids(conn, 'bulk_session_ids', params['session_ids'])
+    _load_rescore_values(conn, params['values'])
+    conn.commit()
+
+    after = (job['state'] or {'after': 0})['after']
+    report = job['result'] or {
+        'statuses': {status: {'revalued': 0, 'removed': 0, 'added': 0, 'delta': 0} for status in params['values']},
+        'samples': []
+    }
+    progress = job['progress']
+    sizes = conn.execute('''
+        SELECT s.id, (SELECT COUNT(*) FROM attendance_records WHERE session_id = s.id)
+        FROM bulk_session_ids s WHERE s.id > ? ORDER BY s.id
+    ''', (after,)).fetchall()
+
+    batch_rows, batch_sessions = 0, 0
+    for index, (session_id, rows) in enumerate(sizes):
+        batch_rows += rows
+        batch_sessions += 1
+        if batch_rows < BULK_CHUNK_ROWS and index < len(sizes) - 1:
+            continue
+
+        # The diff is computed in a read transaction (only TEMP tables are
+        # written); the member history scan never holds the write lock
+        conn.execute('BEGIN')
+        _rescore_batch(conn, after, session_id)
+        for status, revalued, removed, added, delta in conn.execute('''
+            SELECT status, SUM(entry_id IS NOT NULL AND points != 0), SUM(entry_id IS NOT NULL AND points = 0),
+                   SUM(entry_id IS NULL), SUM(points - old_points)
+            FROM bulk_rescore GROUP BY status
+        '''):
+            counts = report['statuses'][status]
+            counts['revalued'] += revalued
+            counts['removed'] += removed
+            counts['added'] += added
+            counts['delta'] = round(counts['delta'] + delta, 4)
+        if len(report['samples']) < RESCORE_SAMPLES:
+            report['samples'] += [dict(row) for row in conn.execute('''
+                SELECT u.student_id, u.name, s.activity_code, r.status, r.old_points, r.points
+                FROM bulk_rescore r
+                JOIN users u ON u.id = r.user_id
+                JOIN attendance_sessions s ON s.id = r.session_id
+                ORDER BY r.session_id, u.student_id
+                LIMIT ?
+            ''', (RESCORE_SAMPLES - len(report['samples']),))]
+        conn.commit()
+
+        if not dry_run:
+            lo, last = conn.execute('SELECT MIN(id) - 1, MAX(id) FROM bulk_rescore').fetchone()
+            while last is not None and lo < last:
+                conn.execute('BEGIN IMMEDIATE')
+                _apply_rescore(conn, lo, lo + RESCORE_WRITE_ROWS, job['created_by'])
+                conn.commit()
+                lo += RESCORE_WRITE_ROWS
+                time.sleep(BULK_CHUNK_PAUSE)
+        for table in RESCORE_TEMP_TABLES[2:]:
+            conn.execute(f'DELETE FROM {table}')
+
+        after = session_id
+        progress += batch_sessions
+        batch_rows, batch_sessions = 0, 0
+        jobs.checkpoint(conn, job['id'], progress, {'after': after}, report)
+
+    conn.execute('DELETE FROM bulk_session_ids')
+    conn.commit()
+    return report
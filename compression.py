@@ -0,0 +1,135 @@
+"""
+Response compression
+
+An after_request hook that gzip- or brotli-encodes text responses
+(HTML, JSON, CSV, CSS, JS) according to the client's Accept-Encoding.
+Small bodies are left alone and streamed responses are compressed chunk
+by chunk. File responses of those types (the send_file CSV exports and
+templates) are read into memory and compressed when they are no larger
+than COMPRESSION_BUFFER_MAX; bigger files, X-Sendfile responses and the
+precompressed assets pass through untouched. Brotli is used only when the `brotli` package is
+installed.
+"""
+import os
+import zlib
+
+from flask import request
+
+import instrumentation
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENABLED = os.getenv('COMPRESSION_ENABLED', '1') == '1'
+MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '500'))
+GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+BUFFER_MAX = int(os.getenv('COMPRESSION_BUFFER_MAX', str(4 * 1024 * 1024)))
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript', 'text/xml',
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml'
+}
+
+
+def choose_encoding(accept_encodings):
+    """Best encoding the client accepts, or None"""
+    if brotli is not None and accept_encodings['br'] > 0 and accept_encodings['br'] >= accept_encodings['gzip']:
+        return 'br'
+    if accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    """Compress a streamed body, flushing after every chunk so nothing is held back"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def _should_compress(response):
+    if request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if 'Content-Encoding' in response.headers or 'Content-Range' in response.headers:
+        # Precompressed assets and partial content
+        return False
+    if 'no-transform' in response.headers.get('Cache-Control', ''):
+        return False
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return False
+    if response.direct_passthrough:
+        # send_file: only bodies small enough to buffer
+        return 'X-Sendfile' not in response.headers and (response.content_length or BUFFER_MAX + 1) <= BUFFER_MAX
+    return True
+
+
+def _buffer_file(response):
+    """Read a send_file body into memory so it can be compressed like any other"""
+    try:
+        data = b''.join(response.response)
+    finally:
+        if hasattr(response.response, 'close'):
+            response.response.close()
+    response.direct_passthrough = False
+    response.set_data(data)
+    # Byte ranges would refer to the uncompressed file
+    response.headers.pop('Accept-Ranges', None)
+
+
+def compress_response(response):
+    """after_request hook"""
+    if not ENABLED or not _should_compress(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.direct_passthrough:
+        _buffer_file(response)
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        with instrumentation.timed('compress'):
+            response.set_data(compress_body(data, encoding))
+
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# The app reads these at import time; every test run gets a fresh database
+_WORK_DIR = tempfile.mkdtemp(prefix='pytakeoff-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(_WORK_DIR, 'database.db')
+os.environ['UPLOAD_FOLDER'] = os.path.join(_WORK_DIR, 'uploads')
+os.environ['METRICS_DIR'] = os.path.join(_WORK_DIR, 'metrics')
+os.environ['SQL_LOG_PATH'] = os.path.join(_WORK_DIR, 'logs', 'sql.log')
+
+from instrumentation import statement_budget as _statement_budget
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_WORK_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    """Test client; ``login(client, user_id)`` signs it in"""
+    return app.test_client()
+
+
+@pytest.fixture
+def login():
+    """Sign a test client in as a user without going through the password hash"""
+    def sign_in(client, user_id):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+    return sign_in
+
+
+@pytest.fixture
+def db(app):
+    from database import get_db
+    conn = get_db()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def make_user(db):
+    """Create a student who has already changed the initial password"""
+    def make(name='学生'):
+        cursor = db.execute('''
+            INSERT INTO users (student_id, name, password_hash, is_admin, must_change_password)
+            VALUES (?, ?, '', 0, 0)
+        ''', (f'T{os.urandom(4).hex()}', name))
+        db.commit()
+        return cursor.lastrowid
+    return make
+
+
+@pytest.fixture
+def active_session(db):
+    """An active check-in session without groups; returns its id"""
+    admin_id = db.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    cursor = db.execute('''
+        INSERT INTO attendance_sessions (activity_code, created_by, is_active, session_type)
+        VALUES (?, ?, 1, 'checkin')
+    ''', (os.urandom(3).hex().upper(), admin_id))
+    db.commit()
+    return cursor.lastrowid
+
+
+@pytest.fixture
+def statement_budget():
+    """Fail the test when a block runs more SQL statements than allowed
+
+    Every request handled inside the block is also checked against the
+    budget its route declares with ``@budget(n)``::
+
+        def test_qr_status(client, active_session, statement_budget):
+            with statement_budget(10):
+                client.get(f'/api/qr/status/{active_session}')
+    """
+    return _statement_budget
@@ -1,36 +1,156 @@
 import sqlite3
 import os
+from urllib.request import pathname2url
 from werkzeug.security import generate_password_hash
-from timezone_utils import now
+from timezone_utils import now, epoch_ms
+from instrumentation import TracedConnection, trace_connection
 
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'database.db')
+# Bump whenever init_db() gains a migration; databases at this version skip init_db()
+SCHEMA_VERSION = 9
 
-def get_db():
-    """Get database connection"""
-    os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
-    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+DATABASE_PATH = os.getenv('DATABASE_PATH', os.path.join(os.path.dirname(__file__), 'data', 'database.db'))
+
+# Seconds a connection waits for another writer (thread or process) before "database is locked"
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '5'))
+
+# WAL lets readers run while a writer commits; set by init_db() (the mode is stored in the file)
+DB_JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'wal').lower()
+
+# get_db(readonly=True) opens a mode=ro connection; 0 hands out ordinary connections instead
+DB_READONLY_CONNECTIONS = os.getenv('DB_READONLY_CONNECTIONS', '1') == '1'
+
+# Performance profiles, picked with DB_PROFILE; DB_CACHE_SIZE, DB_MMAP_SIZE, DB_PAGE_SIZE and
+# DB_TEMP_STORE override single values. None leaves SQLite's default in place.
+# get_db() opens a new connection per call, so cache_size (negative = KiB) only lasts for one
+# request and neither profile raises it; mmap_size maps the file so connections share the OS
+# page cache, which is what carries across requests; page_size is a property of the file,
+# changing it makes init_db() rebuild the database once with VACUUM.
+DB_PROFILES = {
+    'default': {'cache_size': None, 'mmap_size': None, 'page_size': None, 'temp_store': None},
+    'large': {'cache_size': None, 'mmap_size': 268435456, 'page_size': 8192, 'temp_store': 'memory'},
+}
+DB_PROFILE = os.getenv('DB_PROFILE', 'default')
+if DB_PROFILE not in DB_PROFILES:
+    raise ValueError(f"DB_PROFILE must be one of: {', '.join(DB_PROFILES)}")
+DB_PRAGMAS = dict(DB_PROFILES[DB_PROFILE])
+for _name in DB_PRAGMAS:
+    _value = os.getenv(f'DB_{_name.upper()}')
+    if _value:
+        DB_PRAGMAS[_name] = _value if _name == 'temp_store' else int(_value)
+
+# Text timestamp columns mirrored into integer UTC epoch-millisecond `<column>_ms` columns
+TIMESTAMP_COLUMNS = {
+    'users': ('created_at',),
+    'attendance_sessions': ('created_at',),
+    'attendance_records': ('checked_in_at',),
+    'leave_requests': ('created_at', 'approved_at', 'used_at'),
+    'leave_attachments': ('uploaded_at',),
+    'points_records': ('created_at',),
+    'qr_codes': ('created_at', 'expires_at'),
+}
+
+def local_timestamp():
+    """Return current timestamp in local timezone"""
+    return now().strftime('%Y-%m-%d %H:%M:%S')
+
+def sql_epoch_ms(*args):
+    """EPOCH_MS([value]) SQL function: epoch milliseconds of a stored timestamp
+
+    Without an argument, or for the literal 'LOCAL_TIMESTAMP' that the
+    column defaults leave behind, it returns the current time.
+    """
+    if not args or args[0] == 'LOCAL_TIMESTAMP':
+        return epoch_ms()
+    return epoch_ms(args[0])
+
+def epoch_ms_sql(expr):
+    """Plain-SQL equivalent of EPOCH_MS(expr) for the triggers
+
+    Triggers fire on every connection, including ones that never ran
+    register_functions() (the sqlite3 shell, backups, one-off fixes), so
+    they cannot call a Python function. Text with an offset ('+08:00',
+    'Z'), which is what the app writes through tz_now(), converts
+    exactly; naive text is read with the configured timezone's current
+    UTC offset, fixed when init_db() creates the triggers.
+    """
+    offset = int(now().utcoffset().total_seconds() // 60)
+    return f'''CASE
+        WHEN {expr} = 'LOCAL_TIMESTAMP' THEN CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)
+        WHEN {expr} LIKE '%Z' OR (substr({expr}, -6, 1) IN ('+', '-') AND substr({expr}, -3, 1) = ':')
+            THEN CAST(ROUND((julianday({expr}) - 2440587.5) * 86400000) AS INTEGER)
+        ELSE CAST(ROUND((julianday({expr}, '{-offset:+d} minutes') - 2440587.5) * 86400000) AS INTEGER)
+    END'''
+
+def register_functions(conn):
+    """Register the custom SQL functions used by defaults and triggers"""
+    conn.create_function("LOCAL_TIMESTAMP", 0, local_timestamp)
+    conn.create_function("EPOCH_MS", -1, sql_epoch_ms)
+
+def get_db(readonly=False):
+    """Get database connection
+
+    Every call opens a new connection owned by the calling thread; close it
+    before the request ends. Connections are never shared between threads
+    (sqlite3 raises ProgrammingError if one is), which is what makes the
+    gthread worker mode safe.
+
+    readonly=True is for handlers that only read: the file is opened with
+    mode=ro and PRAGMA query_only, so the connection can never take a write
+    lock. Under WAL such readers never block (or wait for) check-in writes.
+    """
+    if readonly and DB_READONLY_CONNECTIONS:
+        uri = f'file:{pathname2url(os.path.abspath(DATABASE_PATH))}?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, timeout=DB_BUSY_TIMEOUT, factory=TracedConnection)
+        conn.execute('PRAGMA query_only = 1')
+    else:
+        os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+        conn = sqlite3.connect(DATABASE_PATH, timeout=DB_BUSY_TIMEOUT, factory=TracedConnection)
     conn.row_factory = sqlite3.Row
+    trace_connection(conn)
 
     # Configure SQLite to use localtime for datetime functions
     conn.execute("PRAGMA localtime = 1")
 
-    # Set timezone for SQLite datetime functions
-    from timezone_utils import get_timezone
-    tz_name = str(get_timezone())
-    conn.execute(f"PRAGMA temp_store = 2")  # Use memory for temp storage
+    # Connection-level settings of the active profile (page_size is applied by init_db)
+    for name in ('cache_size', 'mmap_size', 'temp_store'):
+        if DB_PRAGMAS[name] is not None:
+            conn.execute(f"PRAGMA {name} = {DB_PRAGMAS[name]}")
 
     # Register custom functions for datetime handling
-    def local_timestamp():
-        """Return current timestamp in local timezone"""
-        return now().strftime('%Y-%m-%d %H:%M:%S')
-
-    conn.create_function("LOCAL_TIMESTAMP", 0, local_timestamp)
+    register_functions(conn)
 
     return conn
 
 def init_db():
-    """Initialize database with tables"""
+    """Initialize database with tables
+
+    Applies the profile's page size and DB_JOURNAL_MODE to the file, then
+    returns after one PRAGMA read when the schema is already at
+    SCHEMA_VERSION. Otherwise the migration runs under BEGIN IMMEDIATE, so
+    workers booting at the same time apply it exactly once.
+    """
     conn = get_db()
+    page_size = DB_PRAGMAS['page_size']
+    if page_size and conn.execute('PRAGMA page_size').fetchone()[0] != page_size:
+        # The page size of a WAL database cannot change; rebuild in rollback mode, then
+        # switch back below. VACUUM rewrites the whole file, so this can take a while.
+        conn.execute('PRAGMA busy_timeout = 300000')
+        conn.execute('PRAGMA journal_mode = delete')
+        conn.execute(f'PRAGMA page_size = {page_size}')
+        conn.execute('VACUUM')
+    if DB_JOURNAL_MODE and conn.execute('PRAGMA journal_mode').fetchone()[0] != DB_JOURNAL_MODE:
+        conn.execute(f'PRAGMA journal_mode = {DB_JOURNAL_MODE}')
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+        conn.close()
+        return
+
+    # Other workers wait here while the first one migrates (backfills can take a while)
+    conn.execute('PRAGMA busy_timeout = 300000')
+    conn.execute('BEGIN IMMEDIATE')
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+        conn.rollback()
+        conn.close()
+        return
     cursor = conn.cursor()
 
     # Users table
@@ -151,6 +271,174 @@ def init_db():
         )
     ''')
 
+    # Roster-scoped leave lookups (pending/approved leaves of a session's members)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_leave_requests_status_user ON leave_requests(status, user_id)')
+
+    # Groups (class rosters) and their members
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT LOCAL_TIMESTAMP,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS group_members (
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (group_id, user_id),
+            FOREIGN KEY (group_id) REFERENCES user_groups(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members(user_id)')
+
+    # Groups a session is bound to; a session without groups targets all users
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_groups (
+            session_id INTEGER NOT NULL,
+            group_id INTEGER NOT NULL,
+            PRIMARY KEY (session_id, group_id),
+            FOREIGN KEY (session_id) REFERENCES attendance_sessions(id),
+            FOREIGN KEY (group_id) REFERENCES user_groups(id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_session_groups_group ON session_groups(group_id)')
+
+    # Integer epoch-millisecond timestamps, kept in sync with the text columns by triggers
+    for table, columns in TIMESTAMP_COLUMNS.items():
+        added = [column for column in columns
+                 if _add_column_if_missing(cursor, table, f'{column}_ms', 'INTEGER')]
+        for column in added:
+            # Rows still holding the 'LOCAL_TIMESTAMP' placeholder have no recoverable time
+            cursor.execute(f'''
+                UPDATE {table} SET {column}_ms = EPOCH_MS({column})
+                WHERE {column} IS NOT NULL AND {column} != 'LOCAL_TIMESTAMP'
+            ''')
+        # Recreated on every migration: earlier versions called the EPOCH_MS() Python function and
+        # overwrote a <column>_ms given in the INSERT (copies of a row must keep the original time,
+        # which the text column cannot carry while it holds the 'LOCAL_TIMESTAMP' placeholder)
+        assignments = ', '.join(f'{column}_ms = COALESCE(NEW.{column}_ms, {epoch_ms_sql(f"NEW.{column}")})'
+                                for column in columns)
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_{table}_epoch_ms_insert')
+        cursor.execute(f'''
+            CREATE TRIGGER trg_{table}_epoch_ms_insert AFTER INSERT ON {table}
+            BEGIN
+                UPDATE {table} SET {assignments} WHERE id = NEW.id;
+            END
+        ''')
+        for column in columns:
+            cursor.execute(f'DROP TRIGGER IF EXISTS trg_{table}_{column}_ms_update')
+            cursor.execute(f'''
+                CREATE TRIGGER trg_{table}_{column}_ms_update AFTER UPDATE OF {column} ON {table}
+                BEGIN
+                    UPDATE {table} SET {column}_ms = {epoch_ms_sql(f"NEW.{column}")} WHERE id = NEW.id;
+                END
+            ''')
+
+    # Sessions created before the _ms columns only hold the 'LOCAL_TIMESTAMP' placeholder. Date
+    # them from the times that were written explicitly (records made when a session ended, QR
+    # token expiry), then from the paired session, then from the nearest session by id, so date
+    # ranges (deleting a week, re-scoring) still find them
+    cursor.execute('''
+        UPDATE attendance_sessions SET created_at_ms = COALESCE(
+            (SELECT MIN(checked_in_at_ms) FROM attendance_records WHERE session_id = attendance_sessions.id),
+            (SELECT MIN(expires_at_ms) FROM qr_codes WHERE session_id = attendance_sessions.id)
+        )
+        WHERE created_at_ms IS NULL
+    ''')
+    cursor.execute('''
+        UPDATE attendance_sessions SET created_at_ms = (
+            SELECT MIN(p.created_at_ms) FROM attendance_sessions p
+            WHERE p.id = attendance_sessions.paired_session_id OR p.paired_session_id = attendance_sessions.id
+        )
+        WHERE created_at_ms IS NULL
+    ''')
+    cursor.execute('''
+        UPDATE attendance_sessions SET created_at_ms = COALESCE(
+            (SELECT created_at_ms FROM attendance_sessions p
+             WHERE p.id < attendance_sessions.id AND p.created_at_ms IS NOT NULL ORDER BY p.id DESC LIMIT 1),
+            (SELECT created_at_ms FROM attendance_sessions p
+             WHERE p.id > attendance_sessions.id AND p.created_at_ms IS NOT NULL ORDER BY p.id LIMIT 1)
+        )
+        WHERE created_at_ms IS NULL
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_sessions_created_ms ON attendance_sessions(created_at_ms)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_records_session_checked_ms ON attendance_records(session_id, checked_in_at_ms)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_leave_requests_user_created_ms ON leave_requests(user_id, created_at_ms)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_leave_requests_created_ms ON leave_requests(created_at_ms)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_points_records_user_created_ms ON points_records(user_id, created_at_ms)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_qr_codes_expires_ms ON qr_codes(expires_at_ms)')
+    # Deleting (and re-scoring) sessions finds their rows through these instead of scanning the tables
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_points_records_session ON points_records(session_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_qr_codes_session ON qr_codes(session_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_leave_requests_session ON leave_requests(session_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_leave_requests_paired_session ON leave_requests(paired_session_id)')
+
+    # Content-addressed attachments (see attachments.py); sha256 is NULL for files stored before
+    _add_column_if_missing(cursor, 'leave_attachments', 'sha256', 'TEXT')
+    _add_column_if_missing(cursor, 'leave_attachments', 'size', 'INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_leave_attachments_sha256 ON leave_attachments(sha256)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_leave_attachments_leave ON leave_attachments(leave_request_id)')
+
+    # Preview/thumbnail queue, one job per attachment blob (see media.py and media_worker.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS media_jobs (
+            sha256 TEXT PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            preview_format TEXT,
+            error TEXT,
+            queued_at_ms INTEGER NOT NULL,
+            started_at_ms INTEGER,
+            finished_at_ms INTEGER
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_media_jobs_status_queued ON media_jobs(status, queued_at_ms)')
+
+    # Resumable uploads not yet attached to a leave request (see app_uploads.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            received INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'open',
+            created_at_ms INTEGER NOT NULL,
+            updated_at_ms INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_upload_sessions_user ON upload_sessions(user_id, sha256)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated ON upload_sessions(updated_at_ms)')
+
+    # Long-running admin operations, run in short resumable steps (see jobs.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            params TEXT NOT NULL,
+            state TEXT,
+            progress INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            result TEXT,
+            error TEXT,
+            created_by INTEGER,
+            created_at_ms INTEGER NOT NULL,
+            started_at_ms INTEGER,
+            heartbeat_at_ms INTEGER,
+            finished_at_ms INTEGER,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)')
+
     # Initialize default admin user if not exists
     cursor.execute('SELECT COUNT(*) FROM users WHERE is_admin = 1')
     if cursor.fetchone()[0] == 0:
@@ -178,12 +466,21 @@ def init_db():
             VALUES (?, ?)
         ''', (key, value))
 
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
     conn.commit()
     conn.close()
 
+def _add_column_if_missing(cursor, table, column, definition):
+    """Add a column to an existing table; returns True if it was added"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if any(row['name'] == column for row in cursor.fetchall()):
+        return False
+    cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return True
+
 def get_setting(key, default=None):
     """Get system setting value"""
-    conn = get_db()
+    conn = get_db(readonly=True)
     cursor = conn.cursor()
     cursor.execute('SELECT value FROM system_settings WHERE key = ?', (key,))
     row = cursor.fetchone()
@@ -200,3 +497,23 @@ def set_setting(key, value):
     ''', (key, value, now()))
     conn.commit()
     conn.close()
+
+def roster_cte(session_id):
+    """Return (sql, params) for a `roster(user_id)` CTE of the session's members.
+
+    Sessions bound to groups only consider the members of those groups;
+    sessions without groups fall back to every non-admin user.
+    """
+    sql = '''
+        WITH roster(user_id) AS (
+            SELECT gm.user_id
+            FROM session_groups sg
+            JOIN group_members gm ON gm.group_id = sg.group_id
+            WHERE sg.session_id = ?
+            UNION
+            SELECT u.id FROM users u
+            WHERE u.is_admin = 0
+            AND NOT EXISTS (SELECT 1 FROM session_groups WHERE session_id = ?)
+        )
+    '''
+    return sql, (session_id, session_id)
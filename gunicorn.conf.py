@@ -0,0 +1,44 @@
+"""
+Gunicorn configuration
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master (preload_app), so the schema check
+in init_db(), template compilation and module imports happen a single
+time and workers share those pages copy-on-write. Set GUNICORN_PRELOAD=0
+to fall back to importing the app in every worker.
+
+GUNICORN_THREADS > 1 switches to the gthread worker: each process serves
+that many requests concurrently, so a slow export or QR render no longer
+blocks everything queued behind it. GUNICORN_WORKER_CLASS=gevent is also
+supported (requires `pip install gevent`); SQLite calls still block the
+event loop while they run, so gthread is the recommended mode.
+"""
+import gc
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+threads = int(os.getenv('GUNICORN_THREADS', '1'))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread' if threads > 1 else 'sync')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '100'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+if worker_class == 'gevent':
+    # With preload the app is imported in the master, so patch before that happens
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def when_ready(server):
+    """Runs in the master after the app is loaded, before any worker is forked"""
+    if not preload_app:
+        return
+    flask_app = server.app.wsgi()
+    # Compile every template now instead of once per worker on first request
+    for name in flask_app.jinja_env.list_templates():
+        flask_app.jinja_env.get_template(name)
+    # Move everything allocated so far out of the collector's reach; otherwise the
+    # first collection in each worker touches (and so copies) every shared page
+    gc.freeze()
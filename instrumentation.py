@@ -0,0 +1,534 @@
+"""
+Per-request instrumentation: SQL statement counts and timings, connection
+opens, template/QR rendering time and request latency, exported as
+Prometheus text. Each worker process aggregates in memory and periodically
+writes a snapshot file; the metrics endpoint merges the snapshots of all
+gunicorn workers. Snapshots of workers that have exited are folded into
+one retired.json, so counters keep their totals without the directory
+growing with every worker restart.
+
+Slow statements and requests that repeat the same statement shape many
+times (N+1 loops) are written to a rotating SQL log.
+"""
+import os
+import re
+import json
+import time
+import fcntl
+import sqlite3
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from logging.handlers import RotatingFileHandler
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(os.path.dirname(__file__), 'data', 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+# Slow-query / statement fan-out log
+SQL_LOG_ENABLED = os.getenv('SQL_LOG_ENABLED', '1') == '1'
+SQL_LOG_PATH = os.getenv('SQL_LOG_PATH', os.path.join(os.path.dirname(__file__), 'data', 'logs', 'sql.log'))
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '100'))
+SQL_FANOUT_THRESHOLD = int(os.getenv('SQL_FANOUT_THRESHOLD', '20'))
+
+# Request latency histogram buckets (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_local = threading.local()
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_logger_lock = threading.Lock()
+_totals = {}
+_last_flush = 0.0
+_sql_logger = None
+
+
+class RequestStats:
+    """Counters collected while handling a single request"""
+    __slots__ = ('endpoint', 'started', 'queries', 'query_time', 'connections', 'phases', 'shapes')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.connections = 0
+        self.phases = {}
+        # normalized statement -> [executions, seconds]
+        self.shapes = {}
+
+    def add_phase(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+def current():
+    """Return the stats of the request being handled on this thread, if any"""
+    return getattr(_local, 'stats', None)
+
+
+def _add_query_time(seconds):
+    stats = current()
+    if stats is not None:
+        stats.query_time += seconds
+
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Reduce a statement to its shape: literals and IN-lists become placeholders"""
+    shape = _STRING_LITERAL.sub('?', sql)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    shape = _WHITESPACE.sub(' ', shape).strip()
+    return _PLACEHOLDER_LIST.sub('(?+)', shape)
+
+
+def _get_sql_logger():
+    global _sql_logger
+    if _sql_logger is None:
+        with _logger_lock:
+            if _sql_logger is None:
+                logger = logging.getLogger('pytakeoff.sql')
+                logger.propagate = False
+                if not logger.handlers:
+                    os.makedirs(os.path.dirname(SQL_LOG_PATH), exist_ok=True)
+                    handler = RotatingFileHandler(SQL_LOG_PATH, maxBytes=5 * 1024 * 1024,
+                                                  backupCount=5, encoding='utf-8')
+                    handler.setFormatter(logging.Formatter('%(message)s'))
+                    logger.addHandler(handler)
+                    logger.setLevel(logging.INFO)
+                _sql_logger = logger
+    return _sql_logger
+
+
+def _log_sql_event(event, **fields):
+    """Append one JSON line to the rotating SQL log"""
+    if not SQL_LOG_ENABLED:
+        return
+    fields = {'event': event, 'ts': round(time.time(), 3), 'pid': os.getpid(), **fields}
+    _get_sql_logger().info(json.dumps(fields, ensure_ascii=False))
+
+
+def _observe_statement(sql, param_count, seconds):
+    """Record a statement's shape for the current request and log it if slow"""
+    _add_query_time(seconds)
+    stats = current()
+    shape = normalize_sql(sql)
+
+    if stats is not None:
+        entry = stats.shapes.get(shape)
+        if entry is None:
+            stats.shapes[shape] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+    for tracker in getattr(_local, 'budgets', ()):
+        tracker.shapes[shape] = tracker.shapes.get(shape, 0) + 1
+
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        _log_sql_event('slow_query',
+                       route=stats.endpoint if stats is not None else None,
+                       duration_ms=round(seconds * 1000, 3),
+                       shape=shape,
+                       sql=sql.strip(),
+                       param_count=param_count)
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that charges execute and fetch time to the current request"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observe_statement(sql, len(parameters), time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            param_count = sum(len(params) for params in seq_of_parameters)
+            _observe_statement(sql, param_count, time.perf_counter() - start)
+
+    def executescript(self, sql_script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _observe_statement(sql_script, 0, time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _add_query_time(time.perf_counter() - start)
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            _add_query_time(time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _add_query_time(time.perf_counter() - start)
+
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose cursors (including the execute shortcuts) are traced"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def _on_statement(statement):
+    """sqlite3 trace callback: count every statement SQLite runs"""
+    stats = current()
+    if stats is not None:
+        stats.queries += 1
+    for tracker in getattr(_local, 'budgets', ()):
+        tracker.statements += 1
+
+
+def _budget_active():
+    return bool(getattr(_local, 'budgets', None))
+
+
+def trace_connection(conn):
+    """Attach the statement trace callback and count the connection open
+
+    With METRICS_ENABLED=0 the callback is still attached inside a
+    statement_budget block, so budgets are checked either way.
+    """
+    if not METRICS_ENABLED and not _budget_active():
+        return
+    conn.set_trace_callback(_on_statement)
+    stats = current()
+    if stats is not None:
+        stats.connections += 1
+
+
+@contextmanager
+def timed(phase):
+    """Charge the enclosed block to a named phase of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current()
+        if stats is not None:
+            stats.add_phase(phase, time.perf_counter() - start)
+
+
+def budget(max_statements):
+    """Declare the statement budget of a route (enforced by `statement_budget`)
+
+    Place directly under ``@app.route`` so the registered view carries it.
+    """
+    def decorator(f):
+        f.statement_budget = max_statements
+        return f
+    return decorator
+
+
+class _Budget:
+    __slots__ = ('limit', 'statements', 'shapes', 'violations')
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.statements = 0
+        self.shapes = {}
+        self.violations = []
+
+
+@contextmanager
+def statement_budget(max_statements=None):
+    """Fail when the enclosed block exceeds a statement budget
+
+    Counts every statement SQLite runs on this thread inside the block and
+    raises AssertionError if the total exceeds ``max_statements``, or if any
+    request handled inside the block exceeds its route's declared budget.
+    """
+    tracker = _Budget(max_statements)
+    budgets = getattr(_local, 'budgets', None)
+    if budgets is None:
+        budgets = _local.budgets = []
+    budgets.append(tracker)
+    try:
+        yield tracker
+    finally:
+        budgets.remove(tracker)
+
+    problems = list(tracker.violations)
+    if max_statements is not None and tracker.statements > max_statements:
+        problems.append(f'{tracker.statements} statements > budget {max_statements}')
+    if problems:
+        top = sorted(tracker.shapes.items(), key=lambda item: item[1], reverse=True)[:5]
+        details = '\n'.join(f'  {count}x {shape}' for shape, count in top)
+        raise AssertionError('Statement budget exceeded: ' + '; '.join(problems) +
+                             ('\nMost repeated statements:\n' + details if details else ''))
+
+
+def _check_request(stats, declared_budget):
+    """Log statement fan-out and declared budget overruns of a finished request"""
+    for shape, (count, seconds) in stats.shapes.items():
+        if count > SQL_FANOUT_THRESHOLD:
+            _log_sql_event('statement_fanout',
+                           route=stats.endpoint,
+                           count=count,
+                           duration_ms=round(seconds * 1000, 3),
+                           shape=shape)
+
+    if declared_budget is not None and stats.queries > declared_budget:
+        _log_sql_event('budget_exceeded',
+                       route=stats.endpoint,
+                       statements=stats.queries,
+                       budget=declared_budget)
+        for tracker in getattr(_local, 'budgets', ()):
+            tracker.violations.append(
+                f'{stats.endpoint} ran {stats.queries} statements > declared budget {declared_budget}')
+
+
+def _empty_totals():
+    return {
+        'requests': 0,
+        'latency_sum': 0.0,
+        'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+        'queries': 0,
+        'query_time': 0.0,
+        'connections': 0,
+        'phases': {}
+    }
+
+
+def _record(stats, elapsed):
+    """Merge a finished request into this worker's totals"""
+    with _lock:
+        totals = _totals.setdefault(stats.endpoint, _empty_totals())
+        totals['requests'] += 1
+        totals['latency_sum'] += elapsed
+        bucket = len(LATENCY_BUCKETS)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                bucket = i
+                break
+        totals['buckets'][bucket] += 1
+        totals['queries'] += stats.queries
+        totals['query_time'] += stats.query_time
+        totals['connections'] += stats.connections
+        for phase, seconds in stats.phases.items():
+            totals['phases'][phase] = totals['phases'].get(phase, 0.0) + seconds
+
+
+def flush(force=False):
+    """Write this worker's totals to its snapshot file (rate limited)"""
+    global _last_flush
+    if not METRICS_ENABLED:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < METRICS_FLUSH_INTERVAL:
+        return
+    # Threads of one worker share the snapshot file; a thread that finds
+    # another one mid-flush leaves it to that thread
+    if not _flush_lock.acquire(blocking=force):
+        return
+    try:
+        _last_flush = now
+        with _lock:
+            snapshot = json.dumps(_totals)
+
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f'worker-{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(snapshot)
+        os.replace(tmp_path, path)
+    finally:
+        _flush_lock.release()
+
+
+def _merge(merged, snapshot):
+    for endpoint, totals in snapshot.items():
+        target = merged.setdefault(endpoint, _empty_totals())
+        for key in ('requests', 'latency_sum', 'queries', 'query_time', 'connections'):
+            target[key] += totals[key]
+        target['buckets'] = [a + b for a, b in zip(target['buckets'], totals['buckets'])]
+        for phase, seconds in totals['phases'].items():
+            target['phases'][phase] = target['phases'].get(phase, 0.0) + seconds
+    return merged
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _worker_snapshots():
+    """(pid, path) of every worker snapshot file"""
+    snapshots = []
+    for name in os.listdir(METRICS_DIR):
+        match = re.fullmatch(r'worker-(\d+)\.json', name)
+        if match:
+            snapshots.append((int(match.group(1)), os.path.join(METRICS_DIR, name)))
+    return snapshots
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _fold_dead_workers():
+    """Add the snapshots of exited workers to retired.json and remove them
+
+    The lock keeps two workers serving the metrics endpoint from folding
+    the same snapshot twice.
+    """
+    with open(os.path.join(METRICS_DIR, 'retired.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = [path for pid, path in _worker_snapshots() if not _pid_alive(pid)]
+        if not dead:
+            return
+
+        retired_path = os.path.join(METRICS_DIR, 'retired.json')
+        retired = _read_snapshot(retired_path) or {}
+        for path in dead:
+            _merge(retired, _read_snapshot(path) or {})
+        tmp_path = f'{retired_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(retired, f)
+        os.replace(tmp_path, retired_path)
+        for path in dead:
+            os.unlink(path)
+
+
+def _load_all():
+    """Merge the snapshot files of every worker, past ones included"""
+    merged = {}
+    if not os.path.isdir(METRICS_DIR):
+        return merged
+
+    _fold_dead_workers()
+    paths = [os.path.join(METRICS_DIR, 'retired.json')] + [path for _pid, path in _worker_snapshots()]
+    for path in paths:
+        snapshot = _read_snapshot(path)
+        if snapshot:
+            _merge(merged, snapshot)
+    return merged
+
+
+def render_prometheus():
+    """Render the merged metrics of all workers in Prometheus text format"""
+    flush(force=True)
+    merged = _load_all()
+    endpoints = sorted(merged)
+
+    def label(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+    lines = [
+        '# HELP pytakeoff_http_request_duration_seconds Request latency by endpoint',
+        '# TYPE pytakeoff_http_request_duration_seconds histogram'
+    ]
+    for endpoint in endpoints:
+        totals = merged[endpoint]
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), totals['buckets']):
+            cumulative += count
+            lines.append(f'pytakeoff_http_request_duration_seconds_bucket{{endpoint="{label(endpoint)}",le="{bound}"}} {cumulative}')
+        lines.append(f'pytakeoff_http_request_duration_seconds_sum{{endpoint="{label(endpoint)}"}} {totals["latency_sum"]:.6f}')
+        lines.append(f'pytakeoff_http_request_duration_seconds_count{{endpoint="{label(endpoint)}"}} {totals["requests"]}')
+
+    counters = [
+        ('pytakeoff_db_queries_total', 'SQL statements executed', 'queries', '{}'),
+        ('pytakeoff_db_query_seconds_total', 'Time spent executing and fetching SQL', 'query_time', '{:.6f}'),
+        ('pytakeoff_db_connections_total', 'SQLite connections opened', 'connections', '{}')
+    ]
+    for name, help_text, key, fmt in counters:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for endpoint in endpoints:
+            lines.append(f'{name}{{endpoint="{label(endpoint)}"}} {fmt.format(merged[endpoint][key])}')
+
+    lines.append('# HELP pytakeoff_phase_seconds_total Time spent in rendering phases (template, qr_render)')
+    lines.append('# TYPE pytakeoff_phase_seconds_total counter')
+    for endpoint in endpoints:
+        for phase, seconds in sorted(merged[endpoint]['phases'].items()):
+            lines.append(f'pytakeoff_phase_seconds_total{{endpoint="{label(endpoint)}",phase="{label(phase)}"}} {seconds:.6f}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """Install the request middleware and template timing hooks
+
+    With METRICS_ENABLED=0 requests are only counted inside a
+    statement_budget block, to check the routes' declared budgets.
+    """
+    from flask import request, before_render_template, template_rendered
+
+    @app.before_request
+    def _start_request_stats():
+        if METRICS_ENABLED or _budget_active():
+            _local.stats = RequestStats(request.endpoint or 'unmatched')
+
+    @app.teardown_request
+    def _finish_request_stats(exc=None):
+        stats = current()
+        if stats is None:
+            return
+        _local.stats = None
+        view = app.view_functions.get(stats.endpoint)
+        _check_request(stats, getattr(view, 'statement_budget', None))
+        if METRICS_ENABLED:
+            _record(stats, time.perf_counter() - stats.started)
+            flush()
+
+    if not METRICS_ENABLED:
+        return
+
+    def _template_started(sender, template, context, **extra):
+        _local.template_started = time.perf_counter()
+
+    def _template_finished(sender, template, context, **extra):
+        started = getattr(_local, 'template_started', None)
+        stats = current()
+        if started is not None and stats is not None:
+            stats.add_phase('template', time.perf_counter() - started)
+
+    before_render_template.connect(_template_started, app, weak=False)
+    template_rendered.connect(_template_finished, app, weak=False)
+
+    atexit.register(flush, True)
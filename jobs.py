@@ -0,0 +1,143 @@
+"""
+Background jobs for long-running admin operations
+
+A job row records what to do (kind + JSON params), how far it got
+(progress out of total, plus a JSON cursor in `state`) and the outcome.
+Handlers are registered with @handler(kind) and work in short
+transactions: each one ends with checkpoint(), which stores the new
+cursor in the same commit as the work it describes. An interrupted job
+therefore resumes exactly where it stopped; `flask run-jobs` picks up
+pending jobs and running jobs whose heartbeat is older than
+JOB_LEASE_SECONDS (e.g. after a worker restart).
+
+The web process starts jobs on a daemon thread (start_in_background)
+and pages poll /api/jobs/<id> for progress (see app_jobs.py).
+"""
+import os
+import json
+import threading
+import traceback
+
+from timezone_utils import epoch_ms
+
+# A 'running' job without a checkpoint for this long is assumed to belong to a dead process
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '120'))
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register fn(conn, job) as the handler of a job kind; it returns the job's result"""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def _decode(row):
+    if row is None:
+        return None
+    job = dict(row)
+    for key in ('params', 'state', 'result'):
+        job[key] = json.loads(job[key]) if job[key] else None
+    return job
+
+
+def create(conn, kind, params, total=None, created_by=None):
+    """Insert a pending job and return its id (the caller commits)"""
+    cursor = conn.execute('''
+        INSERT INTO jobs (kind, status, params, total, created_by, created_at_ms)
+        VALUES (?, 'pending', ?, ?, ?, ?)
+    ''', (kind, json.dumps(params), total, created_by, epoch_ms()))
+    return cursor.lastrowid
+
+
+def get(conn, job_id):
+    return _decode(conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+
+def claim(conn, job_id):
+    """Mark a job running if it is pending or its lease expired; returns the job or None"""
+    now_ms = epoch_ms()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        cursor = conn.execute('''
+            UPDATE jobs SET status = 'running', started_at_ms = COALESCE(started_at_ms, ?), heartbeat_at_ms = ?
+            WHERE id = ? AND (status = 'pending' OR (status = 'running' AND heartbeat_at_ms < ?))
+        ''', (now_ms, now_ms, job_id, now_ms - JOB_LEASE_SECONDS * 1000))
+        job = get(conn, job_id) if cursor.rowcount else None
+    finally:
+        conn.commit()
+    return job
+
+
+def checkpoint(conn, job_id, progress, state, result=None):
+    """Record progress and the resume cursor, committing the handler's open transaction with it"""
+    conn.execute('''
+        UPDATE jobs SET progress = ?, state = ?, result = ?, heartbeat_at_ms = ? WHERE id = ?
+    ''', (progress, json.dumps(state), json.dumps(result) if result is not None else None,
+          epoch_ms(), job_id))
+    conn.commit()
+
+
+def run(conn, job_id):
+    """Claim and run a job to completion; returns the finished job, or None if it was not claimable"""
+    job = claim(conn, job_id)
+    if job is None:
+        return None
+    try:
+        result = HANDLERS[job['kind']](conn, job)
+    except Exception as e:
+        conn.rollback()
+        traceback.print_exc()
+        conn.execute('''
+            UPDATE jobs SET status = 'failed', error = ?, finished_at_ms = ? WHERE id = ?
+        ''', (str(e), epoch_ms(), job_id))
+    else:
+        conn.execute('''
+            UPDATE jobs SET status = 'done', progress = MAX(progress, COALESCE(total, 0)), result = ?,
+                            finished_at_ms = ?
+            WHERE id = ?
+        ''', (json.dumps(result), epoch_ms(), job_id))
+    conn.commit()
+    return get(conn, job_id)
+
+
+def start_in_background(job_id):
+    """Run a job on a daemon thread with its own connection; returns the thread"""
+    from database import get_db
+
+    def target():
+        conn = get_db()
+        try:
+            run(conn, job_id)
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=target, name=f'job-{job_id}', daemon=True)
+    thread.start()
+    return thread
+
+
+def resumable(conn):
+    """Ids of pending jobs and running jobs whose lease expired, oldest first"""
+    return [row[0] for row in conn.execute('''
+        SELECT id FROM jobs
+        WHERE status = 'pending' OR (status = 'running' AND heartbeat_at_ms < ?)
+        ORDER BY id
+    ''', (epoch_ms() - JOB_LEASE_SECONDS * 1000,))]
+
+
+def init_app(app):
+    @app.cli.command('run-jobs')
+    def run_jobs_command():
+        """Run pending jobs and resume the ones an exited process left unfinished"""
+        from database import get_db
+        conn = get_db()
+        try:
+            for job_id in resumable(conn):
+                job = run(conn, job_id)
+                if job is not None:
+                    print(f"任务 {job_id}（{job['kind']}）：{job['status']}")
+        finally:
+            conn.close()
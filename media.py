@@ -0,0 +1,136 @@
+"""
+Attachment previews and thumbnails
+
+Uploading a leave attachment queues a job in media_jobs (keyed by the
+blob's SHA-256, so a deduplicated file is processed once). The
+media_worker.py process claims jobs, downscales images with Pillow and
+writes the results next to the blob store:
+
+    uploads/previews/ab/<sha256>.preview.webp   (fits MEDIA_PREVIEW_SIZE)
+    uploads/previews/ab/<sha256>.thumb.webp     (fits MEDIA_THUMB_SIZE)
+
+Files Pillow cannot open (PDFs, documents) are marked 'skipped'. Pillow
+is only imported by the worker; the web process just enqueues jobs and
+looks up finished previews.
+"""
+import os
+
+from timezone_utils import epoch_ms
+from attachments import blob_path, preview_path
+
+MEDIA_FORMAT = os.getenv('MEDIA_FORMAT', 'webp').lower()
+MEDIA_QUALITY = int(os.getenv('MEDIA_QUALITY', '75'))
+MEDIA_MAX_ATTEMPTS = int(os.getenv('MEDIA_MAX_ATTEMPTS', '3'))
+# A 'running' job older than this is assumed to belong to a crashed worker
+MEDIA_LEASE_SECONDS = int(os.getenv('MEDIA_LEASE_SECONDS', '300'))
+
+SIZES = {
+    'preview': int(os.getenv('MEDIA_PREVIEW_SIZE', '1600')),
+    'thumb': int(os.getenv('MEDIA_THUMB_SIZE', '320'))
+}
+MIMETYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+def enqueue(cursor, digest):
+    """Queue preview generation for a blob (no-op if it is already queued or done)"""
+    cursor.execute('''
+        INSERT OR IGNORE INTO media_jobs (sha256, status, queued_at_ms)
+        VALUES (?, 'pending', ?)
+    ''', (digest, epoch_ms()))
+
+
+def enqueue_missing(conn):
+    """Queue every stored blob that has no job yet; returns how many were added"""
+    cursor = conn.execute('''
+        INSERT OR IGNORE INTO media_jobs (sha256, status, queued_at_ms)
+        SELECT DISTINCT sha256, 'pending', ? FROM leave_attachments WHERE sha256 IS NOT NULL
+    ''', (epoch_ms(),))
+    conn.commit()
+    return cursor.rowcount
+
+
+def ready_formats(conn, digests):
+    """{sha256: preview format} for the blobs whose previews are finished"""
+    digests = [digest for digest in set(digests) if digest]
+    if not digests:
+        return {}
+    placeholders = ','.join('?' * len(digests))
+    rows = conn.execute(f'''
+        SELECT sha256, preview_format FROM media_jobs
+        WHERE status = 'done' AND sha256 IN ({placeholders})
+    ''', digests).fetchall()
+    return {row['sha256']: row['preview_format'] for row in rows}
+
+
+def claim(conn):
+    """Take the oldest pending job (or one whose lease expired); returns its sha256 or None"""
+    now_ms = epoch_ms()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('''
+            SELECT sha256 FROM media_jobs
+            WHERE status = 'pending' OR (status = 'running' AND started_at_ms < ?)
+            ORDER BY queued_at_ms LIMIT 1
+        ''', (now_ms - MEDIA_LEASE_SECONDS * 1000,)).fetchone()
+        if row is None:
+            return None
+        conn.execute('''
+            UPDATE media_jobs SET status = 'running', attempts = attempts + 1, started_at_ms = ?
+            WHERE sha256 = ?
+        ''', (now_ms, row['sha256']))
+        return row['sha256']
+    finally:
+        conn.commit()
+
+
+def finish(conn, digest, status, preview_format=None, error=None):
+    """Record a job's outcome; failures go back to pending until MEDIA_MAX_ATTEMPTS
+
+    Returns False if the job no longer exists (its blob was deleted meanwhile).
+    """
+    if status == 'failed':
+        row = conn.execute('SELECT attempts FROM media_jobs WHERE sha256 = ?', (digest,)).fetchone()
+        if row is not None and row['attempts'] < MEDIA_MAX_ATTEMPTS:
+            status = 'pending'
+    cursor = conn.execute('''
+        UPDATE media_jobs SET status = ?, preview_format = ?, error = ?, finished_at_ms = ?
+        WHERE sha256 = ?
+    ''', (status, preview_format, error, epoch_ms(), digest))
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+def remove_previews(digest, preview_format, upload_folder):
+    for kind in SIZES:
+        path = preview_path(digest, kind, preview_format, upload_folder)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def render(digest, upload_folder):
+    """Write the preview and thumbnail of a blob; returns the format, or None if it is not an image"""
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    source = blob_path(digest, upload_folder)
+    try:
+        image = Image.open(source)
+    except UnidentifiedImageError:
+        return None
+
+    with image:
+        largest = max(SIZES.values())
+        # Let the JPEG decoder skip detail we are about to throw away
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if MEDIA_FORMAT == 'jpeg' or image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB' if MEDIA_FORMAT == 'jpeg' or 'A' not in image.mode else 'RGBA')
+
+        for kind, size in sorted(SIZES.items(), key=lambda item: -item[1]):
+            # Each size is derived from the previous, larger one
+            image.thumbnail((size, size), Image.LANCZOS)
+            target = preview_path(digest, kind, MEDIA_FORMAT, upload_folder)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f'{target}.tmp'
+            image.save(tmp_path, format=MEDIA_FORMAT.upper(), quality=MEDIA_QUALITY, optimize=True)
+            os.replace(tmp_path, target)
+    return MEDIA_FORMAT
@@ -0,0 +1,83 @@
+"""
+Preview/thumbnail worker for leave attachments
+
+Runs next to the web server (same DATABASE_PATH and UPLOAD_FOLDER) and
+processes the media_jobs queue, so uploads never wait for image
+processing:
+
+    python media_worker.py              # run until stopped
+    python media_worker.py --once       # drain the queue and exit
+    python media_worker.py --backfill   # also queue attachments uploaded earlier
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import traceback
+
+import media
+from database import get_db
+
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(os.path.dirname(__file__), 'uploads'))
+
+_stopping = False
+
+
+def _stop(signum, frame):
+    global _stopping
+    _stopping = True
+
+
+def process_one(conn, upload_folder=UPLOAD_FOLDER):
+    """Claim and process one job; returns its sha256, or None when the queue is empty"""
+    digest = media.claim(conn)
+    if digest is None:
+        return None
+    try:
+        preview_format = media.render(digest, upload_folder)
+    except Exception as e:
+        traceback.print_exc()
+        media.finish(conn, digest, 'failed', error=f'{type(e).__name__}: {e}')
+        return digest
+
+    status = 'done' if preview_format else 'skipped'
+    if not media.finish(conn, digest, status, preview_format=preview_format) and preview_format:
+        # The attachment was deleted while we were rendering it
+        media.remove_previews(digest, preview_format, upload_folder)
+    return digest
+
+
+def run(once=False, backfill=False, poll_interval=2.0, upload_folder=UPLOAD_FOLDER):
+    conn = get_db()
+    try:
+        if backfill:
+            print(f'已加入队列: {media.enqueue_missing(conn)}')
+        processed = 0
+        while not _stopping:
+            if process_one(conn, upload_folder) is not None:
+                processed += 1
+                continue
+            if once:
+                break
+            time.sleep(poll_interval)
+        return processed
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate previews and thumbnails for leave attachments')
+    parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+    parser.add_argument('--backfill', action='store_true', help='queue attachments that have no job yet')
+    parser.add_argument('--poll-interval', type=float, default=float(os.getenv('MEDIA_POLL_INTERVAL', '2')))
+    args = parser.parse_args(argv)
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    processed = run(args.once, args.backfill, args.poll_interval)
+    print(f'已处理: {processed}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
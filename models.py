@@ -15,7 +15,7 @@ class User(UserMixin):
     @staticmethod
     def get(user_id):
         """Get user by ID"""
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
         row = cursor.fetchone()
@@ -35,7 +35,7 @@ class User(UserMixin):
     @staticmethod
     def get_by_student_id(student_id):
         """Get user by student ID"""
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM users WHERE student_id = ?', (student_id,))
         row = cursor.fetchone()
@@ -123,6 +123,7 @@ class User(UserMixin):
         """Delete user by ID"""
         conn = get_db()
         cursor = conn.cursor()
+        cursor.execute('DELETE FROM group_members WHERE user_id = ?', (user_id,))
         cursor.execute('DELETE FROM users WHERE id = ? AND is_admin = 0', (user_id,))
         conn.commit()
         conn.close()
@@ -130,7 +131,7 @@ class User(UserMixin):
     @staticmethod
     def get_all_users():
         """Get all non-admin users"""
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM users WHERE is_admin = 0 ORDER BY student_id')
         rows = cursor.fetchall()
@@ -139,7 +140,7 @@ class User(UserMixin):
 
     def get_points(self):
         """Get user's total points"""
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
         cursor.execute('''
             SELECT COALESCE(SUM(points), 0) as total_points
@@ -152,14 +153,14 @@ class User(UserMixin):
 
     def get_points_history(self):
         """Get user's points history"""
-        conn = get_db()
+        conn = get_db(readonly=True)
         cursor = conn.cursor()
         cursor.execute('''
             SELECT pr.*, u.name as created_by_name
             FROM points_records pr
             LEFT JOIN users u ON pr.created_by = u.id
             WHERE pr.user_id = ? AND pr.is_deleted = 0
-            ORDER BY pr.created_at DESC
+            ORDER BY pr.created_at_ms DESC, pr.id DESC
         ''', (self.id,))
         rows = cursor.fetchall()
         conn.close()
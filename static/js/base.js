@@ -0,0 +1,112 @@
+// 全局加载叠加层控制
+const loadingOverlay = document.getElementById('loadingOverlay');
+
+// 显示加载叠加层
+function showLoading() {
+    loadingOverlay.classList.add('show');
+}
+
+// 隐藏加载叠加层
+function hideLoading() {
+    loadingOverlay.classList.remove('show');
+}
+
+// 自动拦截所有按钮点击
+document.addEventListener('click', function(e) {
+    // 检查是否点击了按钮或提交按钮
+    const target = e.target;
+
+    // 排除带 no-loading 类的元素
+    if (target.classList.contains('no-loading')) {
+        return;
+    }
+
+    // 排除下载和导出链接（通过 href、download 属性或文本内容判断）
+    if (target.tagName === 'A') {
+        const href = target.getAttribute('href') || '';
+        const text = target.textContent.trim();
+        const hasDownload = target.hasAttribute('download');
+
+        // 排除下载、导出、返回、查看等操作
+        if (hasDownload ||
+            href.includes('download') ||
+            href.includes('export') ||
+            text.includes('下载') ||
+            text.includes('导出') ||
+            text.includes('返回') ||
+            text.includes('查看')) {
+            return;
+        }
+    }
+
+    // 排除有 onclick 属性的按钮（通常是模态框、下拉等）
+    if (target.tagName === 'BUTTON' && target.onclick) {
+        return;
+    }
+
+    // 排除 type="button" 的按钮
+    if (target.type === 'button') {
+        return;
+    }
+
+    // 检查是否是需要拦截的元素
+    if (target.tagName === 'BUTTON' ||
+        (target.tagName === 'INPUT' && target.type === 'submit') ||
+        (target.tagName === 'A' && target.classList.contains('btn'))) {
+
+        // 如果是表单内的按钮，不在这里显示加载层
+        // 让表单的 submit 事件来处理
+        const form = target.closest('form');
+        if (form) {
+            return;
+        }
+
+        // 非表单按钮才显示加载层
+        showLoading();
+    }
+}, true);
+
+// 自动拦截所有表单提交
+document.addEventListener('submit', function(e) {
+    const form = e.target;
+
+    // 排除 AJAX 表单或特殊标记的表单
+    if (form.classList.contains('no-loading') || form.dataset.ajax === 'true') {
+        return;
+    }
+
+    // 显示加载叠加层
+    showLoading();
+}, true);
+
+// 页面加载完成后隐藏加载层（防止页面刷新时一直显示）
+window.addEventListener('load', function() {
+    hideLoading();
+});
+
+// 页面离开前显示加载层
+window.addEventListener('beforeunload', function() {
+    // 只有在正常导航时显示，刷新页面时不显示
+    if (performance.navigation.type !== 1) {
+        showLoading();
+    }
+});
+
+// 页面显示时隐藏加载层（处理浏览器后退等情况）
+window.addEventListener('pageshow', function() {
+    hideLoading();
+});
+
+// AJAX 请求前后的钩子（如果使用 fetch）
+const originalFetch = window.fetch;
+window.fetch = function(...args) {
+    const fetchPromise = originalFetch.apply(this, args);
+
+    // 如果请求选项中没有标记不显示加载
+    if (!args[1]?.noLoading) {
+        showLoading();
+        fetchPromise.finally(() => hideLoading());
+    }
+
+    return fetchPromise;
+};
@@ -0,0 +1,129 @@
+// 请假附件分片上传：每个分片单独请求，断线后从服务器记录的位置继续；
+// 浏览器不支持 crypto.subtle（非 HTTPS）时保持普通表单提交
+(function() {
+    const form = document.getElementById('leaveForm');
+    const input = document.getElementById('attachments');
+    const progress = document.getElementById('uploadProgress');
+    if (!form || !input || !window.crypto || !window.crypto.subtle) {
+        return;
+    }
+    // 由本脚本控制加载层
+    form.dataset.ajax = 'true';
+
+    const MAX_RETRIES = 5;
+
+    function sleep(ms) {
+        return new Promise(resolve => setTimeout(resolve, ms));
+    }
+
+    async function sha256Hex(file) {
+        const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    // 返回 {status, data}；网络错误时 status 为 0
+    async function api(url, options = {}) {
+        try {
+            const response = await fetch(url, Object.assign({noLoading: true, credentials: 'same-origin'}, options));
+            let data = {};
+            try {
+                data = await response.json();
+            } catch (e) {
+                // 非 JSON 响应（如代理错误页）
+            }
+            return {status: response.status, data: data};
+        } catch (e) {
+            return {status: 0, data: {}};
+        }
+    }
+
+    async function uploadFile(file, index, total) {
+        const label = `(${index + 1}/${total}) ${file.name}`;
+        progress.textContent = `正在校验 ${label}...`;
+        const digest = await sha256Hex(file);
+
+        let result = await api('/api/uploads', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({filename: file.name, size: file.size, sha256: digest})
+        });
+        if (!result.data.success) {
+            throw new Error(result.data.message || '上传失败');
+        }
+        const uploadId = result.data.upload_id;
+        const chunkSize = result.data.chunk_size;
+        let offset = result.data.offset;
+        let state = result.data.status;
+        let failures = 0;
+
+        while (state === 'open') {
+            if (offset >= file.size) {
+                result = await api(`/api/uploads/${uploadId}/finalize`, {method: 'POST'});
+            } else {
+                progress.textContent = `正在上传 ${label}：${Math.floor(offset * 100 / file.size)}%`;
+                result = await api(`/api/uploads/${uploadId}?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: {'Content-Type': 'application/octet-stream'},
+                    body: file.slice(offset, offset + chunkSize)
+                });
+            }
+
+            if (result.data.success) {
+                offset = result.data.offset;
+                state = result.data.status;
+                failures = 0;
+                continue;
+            }
+            if (result.data.offset !== undefined && (result.status === 409 || result.status === 422)) {
+                // 服务器记录的位置为准（重传的分片、校验失败后重新开始）
+                offset = result.data.offset;
+                if (++failures > MAX_RETRIES) {
+                    throw new Error(result.data.message || '上传失败');
+                }
+                continue;
+            }
+            if ((result.status >= 400 && result.status < 500) || ++failures > MAX_RETRIES) {
+                throw new Error(result.data.message || '网络异常，上传失败');
+            }
+            // 网络中断或服务器错误：稍后询问服务器已收到多少再继续
+            progress.textContent = `网络异常，正在重试 ${label}...`;
+            await sleep(1000 * failures);
+            const status = await api(`/api/uploads/${uploadId}`);
+            if (status.data.success) {
+                offset = status.data.offset;
+                state = status.data.status;
+            }
+        }
+        return uploadId;
+    }
+
+    form.addEventListener('submit', async function(e) {
+        if (input.files.length === 0) {
+            showLoading();
+            return;
+        }
+        e.preventDefault();
+        const submitButton = form.querySelector('button[type="submit"]');
+        submitButton.disabled = true;
+        try {
+            const files = Array.from(input.files);
+            for (let i = 0; i < files.length; i++) {
+                const uploadId = await uploadFile(files[i], i, files.length);
+                const hidden = document.createElement('input');
+                hidden.type = 'hidden';
+                hidden.name = 'upload_ids';
+                hidden.value = uploadId;
+                form.appendChild(hidden);
+            }
+            progress.textContent = '附件上传完成，正在提交...';
+            // 文件已上传，不再随表单发送
+            input.disabled = true;
+            showLoading();
+            form.submit();
+        } catch (err) {
+            progress.textContent = `${err.message}，请重新提交（已上传的部分会保留）`;
+            form.querySelectorAll('input[name="upload_ids"]').forEach(el => el.remove());
+            submitButton.disabled = false;
+        }
+    });
+})();
@@ -0,0 +1,168 @@
+// 禁用全局加载层 - 二维码大屏不需要加载提示
+document.addEventListener('DOMContentLoaded', function() {
+    const loadingOverlay = document.getElementById('loadingOverlay');
+    if (loadingOverlay) {
+        loadingOverlay.style.display = 'none !important';
+        loadingOverlay.classList.remove('show');
+    }
+});
+
+// 覆盖全局的 showLoading 函数
+window.showLoading = function() {
+    // 在二维码大屏页面不显示加载层
+    return;
+};
+
+let sessionId = null;
+let refreshInterval = 15;
+let countdownTimer = null;
+let statusTimer = null;
+let qrRefreshTimer = null;
+let qrRefreshActive = false;
+let currentTab = 'checked-in';
+
+async function startQRDisplay() {
+    const activityCode = document.getElementById('activity_code').value.trim();
+    const errorDiv = document.getElementById('setup-error');
+
+    if (!activityCode) {
+        errorDiv.textContent = '请输入活动码';
+        errorDiv.style.display = 'block';
+        return;
+    }
+
+    try {
+        const response = await fetch('/api/qr/start', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({activity_code: activityCode}),
+            noLoading: true
+        });
+
+        const data = await response.json();
+
+        if (data.success) {
+            sessionId = data.session_id;
+            document.getElementById('setup-screen').style.display = 'none';
+            document.getElementById('qr-screen').classList.add('active');
+            startQRRefresh();
+            startStatusRefresh();
+        } else {
+            errorDiv.textContent = data.message;
+            errorDiv.style.display = 'block';
+        }
+    } catch (error) {
+        errorDiv.textContent = '网络错误，请重试';
+        errorDiv.style.display = 'block';
+    }
+}
+
+async function refreshQRCode() {
+    // 默认按刷新间隔重试；成功时对齐到服务端时间片的结束时刻
+    let delay = refreshInterval * 1000;
+    try {
+        const response = await fetch(`/api/qr/generate/${sessionId}`, {
+            noLoading: true
+        });
+        const data = await response.json();
+
+        if (data.success) {
+            document.getElementById('qr-code').innerHTML =
+                `<img src="data:image/png;base64,${data.qr_image}" alt="签到二维码">`;
+            refreshInterval = data.refresh_interval;
+            startCountdown(data.expires_in);
+            delay = data.expires_in * 1000 + 100;
+        }
+    } catch (error) {
+        console.error('二维码刷新错误:', error);
+    }
+
+    if (qrRefreshActive) {
+        qrRefreshTimer = setTimeout(refreshQRCode, delay);
+    }
+}
+
+function startCountdown(expiresIn) {
+    const deadline = Date.now() + expiresIn * 1000;
+    const render = () => {
+        const seconds = Math.max(0, Math.ceil((deadline - Date.now()) / 1000));
+        document.getElementById('countdown').textContent = seconds;
+        if (seconds <= 0) {
+            clearInterval(countdownTimer);
+        }
+    };
+
+    if (countdownTimer) clearInterval(countdownTimer);
+    render();
+    countdownTimer = setInterval(render, 250);
+}
+
+function startQRRefresh() {
+    qrRefreshActive = true;
+    refreshQRCode();
+}
+
+async function updateStatus() {
+    try {
+        const response = await fetch(`/api/qr/status/${sessionId}`, {
+            noLoading: true
+        });
+        const data = await response.json();
+
+        if (data.success) {
+            // Check if session is still active
+            if (!data.is_active) {
+                // Session ended, show message and hide QR code
+                document.getElementById('qr-code').innerHTML =
+                    '<div style="text-align: center; padding: 50px; color: #e74c3c; font-size: 24px; font-weight: bold;">活动已结束</div>';
+
+                // Stop all timers
+                if (countdownTimer) clearInterval(countdownTimer);
+                qrRefreshActive = false;
+                if (qrRefreshTimer) clearTimeout(qrRefreshTimer);
+                if (statusTimer) clearInterval(statusTimer);
+
+                // Update countdown to show ended status
+                document.getElementById('countdown').textContent = '--';
+            }
+
+            document.getElementById('checked-in-count').textContent = data.checked_in_count;
+            document.getElementById('not-checked-in-count').textContent = data.not_checked_in_count;
+
+            // Update lists
+            updateNameList('checked-in-list', data.checked_in);
+            updateNameList('not-checked-in-list', data.not_checked_in);
+        }
+    } catch (error) {
+        console.error('状态刷新错误:', error);
+    }
+}
+
+function updateNameList(elementId, users) {
+    const listElement = document.getElementById(elementId);
+    if (users.length === 0) {
+        listElement.innerHTML = '<div style="text-align: center; color: #999; padding: 20px;">暂无数据</div>';
+        return;
+    }
+
+    listElement.innerHTML = users.map(user => `
+        <div class="name-item">
+            <span>${user.name}</span>
+            <span style="color: #95a5a6;">${user.student_id}</span>
+        </div>
+    `).join('');
+}
+
+function startStatusRefresh() {
+    updateStatus();
+    statusTimer = setInterval(updateStatus, 3000);
+}
+
+function switchTab(tab) {
+    currentTab = tab;
+    document.querySelectorAll('.tab-btn').forEach(btn => btn.classList.remove('active'));
+    event.target.classList.add('active');
+
+    document.getElementById('checked-in-list').style.display = tab === 'checked-in' ? 'block' : 'none';
+    document.getElementById('not-checked-in-list').style.display = tab === 'not-checked-in' ? 'block' : 'none';
+}
@@ -0,0 +1,43 @@
+"""Re-scored ledger entries keep the time of the entries they replace"""
+import bulk
+import jobs
+
+MARCH_2024 = 1709514000000
+
+
+def _rescore(db, session_id, values):
+    job_id = bulk.queue_rescore(db, [session_id], values, dry_run=False)
+    assert jobs.run(db, job_id)['status'] == 'done'
+
+
+def test_revalued_entry_keeps_its_date(db, make_user, active_session):
+    user_id = make_user()
+    db.execute("INSERT INTO attendance_records (session_id, user_id, status) VALUES (?, ?, 'absent')",
+               (active_session, user_id))
+    db.execute('''
+        INSERT INTO points_records (user_id, points, reason, record_type, session_id)
+        VALUES (?, -2, '签到缺勤', 'absence', ?)
+    ''', (user_id, active_session))
+    # Rows written by the app only hold the 'LOCAL_TIMESTAMP' placeholder in created_at
+    db.execute('UPDATE points_records SET created_at_ms = ? WHERE session_id = ?', (MARCH_2024, active_session))
+    db.commit()
+
+    _rescore(db, active_session, {'absent': (-2, -3)})
+
+    live = db.execute('SELECT points, created_at_ms FROM points_records WHERE session_id = ? AND is_deleted = 0',
+                      (active_session,)).fetchall()
+    assert [tuple(row) for row in live] == [(-3.0, MARCH_2024)]
+
+
+def test_added_entry_takes_the_attendance_time(db, make_user, active_session):
+    user_id = make_user()
+    db.execute("INSERT INTO attendance_records (session_id, user_id, status) VALUES (?, ?, 'absent')",
+               (active_session, user_id))
+    db.execute('UPDATE attendance_records SET checked_in_at_ms = ? WHERE session_id = ?', (MARCH_2024, active_session))
+    db.commit()
+
+    _rescore(db, active_session, {'absent': (0, -1)})
+
+    live = db.execute('SELECT points, created_at_ms FROM points_records WHERE session_id = ? AND is_deleted = 0',
+                      (active_session,)).fetchall()
+    assert [tuple(row) for row in live] == [(-1.0, MARCH_2024)]
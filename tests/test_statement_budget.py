@@ -0,0 +1,69 @@
+"""Hot routes stay within their declared statement budgets"""
+import pytest
+
+
+def _qr_token(client, db, session_id):
+    """Rotate the session's QR code and return the token the screen would show"""
+    assert client.get(f'/api/qr/generate/{session_id}').get_json()['success']
+    return db.execute('SELECT qr_token FROM qr_codes WHERE session_id = ? ORDER BY id DESC LIMIT 1',
+                      (session_id,)).fetchone()[0]
+
+
+def test_qr_status(client, db, make_user, active_session, statement_budget):
+    for _ in range(5):
+        db.execute("INSERT INTO attendance_records (session_id, user_id, status) VALUES (?, ?, 'present')",
+                   (active_session, make_user()))
+    db.commit()
+
+    with statement_budget(8):
+        data = client.get(f'/api/qr/status/{active_session}').get_json()
+
+    assert data['success']
+    assert len(data['checked_in']) == 5
+
+
+def test_qr_generate(client, active_session, statement_budget):
+    with statement_budget(12):
+        assert client.get(f'/api/qr/generate/{active_session}').get_json()['success']
+
+
+def test_checkin(client, db, login, make_user, active_session, statement_budget):
+    token = _qr_token(client, db, active_session)
+    user_id = make_user()
+    login(client, user_id)
+
+    with statement_budget(24):
+        response = client.get(f'/checkin/{token}')
+
+    assert '签到成功' in response.get_data(as_text=True)
+    assert db.execute('SELECT status FROM attendance_records WHERE session_id = ? AND user_id = ?',
+                      (active_session, user_id)).fetchone()['status'] == 'present'
+
+    # Scanning again is answered without writing anything
+    with statement_budget(24):
+        response = client.get(f'/checkin/{token}')
+    assert '无需重复操作' in response.get_data(as_text=True)
+
+
+def test_admin_points(client, db, login, make_user, statement_budget):
+    admin_id = db.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    db.execute('UPDATE users SET must_change_password = 0 WHERE id = ?', (admin_id,))
+    for _ in range(3):
+        db.execute("INSERT INTO points_records (user_id, points, reason, record_type) VALUES (?, 1, '测试', 'manual')",
+                   (make_user(),))
+    db.commit()
+    login(client, admin_id)
+
+    with statement_budget(12):
+        assert client.get('/admin/points').status_code == 200
+    with statement_budget(10):
+        assert client.get('/admin/export/leave-history').status_code == 200
+
+
+def test_budget_checked_with_metrics_disabled(client, active_session, statement_budget, monkeypatch):
+    import instrumentation
+    monkeypatch.setattr(instrumentation, 'METRICS_ENABLED', False)
+
+    with pytest.raises(AssertionError, match='Statement budget exceeded'):
+        with statement_budget(1):
+            client.get(f'/api/qr/status/{active_session}')
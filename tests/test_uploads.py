@@ -0,0 +1,66 @@
+"""Attaching resumable uploads to a leave request"""
+import os
+import hashlib
+
+import pytest
+
+import attachments
+import media
+
+DATA = b'sick note ' * 100
+
+
+def _upload(client):
+    """Send DATA through the resumable upload API; returns the upload id"""
+    upload = client.post('/api/uploads', json={
+        'filename': 'note.pdf', 'size': len(DATA), 'sha256': hashlib.sha256(DATA).hexdigest()
+    }).get_json()
+    assert client.put(f"/api/uploads/{upload['upload_id']}?offset=0", data=DATA).status_code == 200
+    assert client.post(f"/api/uploads/{upload['upload_id']}/finalize").get_json()['status'] == 'complete'
+    return upload['upload_id']
+
+
+def _submit(client, upload_id):
+    return client.post('/leave/request', data={'leave_type': 'sick', 'reason': '发烧', 'upload_ids': upload_id})
+
+
+def _attachments(db, user_id):
+    return db.execute('''
+        SELECT la.sha256 FROM leave_attachments la
+        JOIN leave_requests lr ON lr.id = la.leave_request_id
+        WHERE lr.user_id = ?
+    ''', (user_id,)).fetchall()
+
+
+def test_second_submit_of_the_same_upload_is_refused(app, client, db, login, make_user):
+    user_id = make_user()
+    login(client, user_id)
+    upload_id = _upload(client)
+
+    assert _submit(client, upload_id).status_code == 302
+    again = _submit(client, upload_id)
+
+    assert again.status_code == 302
+    assert again.headers['Location'].endswith('/leave/request')
+    assert len(_attachments(db, user_id)) == 1
+    assert not os.path.exists(attachments.part_path(upload_id, app.config['UPLOAD_FOLDER']))
+    assert os.path.exists(attachments.blob_path(hashlib.sha256(DATA).hexdigest(), app.config['UPLOAD_FOLDER']))
+
+
+def test_failed_submit_keeps_the_upload(app, client, db, login, make_user, monkeypatch):
+    user_id = make_user()
+    login(client, user_id)
+    upload_id = _upload(client)
+
+    def fail(cursor, digest):
+        raise RuntimeError('media queue unavailable')
+    monkeypatch.setattr(media, 'enqueue', fail)
+    with pytest.raises(RuntimeError):
+        _submit(client, upload_id)
+    monkeypatch.undo()
+
+    assert os.path.exists(attachments.part_path(upload_id, app.config['UPLOAD_FOLDER']))
+    assert db.execute('SELECT status FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()['status'] == 'complete'
+
+    assert _submit(client, upload_id).headers['Location'].endswith('/')
+    assert len(_attachments(db, user_id)) == 1
@@ -2,7 +2,8 @@
 Timezone utilities for proper timezone handling
 """
 import os
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
 
 # Try to use zoneinfo (Python 3.9+), fallback to pytz
 try:
@@ -14,9 +15,11 @@ except ImportError:
 
 # Get timezone from environment variable
 TIMEZONE = os.getenv('TZ', 'Asia/Shanghai')
+DEFAULT_FORMAT = '%Y-%m-%d %H:%M:%S'
 
+@lru_cache(maxsize=None)
 def get_timezone():
-    """Get the configured timezone"""
+    """Get the configured timezone (built once per process)"""
     if USE_ZONEINFO:
         return ZoneInfo(TIMEZONE)
     else:
@@ -38,7 +41,7 @@ def to_local_time(dt):
     if USE_ZONEINFO:
         # If datetime is naive (no timezone), assume it's UTC from SQLite
         if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=ZoneInfo('UTC'))
+            dt = dt.replace(tzinfo=timezone.utc)
 
         # Convert to local timezone
         return dt.astimezone(get_timezone())
@@ -50,17 +53,100 @@ def to_local_time(dt):
 
         return dt.astimezone(get_timezone())
 
-def format_datetime(dt, format_str='%Y-%m-%d %H:%M:%S'):
+def localize(dt):
+    """Attach the configured timezone to a naive local datetime"""
+    if USE_ZONEINFO:
+        return dt.replace(tzinfo=get_timezone())
+    return get_timezone().localize(dt)
+
+def parse_timestamp(value):
+    """Parse a stored timestamp into an aware datetime
+
+    Accepts datetimes, ISO strings (with or without offset) and epoch
+    milliseconds. Naive values are local time, which is what
+    LOCAL_TIMESTAMP and the sessions created by tz_now() write.
+    Returns None for values that cannot be parsed.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return from_epoch_ms(value)
+    if isinstance(value, bytes):
+        value = value.decode()
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return localize(value) if value.tzinfo is None else value
+
+def epoch_ms(value=None):
+    """UTC epoch milliseconds of a timestamp (the current time by default)"""
+    dt = now() if value is None else parse_timestamp(value)
+    if dt is None:
+        return None
+    return int(dt.timestamp() * 1000)
+
+def from_epoch_ms(ms):
+    """Datetime in the configured timezone for UTC epoch milliseconds"""
+    if ms is None:
+        return None
+    return datetime.fromtimestamp(ms / 1000, get_timezone())
+
+@lru_cache(maxsize=8192)
+def _format_epoch_seconds(seconds, format_str):
+    return datetime.fromtimestamp(seconds, get_timezone()).strftime(format_str)
+
+def _format_epoch_ms(ms, format_str):
+    if '%f' in format_str:
+        return from_epoch_ms(ms).strftime(format_str)
+    # Rows written in the same second share one conversion
+    return _format_epoch_seconds(ms // 1000, format_str)
+
+@lru_cache(maxsize=4096)
+def _format_text(value, format_str):
+    try:
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return value
+    return to_local_time(dt).strftime(format_str)
+
+def format_datetimes(values, format_str=DEFAULT_FORMAT):
+    """Format a whole column of timestamps, converting each distinct value once"""
+    formatted = {}
+    result = []
+    for value in values:
+        if value not in formatted:
+            formatted[value] = format_datetime(value, format_str)
+        result.append(formatted[value])
+    return result
+
+def format_rows(rows, *columns, format_str=DEFAULT_FORMAT):
+    """Copy rows into dicts with a `<name>_display` string for each epoch-ms column
+
+    `<name>` is the column without its `_ms` suffix, e.g. `checked_in_at_ms`
+    becomes `checked_in_at_display`.
+    """
+    rows = [dict(row) for row in rows]
+    for column in columns:
+        key = (column[:-3] if column.endswith('_ms') else column) + '_display'
+        for row, text in zip(rows, format_datetimes([row[column] for row in rows], format_str)):
+            row[key] = text
+    return rows
+
+def format_datetime(dt, format_str=DEFAULT_FORMAT):
     """Format datetime to string in local timezone"""
     if dt is None:
         return ''
 
+    if isinstance(dt, int) and not isinstance(dt, bool):
+        # Epoch milliseconds (the *_ms columns)
+        return _format_epoch_ms(dt, format_str)
+
     if isinstance(dt, str):
-        # Try to parse string datetime
-        try:
-            dt = datetime.fromisoformat(dt.replace('Z', '+00:00'))
-        except:
-            return dt
+        return _format_text(dt, format_str)
 
     # Convert to local time if needed
     local_dt = to_local_time(dt)